@@ -1,34 +1,226 @@
 ﻿from __future__ import annotations
 
+import hashlib
+import json
+import logging
 import os
+import threading
 import time
-from dataclasses import dataclass
-from typing import Literal, Optional
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Literal, Optional, Sequence, Tuple, Union
 
 import numpy as np
-import torch
-import librosa
-import onnxruntime as ort
-from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 
-Backend = Literal["pytorch", "onnx", "onnx_int8"]
+from app.ctc import BeamSearchConfig, CTCBeamSearchDecoder, CTCGreedyDecoder, DecodeResult, WordTimestamp, load_vocab
+from app.features import FeatureConfig, NumpyFeatureExtractor
+from app.vad import VadConfig, detect_speech
+
+logger = logging.getLogger("asr")
+
+# Heavy dependencies are imported by the backend that needs them: ONNX
+# backends never load torch/transformers, the PyTorch one never loads ORT.
+if TYPE_CHECKING:
+  import onnxruntime as ort
+  from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+  from app.ort_config import OrtSessionConfig
+
+Backend = Literal["pytorch", "onnx", "onnx_opt", "onnx_fp16", "onnx_int8", "onnx_int8_static"]
+Decoder = Literal["greedy", "beam"]
+
+# ONNX file inside the model dir for each ONNX backend
+ONNX_FILES = {
+  "onnx": "model.onnx",
+  "onnx_opt": "model_opt.onnx",
+  "onnx_fp16": "model_fp16.onnx",
+  "onnx_int8": "model_int8.onnx",
+  "onnx_int8_static": "model_int8_static.onnx",
+}
+
+
+def onnx_file_for(backend: str) -> Optional[str]:
+  return ONNX_FILES.get(backend)
+
+
+def model_fingerprint(model_dir: str, backend: str) -> str:
+  """
+  Identifies the exact weights being served (file sizes + mtimes), so cached
+  transcripts are invalidated when a model dir is re-exported in place.
+  """
+  name = onnx_file_for(backend)
+  if name is not None:
+    paths = [os.path.join(model_dir, name)]
+  else:
+    paths = sorted(
+      os.path.join(model_dir, f)
+      for f in os.listdir(model_dir)
+      if f.endswith((".bin", ".safetensors", ".json"))
+    )
+  h = hashlib.sha1(backend.encode("utf-8"))
+  for path in paths:
+    st = os.stat(path)
+    h.update(f"|{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+  return h.hexdigest()[:16]
+
+
+@dataclass
+class Segment:
+  start: float
+  end: float
+  text: str
+  words: Optional[List[WordTimestamp]] = None
 
 
 @dataclass
 class TranscribeResult:
   text: str
   inference_time: float
+  words: Optional[List[WordTimestamp]] = None
+  # set when the VAD pre-stage ran: speech regions only, times in the full recording
+  segments: Optional[List[Segment]] = None
+  speech_ratio: Optional[float] = None
+
+
+# (stage, variant name, seconds); app/metrics.py registers a Prometheus observer
+StageObserver = Callable[[str, str, float], None]
+_stage_observers: List[StageObserver] = []
+
+
+def add_stage_observer(fn: StageObserver) -> None:
+  _stage_observers.append(fn)
+
+
+@contextmanager
+def stage_timer(stage: str, backend: str) -> Iterator[None]:
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    elapsed = time.perf_counter() - start
+    for fn in _stage_observers:
+      fn(stage, backend, elapsed)
+
+
+def _ffmpeg_decode(path: str) -> Tuple[np.ndarray, int]:
+  import subprocess
 
+  cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", path, "-f", "f32le", "-ac", "1", "-ar", "16000", "-"]
+  out = subprocess.run(cmd, capture_output=True, check=True).stdout
+  return np.frombuffer(out, dtype=np.float32).copy(), 16_000
 
-def _load_audio_to_16k_mono(path: str) -> np.ndarray:
-  # librosa can read wav/mp3 (mp3 typically needs ffmpeg in the system)
-  audio, sr = librosa.load(path, sr=16_000, mono=True)
+
+def decode_audio(path: str) -> Tuple[np.ndarray, int]:
+  """
+  Mono float32 at the file's own rate. libsndfile covers wav/flac/ogg (and mp3
+  on recent builds); anything else (m4a, ...) goes through the ffmpeg binary,
+  or librosa/audioread where ffmpeg is not on PATH.
+  """
+  import soundfile as sf
+
+  try:
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    return audio.mean(axis=1), int(sr)
+  except RuntimeError:  # sf.LibsndfileError on newer soundfile
+    pass
+
+  import shutil
+
+  if shutil.which("ffmpeg"):
+    return _ffmpeg_decode(path)
+  import librosa
+
+  audio, sr = librosa.load(path, sr=None, mono=True)
+  return audio, int(sr)
+
+
+def resample_audio(audio: np.ndarray, sr: int) -> np.ndarray:
+  if sr != 16_000:
+    # same resampler librosa uses by default (soxr_hq), without importing librosa
+    import soxr
+
+    audio = soxr.resample(audio, sr, 16_000, quality="HQ")
   # ensure float32
   if audio.dtype != np.float32:
     audio = audio.astype(np.float32)
   return audio
 
 
+def load_audio(path: str) -> np.ndarray:
+  audio, sr = decode_audio(path)
+  return resample_audio(audio, sr)
+
+
+# wav2vec2 conv feature encoder defaults: (kernel, stride) per layer
+_DEFAULT_CONV_KERNEL = (10, 3, 3, 3, 3, 2, 2)
+_DEFAULT_CONV_STRIDE = (5, 2, 2, 2, 2, 2, 2)
+
+
+@dataclass(frozen=True)
+class FrameGeometry:
+  """Maps audio samples to logit frames through the conv feature encoder."""
+
+  kernels: Tuple[int, ...] = _DEFAULT_CONV_KERNEL
+  strides: Tuple[int, ...] = _DEFAULT_CONV_STRIDE
+  sampling_rate: int = 16_000
+
+  @classmethod
+  def from_model_dir(cls, model_dir: str) -> "FrameGeometry":
+    cfg_path = os.path.join(model_dir, "config.json")
+    if not os.path.exists(cfg_path):
+      return cls()
+    with open(cfg_path, "r", encoding="utf-8") as f:
+      cfg = json.load(f)
+    return cls(
+      kernels=tuple(cfg.get("conv_kernel") or _DEFAULT_CONV_KERNEL),
+      strides=tuple(cfg.get("conv_stride") or _DEFAULT_CONV_STRIDE),
+    )
+
+  @property
+  def frame_seconds(self) -> float:
+    # 320 samples = 20 ms for every wav2vec2 config we ship
+    return int(np.prod(self.strides)) / self.sampling_rate
+
+  def num_frames(self, n_samples: int) -> int:
+    n = n_samples
+    for k, st in zip(self.kernels, self.strides):
+      n = (n - k) // st + 1
+    return max(0, n)
+
+
+def load_length_buckets(model_dir: str, masked: bool = False) -> Tuple[List[int], Dict[str, Dict[int, str]]]:
+  """
+  Input-length buckets (in samples) written by `scripts/export.py --length_buckets`,
+  plus any fixed-shape model files per backend. ASR_LENGTH_BUCKETS (seconds,
+  comma-separated) overrides the boundaries and pads for the dynamic model only.
+
+  The override skips the padding parity check export runs, so it is only
+  honoured when the model masks the padding (`masked`: the graph takes an
+  attention_mask and the feature extractor produces one); otherwise the
+  zeros would go through group norm and attention and change transcripts.
+  """
+  env = os.getenv("ASR_LENGTH_BUCKETS", "").strip()
+  if env and masked:
+    return sorted(int(float(x) * 16_000) for x in env.split(",") if x.strip()), {}
+  if env:
+    logger.warning(
+      "ASR_LENGTH_BUCKETS ignored for %s: the model takes no attention_mask, so padding would change "
+      "its output (export with --length_buckets to run the parity check)",
+      model_dir,
+    )
+
+  path = os.path.join(model_dir, "buckets.json")
+  if not os.path.exists(path):
+    return [], {}
+  with open(path, "r", encoding="utf-8") as f:
+    meta = json.load(f)
+  files = {
+    backend: {int(n): name for n, name in per_backend.items()}
+    for backend, per_backend in meta.get("files", {}).items()
+  }
+  return sorted(int(n) for n in meta["buckets"]), files
+
+
 class ASRService:
   """
   Minimal ASR service with interchangeable backends:
@@ -42,24 +234,34 @@ class ASRService:
     model_dir: str,
     backend: Backend = "onnx_int8",
     device: Optional[str] = None,
+    beam_config: Optional[BeamSearchConfig] = None,
+    session_config: Optional[OrtSessionConfig] = None,
+    processor: Optional[Wav2Vec2Processor] = None,
+    vad_config: Optional[VadConfig] = None,
+    variant: Optional[str] = None,
   ) -> None:
-    self.model_dir = model_dir
-    self.backend: Backend = backend
-    self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    if backend != "pytorch" and onnx_file_for(backend) is None:
+      raise ValueError(f"Unknown ASR backend: {backend}")
+    self._init_frontend(model_dir, backend, processor, beam_config, vad_config, variant)
+    self.device = device or "cpu"
 
-    # Processor is needed for feature extraction & decoding.
-    # We keep processor in the same checkpoint folder OR in onnx folder (export script copies config).
-    self.processor = Wav2Vec2Processor.from_pretrained(model_dir)
+    if backend == "pytorch":
+      import torch
+      from transformers import Wav2Vec2ForCTC
 
-    self._pt_model: Optional[Wav2Vec2ForCTC] = None
-    self._ort_session: Optional[ort.InferenceSession] = None
+      from app.pruning import is_pruned_dir, load_pruned
 
-    if backend == "pytorch":
-      self._pt_model = Wav2Vec2ForCTC.from_pretrained(model_dir).to(self.device)
+      self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+      # scripts/prune.py output: layer widths differ, so from_pretrained cannot rebuild it
+      model = load_pruned(model_dir) if is_pruned_dir(model_dir) else Wav2Vec2ForCTC.from_pretrained(model_dir)
+      self._pt_model = model.to(self.device)
       self._pt_model.eval()
     else:
-      onnx_name = "model_int8.onnx" if backend == "onnx_int8" else "model.onnx"
-      onnx_path = os.path.join(model_dir, onnx_name)
+      import onnxruntime as ort
+
+      from app.ort_config import OrtSessionConfig
+
+      onnx_path = os.path.join(model_dir, onnx_file_for(backend) or "")
       if not os.path.exists(onnx_path):
         raise FileNotFoundError(f"ONNX model not found: {onnx_path}")
 
@@ -68,39 +270,271 @@ class ASRService:
       if ort.get_device().lower() == "gpu":
         providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
 
-      self._ort_session = ort.InferenceSession(onnx_path, providers=providers)
+      self.session_config = session_config or OrtSessionConfig.from_env()
+      self._ort_session = self.session_config.create_session(onnx_path, providers)
       self._ort_input_names = {i.name for i in self._ort_session.get_inputs()}
 
-  def transcribe_file(self, audio_path: str) -> TranscribeResult:
-    audio = _load_audio_to_16k_mono(audio_path)
+      # Length buckets: inputs are zero-padded up to the nearest bucket so ORT
+      # sees a handful of shapes; fixed-shape bucket models are used if exported.
+      masked = "attention_mask" in self._ort_input_names and self.features.config.return_attention_mask
+      self.buckets, bucket_files = load_length_buckets(model_dir, masked)
+      for n, name in bucket_files.get(backend, {}).items():
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+          self._bucket_sessions[n] = self.session_config.create_session(path, providers)
 
-    # Feature extraction
-    inputs = self.processor(audio, sampling_rate=16_000, return_tensors="pt", padding=True)
-    input_values = inputs.input_values  # [1, T]
-    attention_mask = getattr(inputs, "attention_mask", None)
+    # part of the transcription cache key (see app/cache.py)
+    self.fingerprint = model_fingerprint(model_dir, backend)
 
-    start = time.perf_counter()
+  def _init_frontend(
+    self,
+    model_dir: str,
+    backend: Backend,
+    processor: Optional[Wav2Vec2Processor],
+    beam_config: Optional[BeamSearchConfig],
+    vad_config: Optional[VadConfig],
+    variant: Optional[str] = None,
+  ) -> None:
+    """Everything except the acoustic model: features, decoding, VAD (shared with app/serving.py)."""
+    self.model_dir = model_dir
+    self.backend: Backend = backend
+    # registry name; the `backend` label of the stage metrics, same as the API uses
+    self.variant = variant or backend
+
+    # Features and vocab come straight from the processor files the export
+    # script saves next to the model (NumPy only, no torch/transformers).
+    has_files = all(
+      os.path.exists(os.path.join(model_dir, name)) for name in ("preprocessor_config.json", "vocab.json")
+    )
+    if processor is None and has_files:
+      self.features = NumpyFeatureExtractor.from_model_dir(model_dir)
+      self.vocab, blank_token, delimiter = load_vocab(model_dir)
+    else:
+      # hub ids / folders without processor files
+      if processor is None:
+        from transformers import Wav2Vec2Processor
+
+        processor = Wav2Vec2Processor.from_pretrained(model_dir)
+      self.features = NumpyFeatureExtractor(FeatureConfig.from_feature_extractor(processor.feature_extractor))
+      tokenizer = processor.tokenizer
+      self.vocab = tokenizer.get_vocab()
+      blank_token = tokenizer.pad_token
+      delimiter = getattr(tokenizer, "word_delimiter_token", None) or "|"
+
+    # Decoding runs on a precomputed id->char table, not the HF tokenizer.
+    self.geometry = FrameGeometry.from_model_dir(model_dir)
+    self.frame_seconds = self.geometry.frame_seconds
+    self.decoder = CTCGreedyDecoder(self.vocab, blank_token, delimiter, frame_seconds=self.frame_seconds)
+
+    # Beam search decoder (and its process pool) is built on first use.
+    self.beam_config = beam_config or BeamSearchConfig.from_env()
+    self._beam_decoder: Optional[CTCBeamSearchDecoder] = None
+    self._beam_lock = threading.Lock()
+    self.vad_config = vad_config or VadConfig.from_env()
+
+    self._pt_model: Optional[Wav2Vec2ForCTC] = None
+    self._ort_session: Optional[ort.InferenceSession] = None
+    self._bucket_sessions: Dict[int, ort.InferenceSession] = {}
+    self.buckets: List[int] = []
+
+  @property
+  def beam_decoder(self) -> CTCBeamSearchDecoder:
+    if self._beam_decoder is None:
+      with self._beam_lock:
+        if self._beam_decoder is None:
+          self._beam_decoder = CTCBeamSearchDecoder(
+            vocab=self.vocab,
+            config=self.beam_config,
+            frame_seconds=self.frame_seconds,
+          )
+    return self._beam_decoder
+
+  def extract_features(
+    self, audio: Union[np.ndarray, Sequence[np.ndarray]]
+  ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    # a list of clips is padded to the longest one -> [B, T]; arrays live in
+    # reusable per-thread buffers (see app/features.py)
+    return self.features(audio)
+
+  def infer(self, input_values: np.ndarray, attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
     if self.backend == "pytorch":
+      import torch
+
       assert self._pt_model is not None
       with torch.no_grad():
-        input_values_dev = input_values.to(self.device)
-        attn_dev = attention_mask.to(self.device) if attention_mask is not None else None
+        input_values_dev = torch.from_numpy(input_values).to(self.device)
+        attn_dev = torch.from_numpy(attention_mask).to(self.device) if attention_mask is not None else None
         out = self._pt_model(input_values_dev, attention_mask=attn_dev)
-        logits = out.logits.detach().cpu().numpy()
-    else:
-      assert self._ort_session is not None
-      ort_inputs = {"input_values": np.ascontiguousarray(input_values.numpy())}
+        return out.logits.detach().cpu().numpy()
+
+    assert self._ort_session is not None
+    values = input_values
+    mask = attention_mask
 
-      # Only send attention_mask if the model actually expects it
-      if attention_mask is not None and "attention_mask" in self._ort_input_names:
-        ort_inputs["attention_mask"] = np.ascontiguousarray(attention_mask.numpy())
+    n = values.shape[1]
+    bucket = next((b for b in self.buckets if b >= n), None)
+    session = self._ort_session
+    if bucket is not None:
+      session = self._bucket_sessions.get(bucket, self._ort_session)
+      if bucket > n:
+        values = np.pad(values, ((0, 0), (0, bucket - n)))
+        if mask is not None:
+          mask = np.pad(mask, ((0, 0), (0, bucket - n)))
 
-      ort_outs = self._ort_session.run(None, ort_inputs)
-      # Usually first output is logits
-      logits = ort_outs[0]
+    ort_inputs = {"input_values": np.ascontiguousarray(values)}
+
+    # Only send attention_mask if the model actually expects it
+    if mask is not None and "attention_mask" in self._ort_input_names:
+      ort_inputs["attention_mask"] = np.ascontiguousarray(mask)
+
+    ort_outs = session.run(None, ort_inputs)
+    # Usually first output is logits; drop frames that only cover bucket padding
+    logits = ort_outs[0]
+    if bucket is not None and bucket > n:
+      logits = logits[:, :self.geometry.num_frames(n)]
+    return logits
+
+  def decode(
+    self,
+    logits: np.ndarray,
+    with_timestamps: bool = False,
+    decoder: Decoder = "greedy",
+    beam_width: Optional[int] = None,
+    hotwords: Optional[List[str]] = None,
+  ) -> DecodeResult:
+    if decoder == "beam":
+      return self.beam_decoder.decode(
+        logits,
+        with_timestamps=with_timestamps,
+        beam_width=beam_width,
+        hotwords=hotwords,
+      )[0]
+    return self.decoder.decode(logits, with_timestamps=with_timestamps)[0]
+
+  def transcribe_audio(
+    self,
+    audio: np.ndarray,
+    with_timestamps: bool = False,
+    decoder: Decoder = "greedy",
+    beam_width: Optional[int] = None,
+    hotwords: Optional[List[str]] = None,
+    vad: Optional[bool] = None,
+  ) -> TranscribeResult:
+    vad_cfg = self.effective_vad(vad)
+    if vad_cfg is not None:
+      return self._transcribe_segments(audio, vad_cfg, with_timestamps, decoder, beam_width, hotwords)
+
+    with stage_timer("features", self.variant):
+      input_values, attention_mask = self.extract_features(audio)
+
+    start = time.perf_counter()
+    with stage_timer("inference", self.variant):
+      logits = self.infer(input_values, attention_mask)
     elapsed = time.perf_counter() - start
 
-    pred_ids = np.argmax(logits, axis=-1)
-    text = self.processor.batch_decode(pred_ids)[0]
+    with stage_timer("ctc_decode", self.variant):
+      decoded = self.decode(
+        logits,
+        with_timestamps=with_timestamps,
+        decoder=decoder,
+        beam_width=beam_width,
+        hotwords=hotwords,
+      )
+    return TranscribeResult(text=decoded.text, inference_time=float(elapsed), words=decoded.words)
+
+  def effective_vad(self, vad: Optional[bool]) -> Optional[VadConfig]:
+    """VAD config a request runs with (None = whole clip); vad=True without ASR_VAD uses the energy detector."""
+    if not (self.vad_config.enabled if vad is None else vad):
+      return None
+    return self.vad_config if self.vad_config.enabled else replace(self.vad_config, mode="energy")
+
+  def _transcribe_segments(
+    self,
+    audio: np.ndarray,
+    cfg: VadConfig,
+    with_timestamps: bool,
+    decoder: Decoder,
+    beam_width: Optional[int],
+    hotwords: Optional[List[str]],
+  ) -> TranscribeResult:
+    """VAD pre-stage: only speech regions go through the model, batched by similar length."""
+    sr = cfg.sampling_rate
+    with stage_timer("vad", self.variant):
+      spans = detect_speech(audio, cfg)
+
+    order = sorted(range(len(spans)), key=lambda i: spans[i][1] - spans[i][0])
+    seg_logits: Dict[int, np.ndarray] = {}
+    elapsed = 0.0
+    batch_size = max(1, cfg.batch_size)  # ASR_VAD_BATCH=0 -> one segment per call
+    for b in range(0, len(order), batch_size):
+      idx = order[b:b + batch_size]
+      clips = [audio[spans[i][0]:spans[i][1]] for i in idx]
+      with stage_timer("features", self.variant):
+        input_values, attention_mask = self.extract_features(clips)
+      start = time.perf_counter()
+      with stage_timer("inference", self.variant):
+        logits = self.infer(input_values, attention_mask)
+      elapsed += time.perf_counter() - start
+      for row, i in enumerate(idx):
+        # drop frames that only cover batch padding
+        seg_logits[i] = logits[row:row + 1, :self.geometry.num_frames(len(clips[row]))]
+
+    segments: List[Segment] = []
+    for i, (s, e) in enumerate(spans):
+      with stage_timer("ctc_decode", self.variant):
+        decoded = self.decode(
+          seg_logits[i],
+          with_timestamps=with_timestamps,
+          decoder=decoder,
+          beam_width=beam_width,
+          hotwords=hotwords,
+        )
+      offset = s / sr
+      words = None
+      if decoded.words is not None:
+        words = [
+          WordTimestamp(word=w.word, start=round(w.start + offset, 3), end=round(w.end + offset, 3))
+          for w in decoded.words
+        ]
+      segments.append(Segment(start=round(s / sr, 3), end=round(e / sr, 3), text=decoded.text, words=words))
+
+    speech = sum(e - s for s, e in spans)
+    return TranscribeResult(
+      text=" ".join(seg.text for seg in segments if seg.text),
+      inference_time=float(elapsed),
+      words=[w for seg in segments for w in (seg.words or [])] if with_timestamps else None,
+      segments=segments,
+      speech_ratio=round(speech / len(audio), 4) if len(audio) else 0.0,
+    )
+
+  def transcribe_file(self, audio_path: str, **kwargs) -> TranscribeResult:
+    with stage_timer("decode", self.variant):
+      audio, sr = decode_audio(audio_path)
+    with stage_timer("resample", self.variant):
+      audio = resample_audio(audio, sr)
+    return self.transcribe_audio(audio, **kwargs)
+
+  def close(self) -> None:
+    """Release model/session memory (called when a registry variant is retired)."""
+    if self._beam_decoder is not None:
+      self._beam_decoder.close()
+      self._beam_decoder = None
+    self._ort_session = None
+    self._bucket_sessions = {}
+    self._pt_model = None
 
-    return TranscribeResult(text=text, inference_time=float(elapsed))
\ No newline at end of file
+  def warmup(self, durations: Sequence[float] = (1.0, 5.0, 15.0)) -> Dict[str, float]:
+    """
+    Run inference at a few representative lengths so first-run costs (graph
+    optimization, arena growth, kernel selection) are paid before serving.
+    Every length bucket is warmed up as well. Returns seconds spent per length.
+    """
+    durations = sorted(set(durations) | {n / 16_000 for n in self.buckets})
+    rng = np.random.default_rng(0)
+    timings: Dict[str, float] = {}
+    for sec in durations:
+      audio = (0.01 * rng.standard_normal(int(sec * 16_000))).astype(np.float32)
+      start = time.perf_counter()
+      self.transcribe_audio(audio)
+      timings[f"{sec:g}s"] = round(time.perf_counter() - start, 4)
+    return timings
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def cache_key(audio: bytes, variant: str, fingerprint: str, settings: Dict[str, Any]) -> str:
+  """Content address: audio bytes + model variant/fingerprint + decode settings."""
+  h = hashlib.sha256(audio)
+  h.update(b"\0" + variant.encode("utf-8"))
+  h.update(b"\0" + fingerprint.encode("utf-8"))
+  h.update(b"\0" + json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+  return h.hexdigest()
+
+
+@dataclass
+class CacheStats:
+  memory_hits: int = 0
+  disk_hits: int = 0
+  misses: int = 0
+  evictions: int = 0
+
+
+@dataclass
+class TranscriptionCache:
+  """
+  Two-tier result cache: an in-memory LRU (entries) in front of an optional
+  on-disk JSON store bounded by size. Disk entries are evicted oldest-first by
+  mtime, which is refreshed on every hit.
+  """
+
+  max_entries: int = 1024
+  disk_dir: Optional[str] = None
+  disk_max_bytes: int = 1024 * 1024 * 1024
+  stats: CacheStats = field(default_factory=CacheStats)
+
+  def __post_init__(self) -> None:
+    self._lock = threading.Lock()
+    self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    self._disk_bytes = 0
+    if self.disk_dir:
+      os.makedirs(self.disk_dir, exist_ok=True)
+      self._disk_bytes = sum(size for _, _, size in self._disk_files())
+
+  @classmethod
+  def from_env(cls) -> "TranscriptionCache":
+    return cls(
+      max_entries=int(os.getenv("ASR_CACHE_SIZE", "1024")),
+      disk_dir=os.getenv("ASR_CACHE_DIR", "").strip() or None,
+      disk_max_bytes=int(float(os.getenv("ASR_CACHE_DISK_MB", "1024")) * 1024 * 1024),
+    )
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_entries > 0 or self.disk_dir is not None
+
+  def _path(self, key: str) -> str:
+    assert self.disk_dir is not None
+    return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+  def _disk_files(self) -> List[Tuple[float, str, int]]:
+    out = []
+    for root, _, files in os.walk(self.disk_dir or ""):
+      for name in files:
+        if not name.endswith(".json"):
+          continue
+        path = os.path.join(root, name)
+        try:
+          st = os.stat(path)
+        except FileNotFoundError:
+          continue
+        out.append((st.st_mtime, path, st.st_size))
+    return out
+
+  def _remember(self, key: str, value: Dict[str, Any]) -> None:
+    # caller holds self._lock
+    if self.max_entries <= 0:
+      return
+    self._memory[key] = value
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.max_entries:
+      self._memory.popitem(last=False)
+      self.stats.evictions += 1
+
+  def get(self, key: str) -> Optional[Dict[str, Any]]:
+    with self._lock:
+      value = self._memory.get(key)
+      if value is not None:
+        self._memory.move_to_end(key)
+        self.stats.memory_hits += 1
+        return value
+
+    if self.disk_dir:
+      path = self._path(key)
+      try:
+        with open(path, "r", encoding="utf-8") as f:
+          value = json.load(f)
+        os.utime(path)
+      except (FileNotFoundError, json.JSONDecodeError):
+        value = None
+      if value is not None:
+        with self._lock:
+          self._remember(key, value)
+          self.stats.disk_hits += 1
+        return value
+
+    with self._lock:
+      self.stats.misses += 1
+    return None
+
+  def put(self, key: str, value: Dict[str, Any]) -> None:
+    with self._lock:
+      self._remember(key, value)
+    if not self.disk_dir:
+      return
+
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+      f.write(data)
+    with self._lock:
+      try:
+        old_size = os.path.getsize(path)  # overwrite: count only the difference
+      except FileNotFoundError:
+        old_size = 0
+      os.replace(tmp, path)
+      self._disk_bytes += len(data) - old_size
+      if self._disk_bytes > self.disk_max_bytes:
+        self._evict_disk()
+
+  def _evict_disk(self) -> None:
+    # caller holds self._lock; trim to 90% so eviction does not run on every put
+    files = sorted(self._disk_files())
+    total = sum(size for _, _, size in files)
+    target = int(self.disk_max_bytes * 0.9)
+    for _, path, size in files:
+      if total <= target:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+      self.stats.evictions += 1
+    self._disk_bytes = total
+
+  def clear(self) -> None:
+    with self._lock:
+      self._memory.clear()
+      if self.disk_dir:
+        for _, path, _ in self._disk_files():
+          try:
+            os.remove(path)
+          except FileNotFoundError:
+            pass
+        self._disk_bytes = 0
+
+  def describe(self) -> Dict[str, Any]:
+    with self._lock:
+      return {
+        "memory_entries": len(self._memory),
+        "max_entries": self.max_entries,
+        "disk_dir": self.disk_dir,
+        "disk_mb": round(self._disk_bytes / (1024 * 1024), 2),
+        "disk_max_mb": round(self.disk_max_bytes / (1024 * 1024), 2),
+        "memory_hits": self.stats.memory_hits,
+        "disk_hits": self.stats.disk_hits,
+        "misses": self.stats.misses,
+        "evictions": self.stats.evictions,
+      }
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass
+class WordTimestamp:
+  word: str
+  start: float  # seconds
+  end: float  # seconds
+
+
+@dataclass
+class DecodeResult:
+  text: str
+  words: Optional[List[WordTimestamp]] = None
+
+
+def load_vocab(model_dir: str) -> Tuple[Dict[str, int], str, str]:
+  """
+  (token -> id, blank token, word delimiter) from the tokenizer files next to
+  the model, so decoding needs neither transformers nor the HF tokenizer.
+  """
+  with open(os.path.join(model_dir, "vocab.json"), "r", encoding="utf-8") as f:
+    vocab = json.load(f)
+  if vocab and all(isinstance(v, dict) for v in vocab.values()):
+    # multilingual tokenizers nest one vocab per language
+    if len(vocab) != 1:
+      raise ValueError(f"{model_dir}/vocab.json has several languages: {sorted(vocab)}")
+    vocab = next(iter(vocab.values()))
+
+  added = os.path.join(model_dir, "added_tokens.json")
+  if os.path.exists(added):
+    with open(added, "r", encoding="utf-8") as f:
+      vocab.update(json.load(f))
+
+  cfg: Dict = {}
+  for name in ("tokenizer_config.json", "special_tokens_map.json"):
+    path = os.path.join(model_dir, name)
+    if os.path.exists(path):
+      with open(path, "r", encoding="utf-8") as f:
+        cfg.update(json.load(f))
+
+  def token(key: str, default: str) -> str:
+    value = cfg.get(key) or default
+    return value["content"] if isinstance(value, dict) else value
+
+  return vocab, token("pad_token", "<pad>"), token("word_delimiter_token", "|")
+
+
+class CTCGreedyDecoder:
+  """
+  NumPy CTC greedy decoder (no tokenizer on the hot path).
+
+  The id -> string table is built once from the tokenizer vocab, then each
+  decode is: collapse repeats -> drop blanks -> table lookup. Word timestamps
+  come from the frame indices of the surviving tokens.
+  """
+
+  def __init__(
+    self,
+    vocab: Dict[str, int],
+    blank_token: str = "<pad>",
+    word_delimiter_token: str = "|",
+    frame_seconds: float = 0.02,
+  ) -> None:
+    size = max(vocab.values()) + 1
+    table = np.empty(size, dtype=object)
+    table[:] = ""
+    for tok, idx in vocab.items():
+      table[idx] = tok
+
+    self.blank_id = vocab[blank_token]
+    self.delimiter_id = vocab.get(word_delimiter_token, -1)
+    table[self.blank_id] = ""
+    if self.delimiter_id >= 0:
+      table[self.delimiter_id] = " "
+
+    self.table = table
+    self.frame_seconds = frame_seconds
+
+  @classmethod
+  def from_tokenizer(cls, tokenizer, frame_seconds: float = 0.02) -> "CTCGreedyDecoder":
+    return cls(
+      vocab=tokenizer.get_vocab(),
+      blank_token=tokenizer.pad_token,
+      word_delimiter_token=getattr(tokenizer, "word_delimiter_token", None) or "|",
+      frame_seconds=frame_seconds,
+    )
+
+  def _collapse(self, ids: np.ndarray):
+    # one entry per run of identical ids, then drop blank runs
+    change = ids[1:] != ids[:-1]
+    run_start = np.flatnonzero(np.r_[True, change])
+    run_end = np.flatnonzero(np.r_[change, True])
+    tokens = ids[run_start]
+    keep = tokens != self.blank_id
+    return tokens[keep], run_start[keep], run_end[keep]
+
+  def decode_ids(self, ids: np.ndarray, with_timestamps: bool = False) -> DecodeResult:
+    ids = np.asarray(ids)
+    if ids.size == 0:
+      return DecodeResult(text="", words=[] if with_timestamps else None)
+    tokens, first, last = self._collapse(ids)
+    text = " ".join("".join(self.table[tokens]).split())
+    if not with_timestamps:
+      return DecodeResult(text=text)
+    return DecodeResult(text=text, words=self._word_timestamps(tokens, first, last))
+
+  def decode(self, logits: np.ndarray, with_timestamps: bool = False) -> List[DecodeResult]:
+    """
+    logits: [B, T, V] (or [T, V]) -> one DecodeResult per row.
+    """
+    if logits.ndim == 2:
+      logits = logits[None]
+    pred_ids = np.argmax(logits, axis=-1)
+    return [self.decode_ids(row, with_timestamps=with_timestamps) for row in pred_ids]
+
+  def _word_timestamps(self, tokens: np.ndarray, first: np.ndarray, last: np.ndarray) -> List[WordTimestamp]:
+    is_delim = tokens == self.delimiter_id
+    chars = ~is_delim
+    if not chars.any():
+      return []
+
+    # word index of every non-delimiter token
+    word_idx = np.cumsum(is_delim)[chars]
+    char_tokens = tokens[chars]
+    char_first = first[chars]
+    char_last = last[chars]
+
+    starts = np.flatnonzero(np.r_[True, word_idx[1:] != word_idx[:-1]])
+    ends = np.r_[starts[1:], word_idx.shape[0]]
+
+    start_s = char_first[starts] * self.frame_seconds
+    end_s = (char_last[ends - 1] + 1) * self.frame_seconds
+
+    return [
+      WordTimestamp(
+        word="".join(self.table[char_tokens[s:e]]),
+        start=round(float(t0), 3),
+        end=round(float(t1), 3),
+      )
+      for s, e, t0, t1 in zip(starts, ends, start_s, end_s)
+    ]
+
+
+@dataclass
+class BeamSearchConfig:
+  beam_width: int = 32
+  kenlm_path: Optional[str] = None  # .arpa or KenLM binary
+  alpha: float = 0.5  # LM weight
+  beta: float = 1.0  # word insertion bonus
+  hotwords: Tuple[str, ...] = field(default_factory=tuple)
+  hotword_weight: float = 10.0
+  workers: int = 2  # 0 -> decode in the calling process
+
+  @classmethod
+  def from_env(cls) -> "BeamSearchConfig":
+    hotwords = os.getenv("ASR_HOTWORDS", "").strip()
+    return cls(
+      beam_width=int(os.getenv("ASR_BEAM_WIDTH", "32")),
+      kenlm_path=os.getenv("ASR_LM_PATH", "").strip() or None,
+      alpha=float(os.getenv("ASR_LM_ALPHA", "0.5")),
+      beta=float(os.getenv("ASR_LM_BETA", "1.0")),
+      hotwords=tuple(w.strip() for w in hotwords.split(",") if w.strip()),
+      hotword_weight=float(os.getenv("ASR_HOTWORD_WEIGHT", "10.0")),
+      workers=int(os.getenv("ASR_BEAM_WORKERS", "2")),
+    )
+
+
+# One pyctcdecode decoder per pool process (KenLM models are not picklable).
+_WORKER_DECODER = None
+
+
+def _build_pyctcdecoder(labels: List[str], kenlm_path: Optional[str], alpha: float, beta: float):
+  try:
+    from pyctcdecode import build_ctcdecoder
+  except ImportError as e:
+    raise RuntimeError("Beam search needs `pyctcdecode` (and `kenlm` for LM fusion).") from e
+  return build_ctcdecoder(labels, kenlm_model_path=kenlm_path, alpha=alpha, beta=beta)
+
+
+def _init_beam_worker(labels: List[str], kenlm_path: Optional[str], alpha: float, beta: float) -> None:
+  global _WORKER_DECODER
+  _WORKER_DECODER = _build_pyctcdecoder(labels, kenlm_path, alpha, beta)
+
+
+def _log_softmax(logits: np.ndarray) -> np.ndarray:
+  shifted = logits - logits.max(axis=-1, keepdims=True)
+  return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+def _beam_decode(
+  decoder,
+  log_probs: np.ndarray,
+  beam_width: int,
+  hotwords: Sequence[str],
+  hotword_weight: float,
+  frame_seconds: float,
+  with_timestamps: bool,
+) -> DecodeResult:
+  beams = decoder.decode_beams(
+    log_probs,
+    beam_width=beam_width,
+    hotwords=list(hotwords) or None,
+    hotword_weight=hotword_weight,
+  )
+  text, _, word_frames = beams[0][:3]
+  text = " ".join(text.split())
+  if not with_timestamps:
+    return DecodeResult(text=text)
+  words = [
+    WordTimestamp(word=w, start=round(s * frame_seconds, 3), end=round(e * frame_seconds, 3))
+    for w, (s, e) in word_frames
+  ]
+  return DecodeResult(text=text, words=words)
+
+
+def _beam_decode_job(*args) -> DecodeResult:
+  return _beam_decode(_WORKER_DECODER, *args)
+
+
+class CTCBeamSearchDecoder:
+  """
+  CTC prefix beam search (pyctcdecode) with optional KenLM shallow fusion and
+  hotword boosting.
+
+  Beam search is pure Python and GIL-bound, so it runs on a process pool:
+  inference for other requests keeps going while a beam decode is in flight.
+  """
+
+  def __init__(
+    self,
+    vocab: Dict[str, int],
+    config: BeamSearchConfig,
+    frame_seconds: float = 0.02,
+  ) -> None:
+    # pyctcdecode maps "<pad>" -> blank and "|" -> space on its own
+    labels = [tok for tok, _ in sorted(vocab.items(), key=lambda kv: kv[1])]
+    self.config = config
+    self.frame_seconds = frame_seconds
+
+    self._local = None
+    self._pool: Optional[ProcessPoolExecutor] = None
+    init_args = (labels, config.kenlm_path, config.alpha, config.beta)
+    if config.workers > 0:
+      self._pool = ProcessPoolExecutor(
+        max_workers=config.workers,
+        initializer=_init_beam_worker,
+        initargs=init_args,
+      )
+    else:
+      self._local = _build_pyctcdecoder(*init_args)
+
+  @classmethod
+  def from_tokenizer(cls, tokenizer, config: BeamSearchConfig, frame_seconds: float = 0.02) -> "CTCBeamSearchDecoder":
+    return cls(vocab=tokenizer.get_vocab(), config=config, frame_seconds=frame_seconds)
+
+  def decode(
+    self,
+    logits: np.ndarray,
+    with_timestamps: bool = False,
+    beam_width: Optional[int] = None,
+    hotwords: Optional[Sequence[str]] = None,
+  ) -> List[DecodeResult]:
+    if logits.ndim == 2:
+      logits = logits[None]
+    job_args = [
+      (
+        _log_softmax(row.astype(np.float32)),
+        beam_width or self.config.beam_width,
+        tuple(hotwords) if hotwords is not None else self.config.hotwords,
+        self.config.hotword_weight,
+        self.frame_seconds,
+        with_timestamps,
+      )
+      for row in logits
+    ]
+    if self._pool is None:
+      return [_beam_decode(self._local, *a) for a in job_args]
+    futures = [self._pool.submit(_beam_decode_job, *a) for a in job_args]
+    return [f.result() for f in futures]
+
+  def close(self) -> None:
+    if self._pool is not None:
+      self._pool.shutdown(wait=False, cancel_futures=True)
+      self._pool = None
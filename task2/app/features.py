@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class FeatureConfig:
+  """The subset of `preprocessor_config.json` wav2vec2 feature extraction depends on."""
+
+  sampling_rate: int = 16_000
+  do_normalize: bool = True
+  return_attention_mask: bool = False
+  padding_value: float = 0.0
+
+  @classmethod
+  def from_model_dir(cls, model_dir: str) -> "FeatureConfig":
+    with open(os.path.join(model_dir, "preprocessor_config.json"), "r", encoding="utf-8") as f:
+      cfg = json.load(f)
+    return cls(
+      sampling_rate=int(cfg.get("sampling_rate", 16_000)),
+      do_normalize=bool(cfg.get("do_normalize", True)),
+      return_attention_mask=bool(cfg.get("return_attention_mask", False)),
+      padding_value=float(cfg.get("padding_value", 0.0)),
+    )
+
+  @classmethod
+  def from_feature_extractor(cls, fe) -> "FeatureConfig":
+    return cls(
+      sampling_rate=int(fe.sampling_rate),
+      do_normalize=bool(fe.do_normalize),
+      return_attention_mask=bool(fe.return_attention_mask),
+      padding_value=float(fe.padding_value),
+    )
+
+
+class NumpyFeatureExtractor:
+  """
+  Wav2Vec2FeatureExtractor without torch/transformers: per-clip zero-mean /
+  unit-variance normalization (over the real samples only), right padding
+  and attention mask, written straight into float32/int64 buffers that ONNX
+  Runtime can consume as-is.
+
+  Buffers are per thread and grow up to `max_retained` samples
+  (ASR_FEATURE_BUFFER_SECONDS of audio, default 60 s), so steady-state
+  requests allocate nothing. Larger inputs get one-off arrays that are freed
+  with the result, so a single long upload does not pin memory in every
+  threadpool thread. The returned arrays are views into the buffers and are
+  overwritten by the next call on the same thread: run inference before
+  extracting again.
+  """
+
+  def __init__(self, config: FeatureConfig, max_retained: Optional[int] = None) -> None:
+    self.config = config
+    if max_retained is None:
+      max_retained = int(float(os.getenv("ASR_FEATURE_BUFFER_SECONDS", "60")) * config.sampling_rate)
+    self.max_retained = max_retained
+    self._local = threading.local()
+
+  @classmethod
+  def from_model_dir(cls, model_dir: str) -> "NumpyFeatureExtractor":
+    return cls(FeatureConfig.from_model_dir(model_dir))
+
+  def _buffers(self, size: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    with_mask = self.config.return_attention_mask
+    if size > self.max_retained:
+      return np.empty(size, dtype=np.float32), np.empty(size, dtype=np.int64) if with_mask else None
+    values = getattr(self._local, "values", None)
+    if values is None or values.size < size:
+      # some headroom so slightly longer clips do not reallocate every time
+      cap = min(int(size * 1.25), self.max_retained)
+      self._local.values = np.empty(cap, dtype=np.float32)
+      self._local.mask = np.empty(cap, dtype=np.int64) if with_mask else None
+    return self._local.values, self._local.mask
+
+  def __call__(
+    self, audio: Union[np.ndarray, Sequence[np.ndarray]]
+  ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    clips: List[np.ndarray] = [audio] if isinstance(audio, np.ndarray) and audio.ndim == 1 else list(audio)
+    rows = len(clips)
+    n = max((len(c) for c in clips), default=0)
+
+    flat_values, flat_mask = self._buffers(rows * n)
+    # flat prefix -> C-contiguous [rows, n] views
+    values = flat_values[: rows * n].reshape(rows, n)
+    mask = flat_mask[: rows * n].reshape(rows, n) if flat_mask is not None else None
+
+    for r, clip in enumerate(clips):
+      length = len(clip)
+      out = values[r, :length]
+      if self.config.do_normalize and length:
+        x = clip.astype(np.float32, copy=False)
+        mean = x.mean(dtype=np.float64)
+        std = np.sqrt(x.var(dtype=np.float64) + 1e-7)
+        np.subtract(x, np.float32(mean), out=out)
+        out /= np.float32(std)
+      else:
+        out[:] = clip
+      if length < n:
+        values[r, length:] = self.config.padding_value
+      if mask is not None:
+        mask[r, :length] = 1
+        mask[r, length:] = 0
+
+    # models trained without attention masks must not be given one (same as HF)
+    return values, mask
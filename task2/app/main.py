@@ -1,27 +1,43 @@
 ﻿from __future__ import annotations
 
+import hmac
+import logging
 import os
 import tempfile
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+import threading
+import time
+from contextlib import ExitStack, asynccontextmanager
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
 
-from app.asr import ASRService
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
 
-app = FastAPI(title="Turkish ASR API", version="1.0")
+from app import metrics
+from app.cache import TranscriptionCache, cache_key
+from app.registry import ModelRegistry, VariantSpec
 
-@app.get("/", include_in_schema=False)
-async def root():
-    from fastapi.responses import RedirectResponse
-    return RedirectResponse(url="/docs")
+logger = logging.getLogger("asr")
+
+registry = ModelRegistry()
+cache = TranscriptionCache.from_env()
+_ready = threading.Event()
+_state: Dict[str, Any] = {}
 
-_asr: ASRService | None = None
 
+def _warmup_durations() -> list[float]:
+  raw = os.getenv("ASR_WARMUP_SECONDS", "1,5,15").strip()
+  return [float(x) for x in raw.split(",") if x.strip()]
 
-def get_asr() -> ASRService:
-  global _asr
-  if _asr is not None:
-    return _asr
 
+def _variant_specs() -> List[VariantSpec]:
+  """
+  Default variant from ASR_BACKEND/ASR_MODEL_DIR, plus extra variants from
+  ASR_BACKENDS: comma-separated `backend` (same model dir) or
+  `name=backend@model_dir` items, e.g. "onnx,int8_v2=onnx_int8@models/onnx_v2".
+  """
   backend = os.getenv("ASR_BACKEND", "onnx_int8").strip().lower()
   model_dir = os.getenv("ASR_MODEL_DIR", "models/onnx").strip()
 
@@ -29,17 +45,149 @@ def get_asr() -> ASRService:
   if not os.path.exists(model_dir):
     model_dir = os.getenv("ASR_FALLBACK_MODEL_DIR", "models/checkpoint").strip()
 
-  _asr = ASRService(model_dir=model_dir, backend=backend)  # type: ignore[arg-type]
-  return _asr
+  specs = [VariantSpec(name=backend, backend=backend, model_dir=model_dir)]
+  for item in os.getenv("ASR_BACKENDS", "").split(","):
+    item = item.strip()
+    if not item:
+      continue
+    name, _, rest = item.partition("=") if "=" in item else (item, "", item)
+    var_backend, _, var_dir = rest.partition("@")
+    spec = VariantSpec(name=name.strip(), backend=var_backend.strip().lower(), model_dir=var_dir.strip() or model_dir)
+    if spec.name not in {s.name for s in specs}:
+      specs.append(spec)
+  return specs
+
+
+def _load_and_warmup() -> None:
+  """Runs in a background thread at startup; flips readiness when the default variant is warm."""
+  durations = _warmup_durations()
+  for i, spec in enumerate(_variant_specs()):
+    try:
+      if i == 0:
+        registry.default = spec.name
+      info = registry.load(spec, warmup=False)
+      with registry.acquire(spec.name) as asr:
+        info["warmup"] = asr.warmup(durations)
+      logger.info("ASR variant ready: %s", info)
+      if i == 0:
+        _state.update(load_time=info["load_time"], warmup=info["warmup"])
+        _ready.set()
+    except Exception as e:  # surfaced via /ready
+      _state.setdefault("errors", {})[spec.name] = repr(e)
+      logger.exception("ASR variant %s failed to load", spec.name)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+  # Load in the background so /health answers while the model is loading.
+  threading.Thread(target=_load_and_warmup, name="asr-loader", daemon=True).start()
+  yield
+
+
+app = FastAPI(title="Turkish ASR API", version="1.0", lifespan=lifespan)
+
+@app.get("/", include_in_schema=False)
+async def root():
+    from fastapi.responses import RedirectResponse
+    return RedirectResponse(url="/docs")
+
+
+def _check_admin(token: Optional[str]) -> None:
+  # fail closed: without a configured token the admin routes are off
+  expected = os.getenv("ASR_ADMIN_TOKEN", "").strip()
+  if not expected:
+    raise HTTPException(status_code=403, detail="Admin API disabled (set ASR_ADMIN_TOKEN)")
+  if not hmac.compare_digest((token or "").encode("utf-8"), expected.encode("utf-8")):
+    raise HTTPException(status_code=403, detail="Invalid admin token")
 
 
 @app.get("/health")
 def health():
+  # liveness only: the process is up (the model may still be loading)
   return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready():
+  if not _ready.is_set():
+    status = "error" if "errors" in _state else "loading"
+    return JSONResponse({"status": status, **_state}, status_code=503)
+  return {"status": "ready", "variants": registry.names(), **_state}
+
+
+class LoadVariantRequest(BaseModel):
+  backend: str = "onnx_int8"
+  model_dir: str
+  warmup: bool = True
+
+
+@app.get("/models")
+def list_models():
+  """Loaded variants with load time, on-disk size and RSS attributed to each."""
+  return {**registry.describe(), "cache": cache.describe()}
+
+
+@app.delete("/cache")
+def clear_cache(x_admin_token: Optional[str] = Header(None)):
+  _check_admin(x_admin_token)
+  cache.clear()
+  return {"cleared": True}
+
+
+@app.put("/models/{name}")
+async def load_model(name: str, req: LoadVariantRequest, x_admin_token: Optional[str] = Header(None)):
+  """Load a new variant, or hot-swap an existing one; in-flight requests finish on the old model."""
+  _check_admin(x_admin_token)
+  spec = VariantSpec(name=name, backend=req.backend.strip().lower(), model_dir=req.model_dir)
+  try:
+    return await run_in_threadpool(registry.load, spec, req.warmup)
+  except (OSError, ValueError) as e:
+    raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/models/{name}")
+def unload_model(name: str, x_admin_token: Optional[str] = Header(None)):
+  _check_admin(x_admin_token)
+  try:
+    registry.unload(name)
+  except KeyError:
+    raise HTTPException(status_code=404, detail=f"Unknown model variant: {name}")
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  return {"unloaded": name}
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+  metrics.update_model_gauges(registry.describe())
+  body, content_type = metrics.render()
+  return Response(body, media_type=content_type)
+
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def profile(
+  seconds: float = Query(10.0, gt=0, le=120),
+  interval_ms: float = Query(5.0, ge=1, le=1000),
+  x_admin_token: Optional[str] = Header(None),
+):
+  """Collapsed Python stacks of all threads for `seconds` (flamegraph.pl / speedscope input). Opt-in: ASR_PROFILER=1."""
+  if os.getenv("ASR_PROFILER", "0").strip().lower() not in ("1", "true", "yes", "on"):
+    raise HTTPException(status_code=404, detail="Profiler disabled (set ASR_PROFILER=1)")
+  _check_admin(x_admin_token)
+  return await run_in_threadpool(metrics.sample_stacks, seconds, interval_ms / 1000.0)
+
+
 @app.post("/transcribe")
-async def transcribe(file: UploadFile = File(...)):
+async def transcribe(
+  file: UploadFile = File(...),
+  timestamps: bool = False,
+  decoder: str = Query("greedy", pattern="^(greedy|beam)$"),
+  beam_width: Optional[int] = Query(None, ge=1, le=512),
+  hotwords: Optional[str] = Query(None, description="Comma-separated words to boost (beam only)"),
+  backend: Optional[str] = Query(None, description="Model variant (see /models); default variant if omitted"),
+  vad: Optional[bool] = Query(None, description="Transcribe speech segments only (default: ASR_VAD)"),
+  no_cache: bool = Query(False, description="Skip the transcription cache (load tests set this)"),
+):
   if not file.filename:
     raise HTTPException(status_code=400, detail="Missing filename")
 
@@ -48,20 +196,85 @@ async def transcribe(file: UploadFile = File(...)):
   if ext not in [".wav", ".mp3", ".m4a", ".flac", ".ogg"]:
     raise HTTPException(status_code=400, detail="Unsupported file type. Use WAV/MP3 (or similar).")
 
-  asr = get_asr()
+  if not _ready.is_set():
+    raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "5"})
+  if backend is not None and backend not in registry:
+    raise HTTPException(status_code=404, detail=f"Unknown model variant: {backend}")
 
-  with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+  variant = backend or registry.default or ""
+  with metrics.stage("upload_read", variant):
     data = await file.read()
-    if not data:
-      raise HTTPException(status_code=400, detail="Empty file")
-    tmp.write(data)
-    tmp_path = tmp.name
+  if not data:
+    raise HTTPException(status_code=400, detail="Empty file")
+  words = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else None
 
-  try:
-    result = asr.transcribe_file(tmp_path)
-    return JSONResponse({"text": result.text, "inference_time": round(result.inference_time, 4)})
-  finally:
+  # the variant stays referenced (not released by a hot swap) until this request is done
+  with ExitStack() as stack:
     try:
-      os.remove(tmp_path)
+      asr = stack.enter_context(registry.acquire(backend))
+    except KeyError:
+      # unloaded between the check above and here
+      raise HTTPException(status_code=404, detail=f"Unknown model variant: {variant}")
+    key = None
+    if cache.enabled and not no_cache:
+      vad_cfg = asr.effective_vad(vad)
+      settings = {
+        "timestamps": timestamps,
+        "decoder": decoder,
+        "beam_width": beam_width,
+        "hotwords": words,
+        # segmentation changes the transcript: VAD mode and thresholds are part of the key
+        "vad": asdict(vad_cfg) if vad_cfg is not None else None,
+      }
+      key = cache_key(data, variant, asr.fingerprint, settings)
+      hit = cache.get(key)
+      if hit is not None:
+        metrics.REQUESTS.labels(backend=variant, status="ok", cached="true").inc()
+        # inference_time is the one measured when the transcript was produced
+        return JSONResponse({**hit, "cached": True})
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+      tmp.write(data)
+      tmp_path = tmp.name
+
+    def run():
+      metrics.QUEUE_DEPTH.dec()
+      with metrics.IN_FLIGHT.track_inprogress():
+        return asr.transcribe_file(
+          tmp_path,
+          with_timestamps=timestamps,
+          decoder=decoder,
+          beam_width=beam_width,
+          hotwords=words,
+          vad=vad,
+        )
+
+    metrics.QUEUE_DEPTH.inc()
+    try:
+      # run off the event loop: inference and beam decoding are blocking
+      result = await run_in_threadpool(run)
     except Exception:
-      pass
+      metrics.REQUESTS.labels(backend=variant, status="error", cached="false").inc()
+      raise
+    finally:
+      try:
+        os.remove(tmp_path)
+      except Exception:
+        pass
+
+  payload = {
+    "text": result.text,
+    "inference_time": round(result.inference_time, 4),
+    "backend": variant,
+  }
+  if result.words is not None:
+    payload["words"] = [asdict(w) for w in result.words]
+  if result.segments is not None:
+    payload["segments"] = [
+      {k: v for k, v in asdict(seg).items() if k != "words" or v is not None} for seg in result.segments
+    ]
+    payload["speech_ratio"] = result.speech_ratio
+  if key is not None:
+    await run_in_threadpool(cache.put, key, payload)
+  metrics.REQUESTS.labels(backend=variant, status="ok", cached="false").inc()
+  return JSONResponse({**payload, "cached": False})
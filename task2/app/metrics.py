@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from prometheus_client import (
+  CONTENT_TYPE_LATEST,
+  CollectorRegistry,
+  Counter,
+  Gauge,
+  Histogram,
+  generate_latest,
+)
+from prometheus_client import multiprocess
+
+from app.asr import add_stage_observer
+
+# ASR stages run from a few ms (ctc decode) to tens of seconds (long-file inference)
+_STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+  "asr_stage_seconds",
+  "Time spent per pipeline stage",
+  ["stage", "backend"],
+  buckets=_STAGE_BUCKETS,
+)
+REQUESTS = Counter("asr_requests_total", "Transcription requests", ["backend", "status", "cached"])
+QUEUE_DEPTH = Gauge("asr_queue_depth", "Requests waiting for a worker thread", multiprocess_mode="livesum")
+IN_FLIGHT = Gauge("asr_in_flight", "Requests being transcribed", multiprocess_mode="livesum")
+MODEL_LOADED = Gauge("asr_model_loaded", "1 if the variant is loaded", ["variant", "backend"], multiprocess_mode="max")
+MODEL_LOAD_SECONDS = Gauge(
+  "asr_model_load_seconds", "Load (+warmup) time of the variant", ["variant"], multiprocess_mode="max"
+)
+MODEL_RSS_BYTES = Gauge(
+  "asr_model_rss_delta_bytes", "RSS growth attributed to loading the variant", ["variant"], multiprocess_mode="max"
+)
+
+
+def observe_stage(stage: str, backend: str, seconds: float) -> None:
+  STAGE_SECONDS.labels(stage=stage, backend=backend).observe(seconds)
+
+
+# ASRService reports decode/resample/features/inference/ctc_decode through this hook
+add_stage_observer(observe_stage)
+
+
+@contextmanager
+def stage(name: str, backend: str) -> Iterator[None]:
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    observe_stage(name, backend, time.perf_counter() - start)
+
+
+def update_model_gauges(described: Dict) -> None:
+  """Refresh per-variant gauges from `ModelRegistry.describe()` (done on every scrape)."""
+  for gauge in (MODEL_LOADED, MODEL_LOAD_SECONDS, MODEL_RSS_BYTES):
+    gauge.clear()  # drop unloaded variants
+  for v in described.get("variants", []):
+    MODEL_LOADED.labels(variant=v["name"], backend=v["backend"]).set(1)
+    MODEL_LOAD_SECONDS.labels(variant=v["name"]).set(v["load_time"])
+    MODEL_RSS_BYTES.labels(variant=v["name"]).set(v["rss_delta_mb"] * 1024 * 1024)
+
+
+def render() -> tuple[bytes, str]:
+  # with several worker processes, each writes to PROMETHEUS_MULTIPROC_DIR and a scrape merges them
+  if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+  return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def sample_stacks(seconds: float, interval_s: float = 0.005) -> str:
+  """
+  Poor man's sampling profiler: snapshots every thread's Python stack every
+  `interval_s` and returns collapsed stacks ("frame;frame;frame count"), the
+  input format of flamegraph.pl and speedscope. Native time inside ORT/torch
+  shows up under the Python frame that called into it.
+  """
+  me = threading.get_ident()
+  names = {t.ident: t.name for t in threading.enumerate()}
+  counts: StackCounter = StackCounter()
+  deadline = time.monotonic() + seconds
+  while time.monotonic() < deadline:
+    for ident, frame in sys._current_frames().items():
+      if ident == me:
+        continue
+      stack = [f"{os.path.basename(fs.filename)}:{fs.name}" for fs in traceback.extract_stack(frame)]
+      counts[";".join([names.get(ident, str(ident)), *stack])] += 1
+    time.sleep(interval_s)
+  return "\n".join(f"{stack} {n}" for stack, n in counts.most_common()) + "\n"
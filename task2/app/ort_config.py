@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import platform
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import onnxruntime as ort
+
+logger = logging.getLogger("asr")
+
+_GRAPH_OPT_LEVELS = {
+  "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+  "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+  "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+  "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_EXECUTION_MODES = {
+  "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+  "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def _env_bool(name: str, default: bool) -> bool:
+  raw = os.getenv(name)
+  if raw is None or not raw.strip():
+    return default
+  return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+# (pid, index, fd) of the slot lock this process holds; the fd stays open for its lifetime
+_claimed: Optional[Tuple[int, int, int]] = None
+_claim_lock = threading.Lock()
+
+
+def claim_worker_index(workers: int) -> Optional[int]:
+  """
+  Per-process worker index for servers that start N identical processes with
+  one environment (`uvicorn --workers N`): each process takes the first free
+  `worker-<i>.lock` in ASR_WORKER_LOCK_DIR with flock. The OS drops the lock
+  when the process exits, so a restarted worker reuses the slot. None without
+  flock (Windows) or when every slot is taken.
+  """
+  global _claimed
+  with _claim_lock:
+    if _claimed is not None and _claimed[0] == os.getpid():
+      return _claimed[1]
+    try:
+      import fcntl
+    except ImportError:
+      return None
+
+    default_dir = os.path.join(
+      tempfile.gettempdir(), f"asr-workers-{hashlib.sha1(os.getcwd().encode('utf-8')).hexdigest()[:8]}"
+    )
+    lock_dir = os.getenv("ASR_WORKER_LOCK_DIR", "").strip() or default_dir
+    os.makedirs(lock_dir, exist_ok=True)
+    for i in range(workers):
+      fd = os.open(os.path.join(lock_dir, f"worker-{i}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+      try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError:
+        os.close(fd)
+        continue
+      _claimed = (os.getpid(), i, fd)
+      return i
+    return None
+
+
+def available_cores() -> List[int]:
+  """CPU ids this process may run on (respects taskset / container cpusets)."""
+  if hasattr(os, "sched_getaffinity"):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(os.cpu_count() or 1))
+
+
+@dataclass
+class OrtSessionConfig:
+  """
+  ONNX Runtime session settings for the ASR backend.
+
+  Thread counts of 0 mean "derive from the host": the available cores are
+  split evenly between `workers` processes, and worker `worker_index` gets its
+  own slice (pinned when `pin_threads` is on) so N workers on one box do not
+  oversubscribe each other. Without ASR_WORKER_INDEX the index is claimed per
+  process (`claim_worker_index`); if that fails pinning is turned off rather
+  than pinning every worker to the same cores.
+  """
+
+  intra_op_threads: int = 0
+  inter_op_threads: int = 0
+  execution_mode: str = "sequential"
+  graph_optimization: str = "all"
+  optimized_model_dir: Optional[str] = None  # cache for offline-optimized graphs
+  enable_cpu_mem_arena: bool = True
+  enable_mem_pattern: bool = True
+  allow_spinning: bool = True
+  pin_threads: bool = False
+  workers: int = 1
+  worker_index: int = 0
+
+  @classmethod
+  def from_env(cls) -> "OrtSessionConfig":
+    workers = max(1, int(os.getenv("ASR_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+    pin_threads = _env_bool("ASR_ORT_PIN_THREADS", False)
+    raw_index = os.getenv("ASR_WORKER_INDEX", "").strip()
+    worker_index: Optional[int] = int(raw_index) if raw_index else None
+    if worker_index is None:
+      worker_index = claim_worker_index(workers) if pin_threads and workers > 1 else 0
+      if worker_index is None:
+        logger.warning("No per-worker index (set ASR_WORKER_INDEX); thread pinning disabled")
+        worker_index, pin_threads = 0, False
+    return cls(
+      intra_op_threads=int(os.getenv("ASR_ORT_INTRA_THREADS", "0")),
+      inter_op_threads=int(os.getenv("ASR_ORT_INTER_THREADS", "0")),
+      execution_mode=os.getenv("ASR_ORT_EXECUTION_MODE", "sequential").strip().lower(),
+      graph_optimization=os.getenv("ASR_ORT_GRAPH_OPT", "all").strip().lower(),
+      optimized_model_dir=os.getenv("ASR_ORT_OPTIMIZED_DIR", "").strip() or None,
+      enable_cpu_mem_arena=_env_bool("ASR_ORT_CPU_ARENA", True),
+      enable_mem_pattern=_env_bool("ASR_ORT_MEM_PATTERN", True),
+      allow_spinning=_env_bool("ASR_ORT_SPINNING", True),
+      pin_threads=pin_threads,
+      # WEB_CONCURRENCY is what uvicorn/gunicorn use for the worker count
+      workers=workers,
+      worker_index=worker_index,
+    )
+
+  def worker_cores(self) -> List[int]:
+    cores = available_cores()
+    per_worker = max(1, len(cores) // self.workers)
+    start = (self.worker_index % self.workers) * per_worker
+    return cores[start:start + per_worker] or cores[:1]
+
+  def resolved_intra_threads(self) -> int:
+    return self.intra_op_threads or len(self.worker_cores())
+
+  def build(self) -> ort.SessionOptions:
+    if self.graph_optimization not in _GRAPH_OPT_LEVELS:
+      raise ValueError(f"Unknown graph optimization level: {self.graph_optimization}")
+    if self.execution_mode not in _EXECUTION_MODES:
+      raise ValueError(f"Unknown execution mode: {self.execution_mode}")
+
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = self.resolved_intra_threads()
+    so.inter_op_num_threads = self.inter_op_threads or 1
+    so.execution_mode = _EXECUTION_MODES[self.execution_mode]
+    so.graph_optimization_level = _GRAPH_OPT_LEVELS[self.graph_optimization]
+    so.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+    so.enable_mem_pattern = self.enable_mem_pattern
+    so.add_session_config_entry("session.intra_op.allow_spinning", "1" if self.allow_spinning else "0")
+
+    if self.pin_threads:
+      # One entry per extra intra-op thread (the caller thread is thread 0);
+      # ORT numbers logical processors from 1.
+      cores = self.worker_cores()
+      n_extra = so.intra_op_num_threads - 1
+      if n_extra > 0:
+        affinities = [str(cores[(i + 1) % len(cores)] + 1) for i in range(n_extra)]
+        so.add_session_config_entry("session.intra_op_thread_affinities", ";".join(affinities))
+    return so
+
+  def _optimized_path(self, onnx_path: str) -> Path:
+    # key on source file identity + opt level + ORT version + arch so stale caches are never reused
+    # ("all" level can bake CPU-specific layouts into the saved graph)
+    src = Path(onnx_path)
+    st = src.stat()
+    key = "|".join([
+      str(src.resolve()),
+      str(st.st_size),
+      str(st.st_mtime_ns),
+      self.graph_optimization,
+      ort.__version__,
+      platform.machine(),
+    ])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    assert self.optimized_model_dir is not None
+    return Path(self.optimized_model_dir) / f"{src.stem}.{self.graph_optimization}.{digest}.onnx"
+
+  def create_session(self, onnx_path: str, providers: List[str]) -> ort.InferenceSession:
+    """
+    Build an InferenceSession. With `optimized_model_dir` set, the graph is
+    optimized once and saved; later starts load the saved graph with
+    optimizations disabled, skipping the optimization pass entirely.
+    """
+    so = self.build()
+    if not self.optimized_model_dir or self.graph_optimization == "disable":
+      return ort.InferenceSession(onnx_path, sess_options=so, providers=providers)
+
+    cached = self._optimized_path(onnx_path)
+    if cached.exists():
+      so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+      return ort.InferenceSession(cached.as_posix(), sess_options=so, providers=providers)
+
+    # workers may start together: write under a private name, then publish atomically
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+    so.optimized_model_filepath = tmp.as_posix()
+    sess = ort.InferenceSession(onnx_path, sess_options=so, providers=providers)
+    if tmp.exists():
+      os.replace(tmp, cached)
+    return sess
+
+  def describe(self) -> dict:
+    return {
+      "intra_op_threads": self.resolved_intra_threads(),
+      "inter_op_threads": self.inter_op_threads or 1,
+      "execution_mode": self.execution_mode,
+      "graph_optimization": self.graph_optimization,
+      "optimized_model_dir": self.optimized_model_dir,
+      "cpu_mem_arena": self.enable_cpu_mem_arena,
+      "mem_pattern": self.enable_mem_pattern,
+      "pin_threads": self.pin_threads,
+      "worker_index": self.worker_index,
+      "cores": self.worker_cores(),
+    }
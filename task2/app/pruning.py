@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import torch
+from torch import nn
+from transformers import Wav2Vec2Config, Wav2Vec2ForCTC
+
+# written next to config.json by scripts/prune.py
+PLAN_FILE = "pruning.json"
+WEIGHTS_FILE = "pruned_model.pt"
+
+
+def is_pruned_dir(model_dir: str) -> bool:
+  return (Path(model_dir) / PLAN_FILE).is_file()
+
+
+def attention_modules(model: Wav2Vec2ForCTC) -> List[nn.Module]:
+  return [layer.attention for layer in model.wav2vec2.encoder.layers]
+
+
+def ffn_modules(model: Wav2Vec2ForCTC) -> List[nn.Module]:
+  return [layer.feed_forward for layer in model.wav2vec2.encoder.layers]
+
+
+def slice_linear(linear: nn.Linear, keep: torch.Tensor, dim: int) -> nn.Linear:
+  """Copy of `linear` keeping output features (dim=0) or input features (dim=1) `keep`."""
+  weight = linear.weight.detach().index_select(dim, keep).clone()
+  bias = linear.bias
+  if bias is not None:
+    bias = (bias.detach()[keep] if dim == 0 else bias.detach()).clone()
+  out = nn.Linear(weight.shape[1], weight.shape[0], bias=bias is not None)
+  out.weight = nn.Parameter(weight)
+  if bias is not None:
+    out.bias = nn.Parameter(bias)
+  return out
+
+
+def apply_plan(model: Wav2Vec2ForCTC, plan: Dict[str, Dict[int, List[int]]]) -> Wav2Vec2ForCTC:
+  """Physically removes the heads / FFN channels listed in `plan` (in place)."""
+  attns = attention_modules(model)
+  for layer, heads in plan.get("heads", {}).items():
+    attn = attns[int(layer)]
+    d = attn.head_dim
+    kept = [h for h in range(attn.num_heads) if h not in set(heads)]
+    if not kept:
+      raise ValueError(f"Pruning plan removes every attention head of layer {layer}")
+    keep = torch.cat([torch.arange(h * d, (h + 1) * d) for h in kept])
+    attn.q_proj = slice_linear(attn.q_proj, keep, 0)
+    attn.k_proj = slice_linear(attn.k_proj, keep, 0)
+    attn.v_proj = slice_linear(attn.v_proj, keep, 0)
+    attn.out_proj = slice_linear(attn.out_proj, keep, 1)
+    # the attention forward reshapes with these two
+    attn.num_heads = len(kept)
+    attn.embed_dim = len(kept) * d
+
+  ffns = ffn_modules(model)
+  for layer, channels in plan.get("ffn", {}).items():
+    ff = ffns[int(layer)]
+    size = ff.intermediate_dense.out_features
+    keep = torch.tensor([c for c in range(size) if c not in set(channels)], dtype=torch.long)
+    if keep.numel() == 0:
+      raise ValueError(f"Pruning plan removes every FFN channel of layer {layer}")
+    ff.intermediate_dense = slice_linear(ff.intermediate_dense, keep, 0)
+    ff.output_dense = slice_linear(ff.output_dense, keep, 1)
+  return model
+
+
+def load_pruned(model_dir: str) -> Wav2Vec2ForCTC:
+  """Rebuilds a `scripts/prune.py` checkpoint: base config, replayed plan, sliced weights."""
+  path = Path(model_dir)
+  model = Wav2Vec2ForCTC(Wav2Vec2Config.from_pretrained(model_dir))
+  plan = json.loads((path / PLAN_FILE).read_text(encoding="utf-8"))
+  apply_plan(model, plan)
+  model.load_state_dict(torch.load(path / WEIGHTS_FILE, map_location="cpu"))
+  return model.eval()
+
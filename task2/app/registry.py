@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import gc
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+
+import psutil
+
+from app.asr import ASRService, onnx_file_for
+
+
+@dataclass(frozen=True)
+class VariantSpec:
+  name: str
+  backend: str
+  model_dir: str
+
+
+@dataclass
+class _Entry:
+  spec: VariantSpec
+  service: ASRService
+  load_time: float
+  rss_delta_bytes: int
+  model_bytes: int
+  loaded_at: float = field(default_factory=time.time)
+  refs: int = 0
+  retired: bool = False
+
+
+def _rss_bytes() -> int:
+  return psutil.Process(os.getpid()).memory_info().rss
+
+
+def _model_bytes(spec: VariantSpec) -> int:
+  name = onnx_file_for(spec.backend)
+  if name is not None:
+    path = os.path.join(spec.model_dir, name)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+  # pytorch: whole checkpoint folder
+  total = 0
+  for root, _, files in os.walk(spec.model_dir):
+    total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+  return total
+
+
+def _build_service(spec: VariantSpec) -> ASRService:
+  return ASRService(model_dir=spec.model_dir, backend=spec.backend, variant=spec.name)  # type: ignore[arg-type]
+
+
+class ModelRegistry:
+  """
+  Holds several loaded ASR variants (backend + model dir) side by side.
+
+  Requests borrow a variant through `acquire()`, which reference-counts it.
+  `load()` builds a new service outside the lock and swaps it in atomically;
+  the replaced entry is retired and only released once its last in-flight
+  request returns, so a hot swap never interrupts running inference.
+  """
+
+  def __init__(
+    self,
+    default: Optional[str] = None,
+    factory: Callable[[VariantSpec], ASRService] = _build_service,
+  ) -> None:
+    self.default = default
+    # app/serving.py swaps this for model-less frontends backed by the inference process
+    self.factory = factory
+    self._lock = threading.Lock()
+    # serializes builds so the RSS delta is attributable to one variant
+    self._load_lock = threading.Lock()
+    self._active: Dict[str, _Entry] = {}
+    self._retired: List[_Entry] = []
+
+  def load(self, spec: VariantSpec, warmup: bool = True) -> Dict:
+    with self._load_lock:
+      gc.collect()
+      rss_before = _rss_bytes()
+      start = time.perf_counter()
+      service = self.factory(spec)
+      if warmup:
+        service.warmup()
+      entry = _Entry(
+        spec=spec,
+        service=service,
+        load_time=round(time.perf_counter() - start, 3),
+        rss_delta_bytes=max(0, _rss_bytes() - rss_before),
+        model_bytes=_model_bytes(spec),
+      )
+
+    with self._lock:
+      old = self._active.get(spec.name)
+      self._active[spec.name] = entry
+      if self.default is None:
+        self.default = spec.name
+      if old is not None:
+        self._retire(old)
+    return self._describe(entry)
+
+  def unload(self, name: str) -> None:
+    with self._lock:
+      if name == self.default:
+        raise ValueError(f"Cannot unload the default variant: {name}")
+      entry = self._active.pop(name, None)
+      if entry is None:
+        raise KeyError(name)
+      self._retire(entry)
+
+  def _retire(self, entry: _Entry) -> None:
+    # caller holds self._lock
+    entry.retired = True
+    if entry.refs == 0:
+      entry.service.close()
+    else:
+      self._retired.append(entry)
+
+  @contextmanager
+  def acquire(self, name: Optional[str] = None) -> Iterator[ASRService]:
+    with self._lock:
+      key = name or self.default
+      entry = self._active.get(key) if key else None
+      if entry is None:
+        raise KeyError(key)
+      entry.refs += 1
+    try:
+      yield entry.service
+    finally:
+      with self._lock:
+        entry.refs -= 1
+        if entry.retired and entry.refs == 0:
+          if entry in self._retired:
+            self._retired.remove(entry)
+          entry.service.close()
+
+  def names(self) -> List[str]:
+    with self._lock:
+      return list(self._active)
+
+  def __contains__(self, name: str) -> bool:
+    with self._lock:
+      return name in self._active
+
+  @staticmethod
+  def _describe(entry: _Entry) -> Dict:
+    return {
+      "name": entry.spec.name,
+      "backend": entry.spec.backend,
+      "model_dir": entry.spec.model_dir,
+      "load_time": entry.load_time,
+      "loaded_at": round(entry.loaded_at, 3),
+      "in_flight": entry.refs,
+      "model_file_mb": round(entry.model_bytes / (1024 * 1024), 2),
+      "rss_delta_mb": round(entry.rss_delta_bytes / (1024 * 1024), 2),
+    }
+
+  def describe(self) -> Dict:
+    with self._lock:
+      return {
+        "default": self.default,
+        "process_rss_mb": round(_rss_bytes() / (1024 * 1024), 2),
+        "variants": [self._describe(e) for e in self._active.values()],
+        "draining": [self._describe(e) for e in self._retired],
+      }
@@ -0,0 +1,381 @@
+"""
+Multi-process serving: N HTTP workers, one model.
+
+    python -m app.serving --workers 4 --port 8000
+
+- one inference process owns the only copy of the model (ASRService) and
+  micro-batches requests from all workers;
+- N uvicorn workers share one listening socket (the kernel spreads accepted
+  connections across them) and run the GIL-bound stages: upload handling,
+  audio decode/resample, feature extraction, VAD and CTC decoding;
+- features travel to the inference process through a shared-memory ring of
+  fixed-size slots (no pickling of audio); logits come back over a per-worker
+  queue (they are ~50x smaller than the audio).
+
+Model memory therefore stays constant as workers are added; only the light
+frontends are replicated. `GET /serving` (and the periodic log line) reports
+RSS/PSS/USS per process.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psutil
+
+from app.asr import ASRService, model_fingerprint
+from app.registry import VariantSpec
+
+logger = logging.getLogger("asr.serving")
+
+# (worker_id, req_id, slot, rows, n_samples, lengths)
+Job = Tuple[int, int, int, int, int, List[int]]
+
+
+@dataclass(frozen=True)
+class RingSpec:
+  name: str
+  slots: int
+  slot_samples: int
+
+  def view(self, shm: shared_memory.SharedMemory) -> np.ndarray:
+    return np.ndarray((self.slots, self.slot_samples), dtype=np.float32, buffer=shm.buf)
+
+
+class InferenceClient:
+  """Worker side of the ring: writes features into a free slot and waits for logits."""
+
+  def __init__(
+    self,
+    worker_id: int,
+    ring: RingSpec,
+    jobs: Any,
+    free_slots: Any,
+    responses: Any,
+    timeout_s: float = 120.0,
+  ) -> None:
+    self.worker_id = worker_id
+    self.ring = ring
+    self._shm = shared_memory.SharedMemory(name=ring.name)
+    self._slots = ring.view(self._shm)
+    self.jobs = jobs
+    self.free_slots = free_slots
+    self.responses = responses
+    self.timeout_s = timeout_s
+    self._ids = itertools.count()
+    self._lock = threading.Lock()
+    self._pending: Dict[int, Tuple[threading.Event, List[Any]]] = {}
+    threading.Thread(target=self._listen, name="asr-responses", daemon=True).start()
+
+  def _listen(self) -> None:
+    while True:
+      req_id, logits, error = self.responses.get()
+      with self._lock:
+        waiter = self._pending.pop(req_id, None)
+      if waiter is not None:
+        waiter[1].extend((logits, error))
+        waiter[0].set()
+
+  def infer(self, values: np.ndarray, lengths: Sequence[int]) -> np.ndarray:
+    rows, n = values.shape
+    if rows * n > self.ring.slot_samples:
+      raise ValueError(
+        f"Input of {rows}x{n} samples exceeds a ring slot ({self.ring.slot_samples}); "
+        "raise --max_seconds or enable VAD"
+      )
+    try:
+      slot = self.free_slots.get(timeout=self.timeout_s)
+    except queue.Empty:
+      raise TimeoutError("No free inference slot (inference process overloaded)") from None
+    self._slots[slot, : rows * n] = values.reshape(-1)
+
+    req_id = next(self._ids)
+    done = threading.Event()
+    result: List[Any] = []
+    with self._lock:
+      self._pending[req_id] = (done, result)
+    self.jobs.put((self.worker_id, req_id, slot, rows, n, [int(x) for x in lengths]))
+    if not done.wait(self.timeout_s):
+      with self._lock:
+        self._pending.pop(req_id, None)
+      raise TimeoutError(f"Inference did not answer within {self.timeout_s}s")
+
+    logits, error = result
+    if error is not None:
+      raise RuntimeError(f"Inference process failed: {error}")
+    return logits
+
+
+class RemoteASRService(ASRService):
+  """ASRService frontend without a model: `infer` is delegated to the inference process."""
+
+  def __init__(self, spec: VariantSpec, client: InferenceClient) -> None:
+    self._init_frontend(spec.model_dir, spec.backend, None, None, None, spec.name)  # type: ignore[arg-type]
+    self.client = client
+    self.fingerprint = model_fingerprint(spec.model_dir, spec.backend)
+
+  def infer(self, input_values: np.ndarray, attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
+    values = input_values
+    if attention_mask is not None:
+      lengths = attention_mask.sum(axis=1).tolist()
+    else:
+      lengths = [values.shape[1]] * values.shape[0]
+    return self.client.infer(values, lengths)
+
+
+def _bucket_key(buckets: List[int], n: int) -> int:
+  # requests padded to the same length anyway can share one forward pass
+  return next((b for b in buckets if b >= n), n)
+
+
+def _inference_main(
+  spec: VariantSpec,
+  ring: RingSpec,
+  jobs: Any,
+  free_slots: Any,
+  responses: List[Any],
+  max_batch: int,
+  batch_wait_ms: float,
+) -> None:
+  # this process gets every core for intra-op threads
+  os.environ["ASR_WORKERS"] = "1"
+  os.environ["ASR_WORKER_INDEX"] = "0"
+  logging.basicConfig(level=logging.INFO)
+
+  shm = shared_memory.SharedMemory(name=ring.name)
+  slots = ring.view(shm)
+  asr = ASRService(model_dir=spec.model_dir, backend=spec.backend, variant=spec.name)  # type: ignore[arg-type]
+  logger.info("inference process ready (pid=%d, %s)", os.getpid(), spec)
+
+  stop = False
+  held: Optional[Job] = None  # did not fit the previous batch; goes first in the next one
+  while not stop:
+    batch: List[Optional[Job]] = [held if held is not None else jobs.get()]
+    held = None
+    # the first job is always taken, so a job larger than max_batch still runs (alone)
+    rows = batch[0][3] if batch[0] is not None else 0
+    deadline = time.monotonic() + batch_wait_ms / 1000.0
+    while batch[-1] is not None and rows < max_batch:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      try:
+        job = jobs.get(timeout=remaining)
+      except queue.Empty:
+        break
+      if job is not None and rows + job[3] > max_batch:
+        held = job
+        break
+      batch.append(job)
+      rows += job[3] if job is not None else 0
+    if any(j is None for j in batch):
+      stop = True
+      batch = [j for j in batch if j is not None]
+
+    groups: Dict[int, List[Job]] = {}
+    for job in batch:
+      groups.setdefault(_bucket_key(asr.buckets, job[4]), []).append(job)
+
+    for group in groups.values():
+      n_max = max(j[4] for j in group)
+      rows = sum(j[3] for j in group)
+      values = np.zeros((rows, n_max), dtype=np.float32)
+      mask = np.zeros((rows, n_max), dtype=np.int64)
+      r = 0
+      for _, _, slot, job_rows, n, lengths in group:
+        values[r:r + job_rows, :n] = slots[slot, : job_rows * n].reshape(job_rows, n)
+        for i, length in enumerate(lengths):
+          mask[r + i, :length] = 1
+        free_slots.put(slot)
+        r += job_rows
+
+      try:
+        padded = bool((mask == 0).any())
+        logits = asr.infer(values, mask if padded else None)
+        error = None
+      except Exception as e:  # reported to every waiting request
+        logits, error = None, repr(e)
+
+      r = 0
+      for worker_id, req_id, _, job_rows, n, _ in group:
+        out = None
+        if logits is not None:
+          out = np.ascontiguousarray(logits[r:r + job_rows, : asr.geometry.num_frames(n)])
+        responses[worker_id].put((req_id, out, error))
+        r += job_rows
+
+  asr.close()
+  shm.close()
+
+
+def memory_report(root_pid: int, shm_bytes: int = 0) -> Dict[str, Any]:
+  """
+  Per-process memory. RSS double-counts pages shared between processes
+  (libraries, shared memory); PSS splits them fairly and USS is what each
+  process alone would free, so sum(PSS) is the real footprint of the tree.
+  """
+  root = psutil.Process(root_pid)
+  rows = []
+  for proc in [root, *root.children(recursive=True)]:
+    try:
+      info = proc.memory_full_info()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+      continue
+    rows.append({
+      "pid": proc.pid,
+      "name": proc.name(),
+      "rss_mb": round(info.rss / 2**20, 1),
+      "pss_mb": round(getattr(info, "pss", info.rss) / 2**20, 1),
+      "uss_mb": round(info.uss / 2**20, 1),
+    })
+  return {
+    "processes": rows,
+    "total_rss_mb": round(sum(r["rss_mb"] for r in rows), 1),
+    "total_pss_mb": round(sum(r["pss_mb"] for r in rows), 1),
+    "shared_ring_mb": round(shm_bytes / 2**20, 1),
+  }
+
+
+def _http_worker_main(
+  worker_id: int,
+  sock: socket.socket,
+  spec: VariantSpec,
+  ring: RingSpec,
+  jobs: Any,
+  free_slots: Any,
+  responses: List[Any],
+  log_level: str,
+) -> None:
+  import uvicorn
+
+  from app import main
+
+  os.environ["ASR_WORKER_INDEX"] = str(worker_id)
+  client = InferenceClient(worker_id, ring, jobs, free_slots, responses[worker_id])
+
+  def factory(requested: VariantSpec) -> ASRService:
+    if (requested.backend, requested.model_dir) != (spec.backend, spec.model_dir):
+      raise ValueError("Multi-process serving runs a single variant; restart with another --backend/--model_dir")
+    return RemoteASRService(requested, client)
+
+  main.registry.factory = factory
+  ring_bytes = ring.slots * ring.slot_samples * 4
+
+  def serving_info() -> Dict[str, Any]:
+    return {
+      "workers": len(responses),
+      "worker_id": worker_id,
+      "ring_slots": ring.slots,
+      "ring_slots_free": free_slots.qsize(),
+      "memory": memory_report(os.getppid(), ring_bytes),
+    }
+
+  main.app.add_api_route("/serving", serving_info, methods=["GET"])
+
+  config = uvicorn.Config(main.app, log_level=log_level)
+  uvicorn.Server(config).run(sockets=[sock])
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="ASR API: N HTTP workers + one shared inference process")
+  p.add_argument("--host", default="0.0.0.0")
+  p.add_argument("--port", type=int, default=8000)
+  p.add_argument("--workers", type=int, default=int(os.getenv("ASR_HTTP_WORKERS", "0")), help="0 = cores / 2")
+  p.add_argument("--backend", default=os.getenv("ASR_BACKEND", "onnx_int8"))
+  p.add_argument("--model_dir", default=os.getenv("ASR_MODEL_DIR", "models/onnx"))
+  p.add_argument("--max_batch", type=int, default=8, help="Rows per forward pass in the inference process")
+  p.add_argument("--batch_wait_ms", type=float, default=5.0, help="How long to gather a micro-batch")
+  p.add_argument("--slots", type=int, default=0, help="Ring slots (0 = 2 per worker)")
+  p.add_argument("--max_seconds", type=float, default=60.0, help="Audio per ring slot (rows x samples)")
+  p.add_argument("--report_interval", type=float, default=60.0, help="Seconds between memory log lines (0 = off)")
+  p.add_argument("--log_level", default="info")
+  args = p.parse_args()
+  logging.basicConfig(level=logging.INFO)
+
+  workers = args.workers or max(1, (os.cpu_count() or 2) // 2)
+  spec = VariantSpec(name=args.backend, backend=args.backend, model_dir=args.model_dir)
+  # the workers' app.main reads the default variant from env; keep them on the served one
+  os.environ.update(ASR_BACKEND=spec.backend, ASR_MODEL_DIR=spec.model_dir, ASR_BACKENDS="")
+  os.environ["ASR_WORKERS"] = str(workers)
+  if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    # /metrics on any worker then merges the counters of all workers
+    import tempfile
+
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="asr-prom-")
+
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.bind((args.host, args.port))
+  sock.listen(2048)
+  sock.set_inheritable(True)
+
+  ctx = mp.get_context("spawn")
+  slot_samples = int(args.max_seconds * 16_000)
+  n_slots = args.slots or 2 * workers
+  shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_samples * 4)
+  ring = RingSpec(name=shm.name, slots=n_slots, slot_samples=slot_samples)
+  jobs = ctx.Queue()
+  free_slots = ctx.Queue()
+  for i in range(n_slots):
+    free_slots.put(i)
+  responses = [ctx.Queue() for _ in range(workers)]
+
+  inference = ctx.Process(
+    target=_inference_main,
+    args=(spec, ring, jobs, free_slots, responses, args.max_batch, args.batch_wait_ms),
+    name="asr-inference",
+  )
+  inference.start()
+  http = [
+    ctx.Process(
+      target=_http_worker_main,
+      args=(i, sock, spec, ring, jobs, free_slots, responses, args.log_level),
+      name=f"asr-http-{i}",
+    )
+    for i in range(workers)
+  ]
+  for proc in http:
+    proc.start()
+  logger.info("serving %s on %s:%d with %d HTTP workers, %d ring slots", spec, args.host, args.port, workers, n_slots)
+
+  stopping = threading.Event()
+  signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+  signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+  last_report = time.monotonic()
+  try:
+    while not stopping.wait(1.0):
+      if not inference.is_alive() or not all(proc.is_alive() for proc in http):
+        logger.error("a serving process exited; shutting down")
+        break
+      if args.report_interval and time.monotonic() - last_report >= args.report_interval:
+        logger.info("memory: %s", memory_report(os.getpid(), shm.size))
+        last_report = time.monotonic()
+  finally:
+    for proc in http:
+      proc.terminate()
+    jobs.put(None)
+    inference.join(timeout=10)
+    if inference.is_alive():
+      inference.terminate()
+    for proc in http:
+      proc.join(timeout=10)
+    shm.close()
+    shm.unlink()
+    sock.close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import List, Literal, Tuple
+
+import numpy as np
+
+VadMode = Literal["off", "energy", "webrtc"]
+
+
+@dataclass
+class VadConfig:
+  """
+  Speech/silence segmentation before the acoustic model. Only speech regions
+  are sent through wav2vec2, so compute drops with the silence ratio (holds,
+  pauses, ring tones in call-center audio).
+  """
+
+  mode: VadMode = "off"
+  frame_ms: int = 30  # webrtcvad accepts 10 / 20 / 30
+  energy_margin_db: float = 12.0  # energy: speech = this far above the noise floor
+  energy_floor_db: float = -50.0  # ... and never below this level (dBFS)
+  energy_min_spread_db: float = 20.0  # p90 - p10 below this: no silence to learn a noise floor from
+  webrtc_aggressiveness: int = 2  # 0 (lenient) .. 3 (strict)
+  min_speech_s: float = 0.25
+  min_silence_s: float = 0.3  # shorter gaps are merged into one segment
+  pad_s: float = 0.2  # context kept on both sides of a segment
+  max_segment_s: float = 30.0
+  batch_size: int = 8
+  sampling_rate: int = 16_000
+
+  @classmethod
+  def from_env(cls) -> "VadConfig":
+    mode = os.getenv("ASR_VAD", "off").strip().lower()
+    if mode not in ("off", "energy", "webrtc"):
+      raise ValueError(f"ASR_VAD must be off|energy|webrtc, got {mode!r}")
+    return cls(
+      mode=mode,  # type: ignore[arg-type]
+      energy_margin_db=float(os.getenv("ASR_VAD_MARGIN_DB", "12")),
+      energy_min_spread_db=float(os.getenv("ASR_VAD_MIN_SPREAD_DB", "20")),
+      webrtc_aggressiveness=int(os.getenv("ASR_VAD_AGGRESSIVENESS", "2")),
+      min_speech_s=float(os.getenv("ASR_VAD_MIN_SPEECH", "0.25")),
+      min_silence_s=float(os.getenv("ASR_VAD_MIN_SILENCE", "0.3")),
+      pad_s=float(os.getenv("ASR_VAD_PAD", "0.2")),
+      max_segment_s=float(os.getenv("ASR_VAD_MAX_SEGMENT", "30")),
+      batch_size=int(os.getenv("ASR_VAD_BATCH", "8")),
+    )
+
+  @property
+  def enabled(self) -> bool:
+    return self.mode != "off"
+
+
+def _energy_flags(frames: np.ndarray, cfg: VadConfig) -> np.ndarray:
+  rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-12)
+  db = 20.0 * np.log10(rms)
+  # noise floor = quiet end of this recording, so the threshold adapts to line level;
+  # a clip that is speech throughout has no quiet end (p10 is quiet speech), so
+  # only the absolute floor applies there
+  low, high = np.percentile(db, [10, 90])
+  if high - low < cfg.energy_min_spread_db:
+    return db > cfg.energy_floor_db
+  threshold = max(float(low) + cfg.energy_margin_db, cfg.energy_floor_db)
+  return db > threshold
+
+
+def _webrtc_flags(frames: np.ndarray, cfg: VadConfig) -> np.ndarray:
+  try:
+    import webrtcvad
+  except ImportError as e:
+    raise RuntimeError("ASR_VAD=webrtc needs `pip install webrtcvad` (or use ASR_VAD=energy)") from e
+
+  vad = webrtcvad.Vad(cfg.webrtc_aggressiveness)
+  pcm = (np.clip(frames, -1.0, 1.0) * 32767).astype(np.int16)
+  return np.array([vad.is_speech(f.tobytes(), cfg.sampling_rate) for f in pcm], dtype=bool)
+
+
+def detect_speech(audio: np.ndarray, cfg: VadConfig) -> List[Tuple[int, int]]:
+  """Speech regions as [start, end) sample ranges, merged, padded and length-capped."""
+  hop = cfg.sampling_rate * cfg.frame_ms // 1000
+  n_frames = len(audio) // hop
+  if n_frames == 0:
+    return [(0, len(audio))] if len(audio) else []
+
+  frames = audio[: n_frames * hop].reshape(n_frames, hop)
+  flags = _webrtc_flags(frames, cfg) if cfg.mode == "webrtc" else _energy_flags(frames, cfg)
+
+  # runs of speech frames -> sample ranges
+  edges = np.flatnonzero(np.diff(np.concatenate(([0], flags.astype(np.int8), [0]))))
+  runs = [(int(s) * hop, int(e) * hop) for s, e in zip(edges[::2], edges[1::2])]
+
+  sr = cfg.sampling_rate
+  merged: List[List[int]] = []
+  for start, end in runs:
+    if merged and start - merged[-1][1] < cfg.min_silence_s * sr:
+      merged[-1][1] = end
+    else:
+      merged.append([start, end])
+
+  pad = int(cfg.pad_s * sr)
+  max_len = int(cfg.max_segment_s * sr)
+  out: List[Tuple[int, int]] = []
+  for start, end in merged:
+    if end - start < cfg.min_speech_s * sr:
+      continue
+    start, end = max(0, start - pad), min(len(audio), end + pad)
+    if out and start <= out[-1][1]:  # padding made neighbours touch
+      start = out.pop()[0]
+    # long monologues are cut into even pieces no longer than max_segment_s
+    pieces = int(np.ceil((end - start) / max_len))
+    bounds = np.linspace(start, end, pieces + 1).astype(int)
+    out.extend((int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]))
+  return out
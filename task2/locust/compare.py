@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="Side-by-side table of load-test summaries (backends / server configs)")
+  p.add_argument("summaries", nargs="+", help="JSON summaries from locustfile.py or open_loop.py")
+  args = p.parse_args()
+
+  print("| Run | Tool | Backend | Saturation (req/s) | p95 at saturation (s) | Overall p95 (s) | Errors | SLO |")
+  print("|---|---|---|---|---|---|---|---|")
+  for path in args.summaries:
+    s = json.loads(Path(path).read_text(encoding="utf-8"))
+    sat = s.get("saturation") or {}
+    overall = s.get("overall") or {}
+    print(
+      f"| {s.get('label') or Path(path).stem} | {s['tool']} | {s.get('backend') or 'default'} "
+      f"| {sat.get('rps', '-')} | {sat.get('p95_s', '-')} | {overall.get('p95_s', '-')} "
+      f"| {overall.get('error_rate', '-')} | {'pass' if s.get('slo_passed') else 'FAIL'} |"
+    )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import io
+import json
+import threading
+import time
+import urllib.request
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+SAMPLE = ROOT / "samples" / "sample.wav"
+
+# soundfile format / subtype per extension
+_FORMATS = {
+  "wav": ("WAV", "PCM_16", "audio/wav"),
+  "flac": ("FLAC", "PCM_16", "audio/flac"),
+  "ogg": ("OGG", "VORBIS", "audio/ogg"),
+  "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg"),
+}
+
+
+@dataclass
+class Clip:
+  name: str
+  data: bytes
+  mime: str
+  duration_s: float
+
+
+def build_corpus(durations: List[float], formats: List[str], sample: Path = SAMPLE) -> List[Clip]:
+  """
+  Mixed-length, mixed-format upload corpus built in memory from the sample clip
+  (tiled to each duration), so runs are reproducible without extra files.
+  Formats the local libsndfile cannot write (e.g. mp3 on old builds) are skipped.
+  """
+  import librosa
+  import soundfile as sf
+
+  if not sample.exists():
+    raise FileNotFoundError(f"Missing sample file: {sample}")
+  base, _ = librosa.load(sample.as_posix(), sr=16_000, mono=True)
+
+  clips: List[Clip] = []
+  for sec in durations:
+    n = int(sec * 16_000)
+    audio = np.tile(base, int(np.ceil(n / len(base))))[:n]
+    for ext in formats:
+      fmt, subtype, mime = _FORMATS[ext]
+      buf = io.BytesIO()
+      try:
+        sf.write(buf, audio, 16_000, format=fmt, subtype=subtype)
+      except Exception as e:
+        print(f"[loadtest] skipping {ext}: {e}")
+        continue
+      clips.append(Clip(name=f"clip_{sec:g}s.{ext}", data=buf.getvalue(), mime=mime, duration_s=sec))
+  if not clips:
+    raise RuntimeError("Empty load-test corpus")
+  return clips
+
+
+@dataclass
+class SLO:
+  p95_s: Optional[float] = None  # p95 latency must stay under this ...
+  min_rps: Optional[float] = None  # ... at (at least) this throughput
+  max_error_rate: float = 0.01
+
+
+class Recorder:
+  """Thread-safe request log, split into load steps (users or arrival rate)."""
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self.samples: List[Tuple[float, float, bool, str]] = []  # (t_done, latency_s, ok, tag)
+    self.steps: List[Tuple[float, float]] = []  # (t_start, load)
+    self.started = time.time()
+
+  def mark_step(self, load: float) -> None:
+    with self._lock:
+      self.steps.append((time.time(), load))
+
+  def add(self, latency_s: float, ok: bool, tag: str = "") -> None:
+    with self._lock:
+      self.samples.append((time.time(), latency_s, ok, tag))
+
+  def step_summaries(self, load_name: str) -> List[Dict[str, Any]]:
+    with self._lock:
+      samples = list(self.samples)
+      steps = list(self.steps) or [(self.started, 0.0)]
+    end = time.time()
+    out = []
+    for i, (t0, load) in enumerate(steps):
+      t1 = steps[i + 1][0] if i + 1 < len(steps) else end
+      window = [s for s in samples if t0 <= s[0] < t1]
+      out.append({load_name: load, **window_stats(window, t1 - t0)})
+    return out
+
+  def by_tag(self) -> Dict[str, Dict[str, Any]]:
+    with self._lock:
+      samples = list(self.samples)
+    span = max(1e-9, (samples[-1][0] - self.started) if samples else 0.0)
+    tags = sorted({s[3] for s in samples})
+    return {tag: window_stats([s for s in samples if s[3] == tag], span) for tag in tags}
+
+  def overall(self) -> Dict[str, Any]:
+    with self._lock:
+      samples = list(self.samples)
+    span = (samples[-1][0] - self.started) if samples else 0.0
+    return window_stats(samples, span)
+
+
+# shared by locustfile.py and step_shape.py
+RECORDER = Recorder()
+
+
+def window_stats(samples: List[Tuple[float, float, bool, str]], duration_s: float) -> Dict[str, Any]:
+  ok = np.array([s[1] for s in samples if s[2]], dtype=np.float64)
+  n = len(samples)
+  failures = n - len(ok)
+  pct = lambda q: round(float(np.percentile(ok, q)), 4) if len(ok) else None  # noqa: E731
+  return {
+    "duration_s": round(duration_s, 2),
+    "requests": n,
+    "failures": failures,
+    "error_rate": round(failures / n, 4) if n else 0.0,
+    "rps": round(len(ok) / duration_s, 3) if duration_s > 0 else 0.0,
+    "p50_s": pct(50),
+    "p95_s": pct(95),
+    "p99_s": pct(99),
+  }
+
+
+def evaluate(steps: List[Dict[str, Any]], slo: SLO) -> Dict[str, Any]:
+  """
+  Saturation = best sustained throughput of any step whose errors stay in
+  budget. The SLO passes if some step reaches `min_rps` with p95 <= `p95_s`.
+  """
+  healthy = [s for s in steps if s["requests"] and s["error_rate"] <= slo.max_error_rate]
+  saturation = max(healthy, key=lambda s: s["rps"], default=None)
+
+  passed = True
+  if slo.p95_s is not None or slo.min_rps is not None:
+    passed = any(
+      (slo.min_rps is None or s["rps"] >= slo.min_rps)
+      and (slo.p95_s is None or (s["p95_s"] is not None and s["p95_s"] <= slo.p95_s))
+      for s in healthy
+    )
+  return {"slo": asdict(slo), "slo_passed": passed, "saturation": saturation}
+
+
+def request_params(backend: str, use_cache: bool) -> Dict[str, str]:
+  """
+  Query string for /transcribe. The corpus is a handful of fixed clips, so
+  with the result cache on every request after the first pass would be a cache
+  hit: it is bypassed unless the run is meant to measure the cache.
+  """
+  params = {"backend": backend} if backend else {}
+  if not use_cache:
+    params["no_cache"] = "true"
+  return params
+
+
+def fetch_server_info(host: str) -> Dict[str, Any]:
+  """Backend / variant info from the API so summaries are comparable across configs."""
+  info: Dict[str, Any] = {}
+  for path in ("/ready", "/models"):
+    try:
+      with urllib.request.urlopen(host.rstrip("/") + path, timeout=5) as resp:
+        info[path.strip("/")] = json.loads(resp.read().decode("utf-8"))
+    except Exception as e:
+      info[path.strip("/")] = {"error": repr(e)}
+  return info
+
+
+def write_summary(path: str, summary: Dict[str, Any]) -> None:
+  out = Path(path)
+  out.parent.mkdir(parents=True, exist_ok=True)
+  out.write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+  print(f"[loadtest] summary: {out.as_posix()} (slo_passed={summary.get('slo_passed')})")
@@ -1,18 +1,88 @@
-﻿from locust import HttpUser, task, between
-from pathlib import Path
+﻿from __future__ import annotations
+
+import os
+import random
+import time
+
+from locust import HttpUser, between, events, task
+
+import loadtest as lt
+
+CORPUS: list[lt.Clip] = []
+RECORDER = lt.RECORDER
+
+
+@events.init_command_line_parser.add_listener
+def _add_arguments(parser) -> None:
+  g = parser.add_argument_group("ASR load test")
+  g.add_argument("--audio-durations", default="2,5,10,20", help="Clip lengths in seconds (comma-separated)")
+  g.add_argument("--audio-formats", default="wav,flac,ogg,mp3")
+  g.add_argument("--asr-backend", default="", help="Model variant sent as ?backend=")
+  g.add_argument("--use-cache", action="store_true", help="Let the server answer from its transcription cache")
+  g.add_argument("--seed", type=int, default=42)
+  g.add_argument("--step-users", type=int, default=2, help="Step shape: users added per step")
+  g.add_argument("--step-seconds", type=int, default=60, help="Step shape: step length")
+  g.add_argument("--step-max-users", type=int, default=20, help="Step shape: last step")
+  g.add_argument("--slo-p95", type=float, default=None, help="SLO: p95 latency (s) ...")
+  g.add_argument("--slo-rps", type=float, default=None, help="SLO: ... at this throughput")
+  g.add_argument("--slo-max-error-rate", type=float, default=0.01)
+  g.add_argument("--label", default=os.getenv("ASR_BACKEND", ""), help="Free-form run label for the summary")
+  g.add_argument("--summary-out", default="artifacts/loadtest/locust_summary.json")
+
+
+@events.init.add_listener
+def _on_init(environment, **_) -> None:
+  opts = environment.parsed_options
+  random.seed(opts.seed)
+  durations = [float(x) for x in opts.audio_durations.split(",") if x.strip()]
+  formats = [x.strip() for x in opts.audio_formats.split(",") if x.strip()]
+  CORPUS.extend(lt.build_corpus(durations, formats))
+
+
+@events.test_start.add_listener
+def _on_test_start(environment, **_) -> None:
+  RECORDER.started = time.time()
+  # with a load shape the steps are marked by the shape itself
+  if environment.shape_class is None:
+    RECORDER.mark_step(environment.parsed_options.num_users or 0)
+
+
+@events.request.add_listener
+def _on_request(request_type, name, response_time, exception=None, **_) -> None:
+  RECORDER.add(response_time / 1000.0, exception is None, tag=name)
+
+
+@events.quitting.add_listener
+def _on_quit(environment, **_) -> None:
+  opts = environment.parsed_options
+  steps = RECORDER.step_summaries("users")
+  slo = lt.SLO(p95_s=opts.slo_p95, min_rps=opts.slo_rps, max_error_rate=opts.slo_max_error_rate)
+  summary = {
+    "tool": "locust",
+    "mode": "closed_loop",
+    "label": opts.label,
+    "target": environment.host,
+    "backend": opts.asr_backend or None,
+    "cache": opts.use_cache,
+    "server": lt.fetch_server_info(environment.host),
+    "steps": steps,
+    "by_clip": RECORDER.by_tag(),
+    "overall": RECORDER.overall(),
+    **lt.evaluate(steps, slo),
+  }
+  lt.write_summary(opts.summary_out, summary)
+  if not summary["slo_passed"]:
+    environment.process_exit_code = 1
 
-ROOT = Path(__file__).resolve().parents[1]
-SAMPLE = ROOT / "samples" / "sample.wav"
 
 class ASRUser(HttpUser):
   wait_time = between(0.5, 1.5)
 
   @task
   def transcribe(self):
-    if not SAMPLE.exists():
-      # show in Locust exceptions if sample missing
-      raise FileNotFoundError(f"Missing sample file: {SAMPLE}")
-
-    with SAMPLE.open("rb") as f:
-      files = {"file": (SAMPLE.name, f, "audio/wav")}
-      self.client.post("/transcribe", files=files, timeout=60)
\ No newline at end of file
+    clip = random.choice(CORPUS)
+    opts = self.environment.parsed_options
+    params = lt.request_params(opts.asr_backend, opts.use_cache)
+    files = {"file": (clip.name, clip.data, clip.mime)}
+    # one stats row per clip length/format
+    self.client.post("/transcribe", files=files, params=params, timeout=120, name=f"/transcribe [{clip.name}]")
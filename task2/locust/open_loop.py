@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from typing import List
+
+import httpx
+
+import loadtest as lt
+
+
+async def _one(client: httpx.AsyncClient, clip: lt.Clip, params: dict, rec: lt.Recorder, inflight: List[int]) -> None:
+  inflight[0] += 1
+  inflight[1] = max(inflight[1], inflight[0])
+  start = time.perf_counter()
+  ok = False
+  try:
+    resp = await client.post("/transcribe", files={"file": (clip.name, clip.data, clip.mime)}, params=params)
+    ok = resp.status_code == 200
+  except httpx.HTTPError:
+    pass
+  finally:
+    inflight[0] -= 1
+    rec.add(time.perf_counter() - start, ok, tag=clip.name)
+
+
+async def run_step(
+  client: httpx.AsyncClient,
+  corpus: List[lt.Clip],
+  rate: float,
+  seconds: float,
+  params: dict,
+  rec: lt.Recorder,
+  rng: random.Random,
+  poisson: bool,
+) -> int:
+  """
+  Fire requests at `rate` per second regardless of how fast the server answers
+  (open loop), so queueing shows up as latency instead of a lower send rate.
+  Returns the peak number of in-flight requests.
+  """
+  inflight = [0, 0]
+  tasks = []
+  rec.mark_step(rate)
+  t_end = time.perf_counter() + seconds
+  next_t = time.perf_counter()
+  while next_t < t_end:
+    delay = next_t - time.perf_counter()
+    if delay > 0:
+      await asyncio.sleep(delay)
+    tasks.append(asyncio.create_task(_one(client, rng.choice(corpus), params, rec, inflight)))
+    next_t += rng.expovariate(rate) if poisson else 1.0 / rate
+  # in-flight requests still count towards this step
+  await asyncio.gather(*tasks)
+  return inflight[1]
+
+
+async def main_async(args: argparse.Namespace) -> int:
+  rng = random.Random(args.seed)
+  durations = [float(x) for x in args.audio_durations.split(",") if x.strip()]
+  formats = [x.strip() for x in args.audio_formats.split(",") if x.strip()]
+  corpus = lt.build_corpus(durations, formats)
+  rates = [float(x) for x in args.rates.split(",") if x.strip()]
+  params = lt.request_params(args.backend, args.use_cache)
+
+  rec = lt.Recorder()
+  peaks = []
+  limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+  async with httpx.AsyncClient(base_url=args.host, timeout=args.timeout, limits=limits) as client:
+    for rate in rates:
+      print(f"[open_loop] {rate} req/s for {args.step_seconds}s")
+      peaks.append(await run_step(client, corpus, rate, args.step_seconds, params, rec, rng, args.poisson))
+
+  steps = rec.step_summaries("offered_rps")
+  for step, peak in zip(steps, peaks):
+    step["peak_in_flight"] = peak
+  slo = lt.SLO(p95_s=args.slo_p95, min_rps=args.slo_rps, max_error_rate=args.slo_max_error_rate)
+  summary = {
+    "tool": "open_loop",
+    "mode": "poisson" if args.poisson else "constant",
+    "label": args.label,
+    "target": args.host,
+    "backend": args.backend or None,
+    "cache": args.use_cache,
+    "server": lt.fetch_server_info(args.host),
+    "steps": steps,
+    "by_clip": rec.by_tag(),
+    "overall": rec.overall(),
+    **lt.evaluate(steps, slo),
+  }
+  lt.write_summary(args.summary_out, summary)
+  return 0 if summary["slo_passed"] else 1
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="Open-loop (constant arrival rate) load test for /transcribe")
+  p.add_argument("--host", default="http://localhost:8000")
+  p.add_argument("--rates", default="0.25,0.5,1,2", help="Arrival rates (req/s) stepped in order")
+  p.add_argument("--step_seconds", type=float, default=60)
+  p.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times instead of constant")
+  p.add_argument("--audio_durations", default="2,5,10,20")
+  p.add_argument("--audio_formats", default="wav,flac,ogg,mp3")
+  p.add_argument("--backend", default="", help="Model variant sent as ?backend=")
+  p.add_argument("--use_cache", action="store_true", help="Let the server answer from its transcription cache")
+  p.add_argument("--timeout", type=float, default=120)
+  p.add_argument("--max_connections", type=int, default=256)
+  p.add_argument("--seed", type=int, default=42)
+  p.add_argument("--slo_p95", type=float, default=None)
+  p.add_argument("--slo_rps", type=float, default=None)
+  p.add_argument("--slo_max_error_rate", type=float, default=0.01)
+  p.add_argument("--label", default="")
+  p.add_argument("--summary_out", default="artifacts/loadtest/open_loop_summary.json")
+  args = p.parse_args()
+  sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+  main()
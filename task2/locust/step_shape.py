@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from locust import LoadTestShape
+
+from loadtest import RECORDER
+
+
+class StepLoadShape(LoadTestShape):
+  """
+  Stepped ramp (--step-users every --step-seconds up to --step-max-users) to
+  find saturation: each step is summarized separately in the run summary.
+  Enable with `-f locust/locustfile.py,locust/step_shape.py`.
+  """
+
+  _current = None
+
+  def tick(self):
+    opts = self.runner.environment.parsed_options
+    run_time = self.get_run_time()
+    step = int(run_time // opts.step_seconds) + 1
+    users = step * opts.step_users
+    if users > opts.step_max_users:
+      return None
+    if users != self._current:
+      self._current = users
+      RECORDER.mark_step(users)
+    return users, max(1, opts.step_users)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+AUDIO_EXTS = (".wav", ".mp3", ".m4a", ".flac", ".ogg")
+
+
+@dataclass
+class AudioItem:
+  id: str
+  audio: str
+  text: Optional[str] = None
+
+
+def read_manifest(path: str) -> List[AudioItem]:
+  """
+  Audio inputs shared by the scripts (benchmark, calibration, batch transcription, ...).
+
+  - a directory: every audio file under it; transcript from a sibling `<name>.txt` if present
+  - a JSONL manifest: one {"audio": ..., "text": ..., "id": ...} per line
+    ("audio_filepath"/"path" also accepted; relative paths resolve against the manifest's folder)
+  """
+  src = Path(path)
+  if not src.exists():
+    raise FileNotFoundError(f"Audio manifest/folder not found: {src}")
+
+  items: List[AudioItem] = []
+  if src.is_dir():
+    for p in sorted(src.rglob("*")):
+      if p.suffix.lower() not in AUDIO_EXTS:
+        continue
+      txt = p.with_suffix(".txt")
+      text = txt.read_text(encoding="utf-8").strip() if txt.exists() else None
+      items.append(AudioItem(id=p.relative_to(src).as_posix(), audio=p.as_posix(), text=text))
+    return items
+
+  with src.open("r", encoding="utf-8") as f:
+    for line_no, line in enumerate(f, start=1):
+      line = line.strip()
+      if not line:
+        continue
+      row = json.loads(line)
+      audio = row.get("audio") or row.get("audio_filepath") or row.get("path")
+      if not audio:
+        raise ValueError(f"{src}:{line_no}: missing 'audio' field")
+      audio_path = Path(audio)
+      if not audio_path.is_absolute():
+        audio_path = src.parent / audio_path
+      items.append(AudioItem(id=str(row.get("id", audio)), audio=audio_path.as_posix(), text=row.get("text")))
+  return items
@@ -1,125 +1,407 @@
 ﻿from __future__ import annotations
 
 import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import tempfile
 import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
-import torch
-import librosa
-import onnxruntime as ort
-from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+import psutil
 
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
 
-def load_audio(path: str) -> np.ndarray:
-  audio, _ = librosa.load(path, sr=16_000, mono=True)
-  return audio.astype(np.float32)
+from audio_manifest import AudioItem, read_manifest  # noqa: E402
 
+STAGES = ("decode_audio", "features", "inference", "ctc_decode")
 
-def dir_size_mb(path: Path) -> float:
-  total = 0
-  for p in path.rglob("*"):
-    if p.is_file():
-      total += p.stat().st_size
-  return round(total / (1024 * 1024), 2)
+
+@dataclass
+class Variant:
+  name: str
+  backend: str
+  model_dir: str
+
+
+@dataclass
+class BenchConfig:
+  durations: List[float]
+  batch_sizes: List[int]
+  threads: List[int]
+  decoders: List[str]
+  runs: int
+  warmup_runs: int
+  beam_width: int
+  lm_path: Optional[str]
+  manifest: List[AudioItem] = field(default_factory=list)
+
+
+def parse_variant(raw: str) -> Variant:
+  # name=backend@model_dir
+  name, _, rest = raw.partition("=")
+  backend, _, model_dir = rest.partition("@")
+  if not (name and backend and model_dir):
+    raise argparse.ArgumentTypeError(f"Expected name=backend@model_dir, got: {raw}")
+  return Variant(name=name.strip(), backend=backend.strip(), model_dir=model_dir.strip())
+
+
+def parse_list(raw: str, cast) -> list:
+  return [cast(x) for x in raw.split(",") if x.strip()]
 
 
 def file_size_mb(path: Path) -> float:
   return round(path.stat().st_size / (1024 * 1024), 2)
 
 
-def run_pytorch(model_dir: str, audio: np.ndarray, runs: int) -> float:
-  device = "cuda" if torch.cuda.is_available() else "cpu"
-  processor = Wav2Vec2Processor.from_pretrained(model_dir)
-  model = Wav2Vec2ForCTC.from_pretrained(model_dir).to(device)
-  model.eval()
+def weights_size_mb(model_dir: str) -> float:
+  """
+  Size of the weight files of a local folder or of a Hub id resolved from the
+  local HF cache (the old report read 0.0 MB for a Hub id because the folder
+  did not exist).
+  """
+  path = Path(model_dir)
+  if not path.exists():
+    from huggingface_hub import snapshot_download
 
-  inputs = processor(audio, sampling_rate=16_000, return_tensors="pt", padding=True)
-  input_values = inputs.input_values.to(device)
-  attn = getattr(inputs, "attention_mask", None)
-  if attn is not None:
-    attn = attn.to(device)
+    path = Path(snapshot_download(model_dir, local_files_only=True))
+  total = sum(p.stat().st_size for p in path.rglob("*") if p.suffix in (".bin", ".safetensors"))
+  return round(total / (1024 * 1024), 2)
 
-  # warmup
-  with torch.no_grad():
-    _ = model(input_values, attention_mask=attn)
 
-  times = []
-  for _ in range(runs):
-    start = time.perf_counter()
-    with torch.no_grad():
-      out = model(input_values, attention_mask=attn)
-      _ = out.logits
-    times.append(time.perf_counter() - start)
+def peak_rss_mb() -> float:
+  try:
+    import resource
+
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+  except ImportError:  # Windows
+    return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 2)
 
-  return float(np.mean(times))
 
+def summarize(samples: Dict[str, List[float]], audio_seconds: float, batch: int) -> Dict[str, Any]:
+  total = np.sum([samples[s] for s in STAGES], axis=0)
+  mean_total = float(np.mean(total))
+  return {
+    "p50_s": round(float(np.percentile(total, 50)), 4),
+    "p90_s": round(float(np.percentile(total, 90)), 4),
+    "p99_s": round(float(np.percentile(total, 99)), 4),
+    "mean_s": round(mean_total, 4),
+    "rtf": round(mean_total / (audio_seconds * batch), 4),
+    "throughput_rps": round(batch / mean_total, 3),
+    "throughput_audio_x": round(audio_seconds * batch / mean_total, 2),
+    "stages_mean_s": {s: round(float(np.mean(samples[s])), 5) for s in STAGES},
+  }
 
-def run_onnx(model_dir: str, onnx_path: str, audio: np.ndarray, runs: int) -> float:
-  processor = Wav2Vec2Processor.from_pretrained(model_dir)
-  inputs = processor(audio, sampling_rate=16_000, return_tensors="pt", padding=True)
-  input_values = inputs.input_values.numpy()
-  attention_mask = getattr(inputs, "attention_mask", None)
-  attention_mask_np = attention_mask.numpy() if attention_mask is not None else None
 
-  sess = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+def word_error_rate(refs: List[str], hyps: List[str]) -> float:
+  import jiwer
 
-  # warmup
-  ort_inputs = {"input_values": input_values}
-  if attention_mask_np is not None and any(i.name == "attention_mask" for i in sess.get_inputs()):
-    ort_inputs["attention_mask"] = attention_mask_np
-  _ = sess.run(None, ort_inputs)
+  norm = lambda t: " ".join(t.lower().split())  # noqa: E731
+  return round(float(jiwer.wer([norm(r) for r in refs], [norm(h) for h in hyps])), 4)
+
+
+def bench_variant(variant: Variant, cfg: BenchConfig, audio_files: List[Tuple[float, str]]) -> Dict[str, Any]:
+  """
+  Runs in its own process (spawned) so load time and peak RSS belong to this
+  variant only. The `pytorch` backend loads the HF processor once and shares it
+  by every thread-count configuration; ONNX variants use the NumPy frontend
+  (preprocessor_config.json + vocab.json) like the service, so transformers is
+  never imported for them. The frontend load time is reported separately from
+  the model's.
+  """
+  from app.asr import ASRService, load_audio, onnx_file_for
+  from app.ctc import BeamSearchConfig, load_vocab
+  from app.features import NumpyFeatureExtractor
+  from app.ort_config import OrtSessionConfig
+
+  onnx_name = onnx_file_for(variant.backend)
+  size_mb = file_size_mb(Path(variant.model_dir) / onnx_name) if onnx_name else weights_size_mb(variant.model_dir)
+
+  start = time.perf_counter()
+  processor = None
+  if variant.backend == "pytorch":
+    from transformers import Wav2Vec2Processor
+
+    processor = Wav2Vec2Processor.from_pretrained(variant.model_dir)
+  else:
+    # same files ASRService reads when no processor is passed
+    NumpyFeatureExtractor.from_model_dir(variant.model_dir)
+    load_vocab(variant.model_dir)
+  processor_load_s = round(time.perf_counter() - start, 3)
+
+  beam_cfg = BeamSearchConfig(beam_width=cfg.beam_width, kenlm_path=cfg.lm_path, workers=0)
+  rows: List[Dict[str, Any]] = []
+  load_times: Dict[str, float] = {}
+  wer: Dict[str, float] = {}
+
+  for threads in cfg.threads:
+    session_cfg = OrtSessionConfig.from_env()
+    session_cfg.intra_op_threads = threads
+    if variant.backend == "pytorch":
+      import torch
+
+      torch.set_num_threads(threads)
 
-  times = []
-  for _ in range(runs):
     start = time.perf_counter()
-    _ = sess.run(None, ort_inputs)
-    times.append(time.perf_counter() - start)
+    svc = ASRService(
+      model_dir=variant.model_dir,
+      backend=variant.backend,  # type: ignore[arg-type]
+      beam_config=beam_cfg,
+      session_config=session_cfg,
+      processor=processor,
+    )
+    load_times[str(threads)] = round(time.perf_counter() - start, 3)
+    svc.warmup((1.0,))
+
+    decoders = {"greedy": svc.decoder.decode}
+    if "beam" in cfg.decoders:
+      decoders["beam"] = svc.beam_decoder.decode
+
+    for batch in cfg.batch_sizes:
+      for duration, path in audio_files:
+        samples = {name: {s: [] for s in STAGES} for name in decoders}
+        for i in range(cfg.warmup_runs + cfg.runs):
+          t0 = time.perf_counter()
+          audios = [load_audio(path) for _ in range(batch)]
+          t1 = time.perf_counter()
+          input_values, attention_mask = svc.extract_features(audios)
+          t2 = time.perf_counter()
+          logits = svc.infer(input_values, attention_mask)
+          t3 = time.perf_counter()
+          decode_times = {}
+          for name, decode in decoders.items():
+            d0 = time.perf_counter()
+            decode(logits)
+            decode_times[name] = time.perf_counter() - d0
+          if i < cfg.warmup_runs:
+            continue
+          for name in decoders:
+            samples[name]["decode_audio"].append(t1 - t0)
+            samples[name]["features"].append(t2 - t1)
+            samples[name]["inference"].append(t3 - t2)
+            samples[name]["ctc_decode"].append(decode_times[name])
 
-  return float(np.mean(times))
+        for name in decoders:
+          rows.append({
+            "variant": variant.name,
+            "threads": threads,
+            "batch": batch,
+            "duration_s": duration,
+            "decoder": name,
+            **summarize(samples[name], duration, batch),
+          })
+
+    # WER is independent of the thread count: measure once
+    if cfg.manifest and not wer:
+      labelled = [it for it in cfg.manifest if it.text]
+      for name in decoders:
+        hyps = [svc.transcribe_file(it.audio, decoder=name).text for it in labelled]  # type: ignore[arg-type]
+        wer[name] = word_error_rate([it.text or "" for it in labelled], hyps)
+
+    svc.close()
+
+  return {
+    **asdict(variant),
+    "model_size_mb": size_mb,
+    "processor_load_s": processor_load_s,
+    "model_load_s": load_times,
+    "peak_rss_mb": peak_rss_mb(),
+    "wer": wer,
+    "rows": rows,
+  }
+
+
+def make_audio_files(audio_path: str, durations: List[float], out_dir: Path) -> List[Tuple[float, str]]:
+  """Tile the sample clip to each requested duration and write it as 16 kHz WAV."""
+  import librosa
+  import soundfile as sf
+
+  base, _ = librosa.load(audio_path, sr=16_000, mono=True)
+  files = []
+  for sec in durations:
+    n = int(sec * 16_000)
+    audio = np.tile(base, int(np.ceil(n / len(base))))[:n]
+    path = out_dir / f"bench_{sec:g}s.wav"
+    sf.write(path.as_posix(), audio, 16_000)
+    files.append((sec, path.as_posix()))
+  return files
+
+
+def row_key(row: Dict[str, Any]) -> str:
+  return f"{row['variant']}/t{row['threads']}/b{row['batch']}/{row['duration_s']:g}s/{row['decoder']}"
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+  base_rows = {row_key(r): r for v in baseline["variants"] for r in v["rows"]}
+  out = []
+  for v in results["variants"]:
+    for row in v["rows"]:
+      base = base_rows.get(row_key(row))
+      if base is None:
+        continue
+      for metric in ("p50_s", "p90_s"):
+        ratio = row[metric] / base[metric] if base[metric] else 1.0
+        out.append({
+          "key": row_key(row),
+          "metric": metric,
+          "baseline": base[metric],
+          "current": row[metric],
+          "change_pct": round((ratio - 1.0) * 100, 1),
+          "regression": ratio > 1.0 + threshold,
+        })
+  return out
+
+
+def render_markdown(results: Dict[str, Any]) -> str:
+  meta = results["meta"]
+  md = ["# Benchmark Report: ASR backends\n\n"]
+  md.append(f"- Host: `{meta['platform']}`, {meta['cpu_count']} CPU, {meta['ram_gb']} GB RAM\n")
+  md.append(f"- Audio: `{meta['audio_path']}`, runs: `{meta['runs']}` (+{meta['warmup_runs']} warmup)\n")
+  md.append("- Latency = decode audio + feature extraction + inference + CTC decode (per request batch)\n\n")
+
+  md.append("## Models\n\n")
+  md.append("| Variant | Backend | Size (MB) | Frontend load (s) | Model load (s) by threads | Peak RSS (MB) | WER |\n")
+  md.append("|---|---|---|---|---|---|---|\n")
+  for v in results["variants"]:
+    loads = ", ".join(f"{t}t: {s}" for t, s in v["model_load_s"].items())
+    wer = ", ".join(f"{d}: {w}" for d, w in v["wer"].items()) or "-"
+    md.append(
+      f"| {v['name']} | {v['backend']} | {v['model_size_mb']} | {v['processor_load_s']} | {loads} "
+      f"| {v['peak_rss_mb']} | {wer} |\n"
+    )
+
+  md.append("\n## Latency\n\n")
+  md.append("| Variant | Threads | Batch | Audio (s) | Decoder | p50 (s) | p90 (s) | p99 (s) | RTF | req/s "
+            "| decode audio | features | inference | CTC decode |\n")
+  md.append("|---|---|---|---|---|---|---|---|---|---|---|---|---|---|\n")
+  for v in results["variants"]:
+    for r in v["rows"]:
+      st = r["stages_mean_s"]
+      md.append(
+        f"| {r['variant']} | {r['threads']} | {r['batch']} | {r['duration_s']:g} | {r['decoder']} "
+        f"| {r['p50_s']} | {r['p90_s']} | {r['p99_s']} | {r['rtf']} | {r['throughput_rps']} "
+        f"| {st['decode_audio']} | {st['features']} | {st['inference']} | {st['ctc_decode']} |\n"
+      )
+
+  if "comparison" in results:
+    regressions = [c for c in results["comparison"] if c["regression"]]
+    md.append(f"\n## Baseline comparison\n\n- Threshold: +{results['meta']['regression_threshold'] * 100:g}%\n")
+    md.append(f"- Regressions: **{len(regressions)}**\n\n")
+    md.append("| Key | Metric | Baseline (s) | Current (s) | Change |\n|---|---|---|---|---|\n")
+    for c in results["comparison"]:
+      flag = " ⚠️" if c["regression"] else ""
+      md.append(f"| {c['key']} | {c['metric']} | {c['baseline']} | {c['current']} | {c['change_pct']:+}%{flag} |\n")
+  return "".join(md)
 
 
 def main() -> None:
   p = argparse.ArgumentParser()
-  p.add_argument("--checkpoint_dir", required=True)
-  p.add_argument("--onnx_path", required=True)
-  p.add_argument("--onnx_int8_path", required=True)
-  p.add_argument("--audio_path", required=True)
+  p.add_argument(
+    "--variant",
+    action="append",
+    type=parse_variant,
+    default=None,
+    help="name=backend@model_dir (repeatable), e.g. onnx_int8=onnx_int8@models/onnx",
+  )
+  p.add_argument("--checkpoint_dir", default=None, help="Shorthand for a pytorch variant")
+  p.add_argument("--onnx_dir", default=None, help="Shorthand for onnx + onnx_int8 variants")
+  p.add_argument("--audio_path", default="samples/sample.wav")
+  p.add_argument("--durations", default="1,5,15,30", help="Seconds (sample is tiled to each length)")
+  p.add_argument("--batch_sizes", default="1,4")
+  p.add_argument("--threads", default=str(os.cpu_count() or 1), help="ORT/torch intra-op thread counts, e.g. 1,2,4")
+  p.add_argument("--decoders", default="greedy", help="greedy and/or beam")
+  p.add_argument("--beam_width", type=int, default=32)
+  p.add_argument("--lm_path", default=None, help="KenLM .arpa/.bin for beam shallow fusion")
+  p.add_argument("--manifest", default=None, help="Folder/JSONL with reference transcripts (enables WER)")
   p.add_argument("--runs", type=int, default=20)
+  p.add_argument("--warmup_runs", type=int, default=2)
+  p.add_argument("--baseline", default=None, help="Previous benchmark JSON to compare against")
+  p.add_argument("--regression_threshold", type=float, default=0.10)
+  p.add_argument("--fail_on_regression", action="store_true")
+  p.add_argument("--no_isolate", action="store_true", help="Run variants in this process (peak RSS is then cumulative)")
   p.add_argument("--out", default="artifacts/benchmark_report.md")
   args = p.parse_args()
 
-  ckpt = Path(args.checkpoint_dir)
-  onnx = Path(args.onnx_path)
-  int8 = Path(args.onnx_int8_path)
+  variants: List[Variant] = list(args.variant or [])
+  if args.checkpoint_dir:
+    variants.append(Variant("pytorch", "pytorch", args.checkpoint_dir))
+  if args.onnx_dir:
+    variants.append(Variant("onnx", "onnx", args.onnx_dir))
+    variants.append(Variant("onnx_int8", "onnx_int8", args.onnx_dir))
+    # optional artifacts from export.py --optimize/--fp16 and quantize.py --mode static
+    for backend, name in (
+      ("onnx_opt", "model_opt.onnx"),
+      ("onnx_fp16", "model_fp16.onnx"),
+      ("onnx_int8_static", "model_int8_static.onnx"),
+    ):
+      if (Path(args.onnx_dir) / name).exists():
+        variants.append(Variant(backend, backend, args.onnx_dir))
+  if not variants:
+    p.error("Give at least one --variant (or --checkpoint_dir / --onnx_dir)")
+
+  cfg = BenchConfig(
+    durations=parse_list(args.durations, float),
+    batch_sizes=parse_list(args.batch_sizes, int),
+    threads=parse_list(args.threads, int),
+    decoders=parse_list(args.decoders, str),
+    runs=args.runs,
+    warmup_runs=args.warmup_runs,
+    beam_width=args.beam_width,
+    lm_path=args.lm_path,
+    manifest=read_manifest(args.manifest) if args.manifest else [],
+  )
+
   out = Path(args.out)
   out.parent.mkdir(parents=True, exist_ok=True)
 
-  audio = load_audio(args.audio_path)
-
-  pt_size = dir_size_mb(ckpt)
-  onnx_size = file_size_mb(onnx)
-  int8_size = file_size_mb(int8)
-
-  pt_time = run_pytorch(ckpt.as_posix(), audio, args.runs)
-  onnx_time = run_onnx(ckpt.as_posix(), onnx.as_posix(), audio, args.runs)
-  int8_time = run_onnx(ckpt.as_posix(), int8.as_posix(), audio, args.runs)
-
-  md = []
-  md.append("# Benchmark Report: PyTorch vs ONNX\n")
-  md.append(f"- Audio: `{args.audio_path}`\n")
-  md.append(f"- Runs: `{args.runs}` (average latency)\n\n")
-  md.append("## Model ölçüsü (MB)\n")
-  md.append(f"- PyTorch checkpoint folder: **{pt_size} MB**\n")
-  md.append(f"- ONNX (float): **{onnx_size} MB**\n")
-  md.append(f"- ONNX (int8): **{int8_size} MB**\n\n")
-  md.append("## Inference time (seconds, average)\n")
-  md.append(f"- PyTorch: **{pt_time:.4f} s**\n")
-  md.append(f"- ONNX (float): **{onnx_time:.4f} s**\n")
-  md.append(f"- ONNX (int8): **{int8_time:.4f} s**\n")
-
-  out.write_text("".join(md), encoding="utf-8")
-  print(f"[benchmark] wrote: {out.as_posix()}")
+  results: Dict[str, Any] = {
+    "meta": {
+      "platform": platform.platform(),
+      "cpu_count": os.cpu_count(),
+      "ram_gb": round(psutil.virtual_memory().total / 1024**3, 1),
+      "audio_path": args.audio_path,
+      "runs": args.runs,
+      "warmup_runs": args.warmup_runs,
+      "regression_threshold": args.regression_threshold,
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    },
+    "variants": [],
+  }
+
+  with tempfile.TemporaryDirectory() as tmp:
+    audio_files = make_audio_files(args.audio_path, cfg.durations, Path(tmp))
+    for variant in variants:
+      print(f"[benchmark] {variant.name} ({variant.backend} @ {variant.model_dir})")
+      if args.no_isolate:
+        res = bench_variant(variant, cfg, audio_files)
+      else:
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+          res = pool.submit(bench_variant, variant, cfg, audio_files).result()
+      results["variants"].append(res)
+
+  regressions = []
+  if args.baseline:
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    results["comparison"] = compare_to_baseline(results, baseline, args.regression_threshold)
+    regressions = [c for c in results["comparison"] if c["regression"]]
+
+  json_path = out.with_suffix(".json")
+  json_path.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+  out.write_text(render_markdown(results), encoding="utf-8")
+  print(f"[benchmark] wrote: {out.as_posix()} and {json_path.as_posix()}")
+
+  if regressions:
+    print(f"[benchmark] {len(regressions)} latency regression(s) vs baseline")
+    if args.fail_on_regression:
+      sys.exit(1)
 
 
 if __name__ == "__main__":
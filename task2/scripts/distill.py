@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+from transformers import Trainer, TrainingArguments, Wav2Vec2ForCTC, Wav2Vec2Processor
+
+from train import (
+  DataCollatorCTCWithPadding,
+  ThroughputCallback,
+  bf16_supported,
+  features_cache_dir,
+  load_or_prepare,
+  load_subsets,
+  make_compute_metrics,
+  make_prepare,
+  trainable_params,
+)
+
+ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS = Path(__file__).resolve().parent
+
+
+def pick_layers(n_teacher: int, n_student: int) -> List[int]:
+  """Evenly spaced teacher layers (always the first and the last) to initialize the student from."""
+  if n_student >= n_teacher:
+    return list(range(n_teacher))
+  if n_student == 1:
+    return [n_teacher - 1]
+  return [round(i * (n_teacher - 1) / (n_student - 1)) for i in range(n_student)]
+
+
+def build_student(
+  teacher: Wav2Vec2ForCTC,
+  num_layers: int,
+  hidden_size: Optional[int],
+  num_heads: Optional[int],
+  intermediate_size: Optional[int],
+) -> Wav2Vec2ForCTC:
+  """
+  Same CNN feature encoder and vocabulary as the teacher (so both emit the same
+  number of frames), shallower and optionally narrower transformer.
+
+  Every tensor whose shape matches is copied from the teacher, the encoder
+  layers from `pick_layers`. A narrower student therefore only inherits the
+  CNN encoder; its transformer starts from random init and relies on the
+  distillation loss.
+  """
+  config = copy.deepcopy(teacher.config)
+  config.num_hidden_layers = num_layers
+  if hidden_size:
+    config.hidden_size = hidden_size
+    config.num_attention_heads = num_heads or max(1, hidden_size // 64)
+    config.intermediate_size = intermediate_size or 4 * hidden_size
+  elif intermediate_size:
+    config.intermediate_size = intermediate_size
+  student = Wav2Vec2ForCTC(config)
+
+  layer_map = pick_layers(teacher.config.num_hidden_layers, num_layers)
+  src = teacher.state_dict()
+  dst = student.state_dict()
+  prefix = "wav2vec2.encoder.layers."
+  copied = 0
+  for key, value in dst.items():
+    src_key = key
+    if key.startswith(prefix):
+      idx, rest = key[len(prefix):].split(".", 1)
+      src_key = f"{prefix}{layer_map[int(idx)]}.{rest}"
+    if src_key in src and src[src_key].shape == value.shape:
+      dst[key] = src[src_key].clone()
+      copied += 1
+  student.load_state_dict(dst)
+  print(f"[distill] student layers <- teacher {layer_map}; {copied}/{len(dst)} tensors copied")
+  return student
+
+
+def kd_loss(
+  student_logits: torch.Tensor,
+  teacher_logits: torch.Tensor,
+  frame_mask: Optional[torch.Tensor],
+  temperature: float,
+) -> torch.Tensor:
+  """Frame-level KL(teacher || student) on softened CTC posteriors, averaged over real frames."""
+  t = temperature
+  kl = F.kl_div(
+    F.log_softmax(student_logits.float() / t, dim=-1),
+    F.log_softmax(teacher_logits.float() / t, dim=-1),
+    log_target=True,
+    reduction="none",
+  ).sum(-1)
+  if frame_mask is None:
+    return kl.mean() * t * t
+  frame_mask = frame_mask.to(kl.dtype)
+  return (kl * frame_mask).sum() / frame_mask.sum().clamp(min=1.0) * t * t
+
+
+class DistillationTrainer(Trainer):
+  """Trainer whose loss is alpha * KD(teacher logits) + (1 - alpha) * CTC(labels)."""
+
+  def __init__(self, *args, teacher: Wav2Vec2ForCTC, temperature: float, alpha: float, **kwargs) -> None:
+    super().__init__(*args, **kwargs)
+    self.teacher = teacher.to(self.args.device).eval()
+    for param in self.teacher.parameters():
+      param.requires_grad = False
+    self.temperature = temperature
+    self.alpha = alpha
+
+  def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+    outputs = model(**inputs)
+    attention_mask = inputs.get("attention_mask")
+    with torch.no_grad():
+      teacher_logits = self.teacher(input_values=inputs["input_values"], attention_mask=attention_mask).logits
+
+    frame_mask = None
+    if attention_mask is not None:
+      unwrapped = self.accelerator.unwrap_model(model)
+      lengths = unwrapped._get_feat_extract_output_lengths(attention_mask.sum(-1))
+      frames = torch.arange(outputs.logits.shape[1], device=lengths.device)
+      frame_mask = frames[None, :] < lengths[:, None]
+
+    kd = kd_loss(outputs.logits, teacher_logits, frame_mask, self.temperature)
+    loss = self.alpha * kd + (1.0 - self.alpha) * outputs.loss
+    return (loss, outputs) if return_outputs else loss
+
+
+def run_script(name: str, *script_args: str) -> None:
+  cmd = [sys.executable, (SCRIPTS / name).as_posix(), *script_args]
+  print(f"[distill] $ {' '.join(cmd)}")
+  subprocess.run(cmd, check=True, cwd=ROOT)
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="Distill a fine-tuned wav2vec2 CTC model into a smaller student")
+  p.add_argument("--teacher_dir", default="models/checkpoint", help="Fine-tuned teacher (model + processor)")
+  p.add_argument("--dataset_name", default="ysdede/khanacademy-turkish")
+  p.add_argument("--train_percent", type=float, default=0.1)
+  p.add_argument("--eval_percent", type=float, default=0.05)
+  p.add_argument("--output_dir", default="models/student")
+  p.add_argument("--student_layers", type=int, default=6)
+  p.add_argument("--student_hidden", type=int, default=None, help="Narrower hidden size (default: teacher's)")
+  p.add_argument("--student_heads", type=int, default=None, help="Default: student_hidden // 64")
+  p.add_argument("--student_intermediate", type=int, default=None, help="FFN size (default: 4 x hidden)")
+  p.add_argument("--temperature", type=float, default=2.0)
+  p.add_argument("--alpha", type=float, default=0.5, help="Weight of the KD loss; the rest is CTC on labels")
+  p.add_argument("--epochs", type=float, default=3.0)
+  p.add_argument("--batch_size", type=int, default=8)
+  p.add_argument("--grad_accum", type=int, default=1)
+  p.add_argument("--learning_rate", type=float, default=1e-4)
+  p.add_argument("--bf16", choices=["auto", "on", "off"], default="auto")
+  p.add_argument("--num_proc", type=int, default=os.cpu_count() or 1)
+  p.add_argument("--features_cache", default="data/features_cache")
+  p.add_argument("--dataloader_workers", type=int, default=2)
+  p.add_argument("--onnx_dir", default=None, help="Export the student here with scripts/export.py")
+  p.add_argument("--teacher_onnx_dir", default=None, help="Exported teacher, benchmarked next to the student")
+  p.add_argument("--bench_manifest", default=None, help="Folder/JSONL with references: runs scripts/benchmark.py")
+  p.add_argument("--bench_out", default="artifacts/distill_benchmark.md")
+  args = p.parse_args()
+
+  processor = Wav2Vec2Processor.from_pretrained(args.teacher_dir)
+  teacher = Wav2Vec2ForCTC.from_pretrained(args.teacher_dir)
+  student = build_student(
+    teacher, args.student_layers, args.student_hidden, args.student_heads, args.student_intermediate
+  )
+  # the CNN encoder is shared with the teacher either way; training it buys little
+  student.freeze_feature_encoder()
+  params = {"teacher": trainable_params(teacher)["total"], "student": trainable_params(student)}
+  print(f"[distill] parameters: {params}")
+
+  # same Arrow feature cache as train.py (keyed by dataset subset + processor)
+  train, eval_ds, text_col = load_subsets(args.dataset_name, args.train_percent, args.eval_percent)
+  prepare = make_prepare(processor, text_col)
+  cache = features_cache_dir(args, text_col, processor)
+  train_proc, _ = load_or_prepare("train", train, prepare, cache, args.num_proc)
+  eval_proc, _ = load_or_prepare("eval", eval_ds, prepare, cache, args.num_proc)
+
+  use_bf16 = args.bf16 == "on" or (args.bf16 == "auto" and bf16_supported())
+  training_args = TrainingArguments(
+    output_dir=args.output_dir,
+    group_by_length=True,
+    length_column_name="input_length",
+    per_device_train_batch_size=args.batch_size,
+    per_device_eval_batch_size=args.batch_size,
+    gradient_accumulation_steps=args.grad_accum,
+    dataloader_num_workers=args.dataloader_workers,
+    learning_rate=args.learning_rate,
+    warmup_ratio=0.1,
+    evaluation_strategy="epoch",
+    save_strategy="epoch",
+    save_total_limit=1,
+    logging_steps=10,
+    num_train_epochs=args.epochs,
+    bf16=use_bf16,
+    fp16=torch.cuda.is_available() and not use_bf16,
+    report_to=["tensorboard"],
+    run_name="turkish_asr_task2_distill",
+  )
+
+  speed = ThroughputCallback()
+  trainer = DistillationTrainer(
+    model=student,
+    args=training_args,
+    data_collator=DataCollatorCTCWithPadding(processor=processor, padding=True),
+    train_dataset=train_proc,
+    eval_dataset=eval_proc,
+    tokenizer=processor.feature_extractor,
+    compute_metrics=make_compute_metrics(processor),
+    callbacks=[speed],
+    teacher=teacher,
+    temperature=args.temperature,
+    alpha=args.alpha,
+  )
+  trainer.train()
+  metrics = trainer.evaluate()
+
+  # a plain Wav2Vec2ForCTC checkpoint: export.py and ASRService take it like any other
+  trainer.save_model(args.output_dir)
+  processor.save_pretrained(args.output_dir)
+
+  report: Dict[str, Any] = {
+    "teacher_dir": args.teacher_dir,
+    "student": {
+      "layers": args.student_layers,
+      "hidden_size": student.config.hidden_size,
+      "num_attention_heads": student.config.num_attention_heads,
+      "intermediate_size": student.config.intermediate_size,
+    },
+    "parameters": params,
+    "temperature": args.temperature,
+    "alpha": args.alpha,
+    "eval_wer": metrics.get("eval_wer"),
+    "training": speed.summary(args.batch_size * args.grad_accum),
+  }
+  out = Path(args.output_dir) / "distill_report.json"
+  out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+  print(f"[distill] student saved: {args.output_dir} (eval WER {report['eval_wer']})")
+
+  if args.onnx_dir:
+    run_script("export.py", "--checkpoint_dir", args.output_dir, "--onnx_dir", args.onnx_dir)
+
+  if args.bench_manifest:
+    variants: List[str] = []
+    if args.onnx_dir:
+      variants += ["--variant", f"student_int8=onnx_int8@{args.onnx_dir}"]
+    else:
+      variants += ["--variant", f"student=pytorch@{args.output_dir}"]
+    if args.teacher_onnx_dir:
+      variants += ["--variant", f"teacher_int8=onnx_int8@{args.teacher_onnx_dir}"]
+    else:
+      variants += ["--variant", f"teacher=pytorch@{args.teacher_dir}"]
+    run_script("benchmark.py", *variants, "--manifest", args.bench_manifest, "--out", args.bench_out)
+
+  print("[distill] done.")
+
+
+if __name__ == "__main__":
+  main()
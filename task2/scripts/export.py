@@ -1,14 +1,26 @@
 ﻿from __future__ import annotations
 
 import argparse
+import json
 from pathlib import Path
 import inspect
+import sys
+import time
+from typing import Dict, List
 
+import numpy as np
 from transformers import Wav2Vec2Processor
 from onnxruntime.quantization import QuantType, quantize_dynamic
 
 from optimum.onnxruntime import ORTModelForCTC
 
+from audio_manifest import AUDIO_EXTS, AudioItem, read_manifest
+
+SAMPLING_RATE = 16_000
+ROOT = Path(__file__).resolve().parents[1]
+SAMPLE = ROOT / "samples" / "sample.wav"
+sys.path.insert(0, str(ROOT))
+
 
 def sizeof_mb(path: Path) -> float:
   return round(path.stat().st_size / (1024 * 1024), 2)
@@ -50,6 +62,256 @@ def export_with_optimum(model_id_or_path: str, out_dir: Path) -> None:
   ort_model.save_pretrained(out_dir.as_posix())
 
 
+def optimize_graph(onnx_path: Path, ckpt_id: str, fp16: bool) -> Dict[str, Path]:
+  """
+  ORT transformer optimizer: LayerNorm / GELU / attention fusion (bert pattern,
+  which matches the wav2vec2 encoder blocks). Optionally also writes an fp16
+  copy with float32 inputs/outputs kept, so callers feed the same tensors.
+  """
+  from onnxruntime.transformers.optimizer import optimize_model
+  from transformers import AutoConfig
+
+  config = AutoConfig.from_pretrained(ckpt_id)
+  model = optimize_model(
+    onnx_path.as_posix(),
+    model_type="bert",
+    num_heads=config.num_attention_heads,
+    hidden_size=config.hidden_size,
+    opt_level=1,  # fusions only; hardware-specific rewrites are left to the session (ASR_ORT_GRAPH_OPT)
+  )
+  print(f"[export] fused ops: {model.get_fused_operator_statistics()}")
+
+  out = {"onnx_opt": onnx_path.with_name("model_opt.onnx")}
+  model.save_model_to_file(out["onnx_opt"].as_posix())
+  print(f"[export] optimized saved: {out['onnx_opt']} ({sizeof_mb(out['onnx_opt'])} MB)")
+
+  if fp16:
+    model.convert_float_to_float16(keep_io_types=True)
+    out["onnx_fp16"] = onnx_path.with_name("model_fp16.onnx")
+    model.save_model_to_file(out["onnx_fp16"].as_posix())
+    print(f"[export] fp16 saved: {out['onnx_fp16']} ({sizeof_mb(out['onnx_fp16'])} MB)")
+  return out
+
+
+def validate_variants(
+  ckpt_id: str,
+  processor: Wav2Vec2Processor,
+  variants: Dict[str, Path],
+  audio_path: Path,
+  runs: int,
+  atol: float,
+) -> Dict[str, Dict]:
+  """
+  Parity of each ONNX variant against the PyTorch logits on one clip
+  (max |diff| and argmax agreement per frame), plus size and mean latency.
+  """
+  import librosa
+  import onnxruntime as ort
+  import torch
+  from transformers import Wav2Vec2ForCTC
+
+  audio, _ = librosa.load(audio_path.as_posix(), sr=SAMPLING_RATE, mono=True)
+  inputs = processor(audio, sampling_rate=SAMPLING_RATE, return_tensors="np")
+
+  ref_model = Wav2Vec2ForCTC.from_pretrained(ckpt_id).eval()
+  with torch.inference_mode():
+    ref = ref_model(torch.from_numpy(inputs["input_values"])).logits.numpy()
+  del ref_model
+
+  report: Dict[str, Dict] = {}
+  for backend, path in variants.items():
+    sess = ort.InferenceSession(path.as_posix(), providers=["CPUExecutionProvider"])
+    names = {i.name for i in sess.get_inputs()}
+    feed = {k: v for k, v in inputs.items() if k in names}
+    logits = sess.run(None, feed)[0].astype(np.float32)
+
+    times = []
+    for _ in range(runs):
+      start = time.perf_counter()
+      sess.run(None, feed)
+      times.append(time.perf_counter() - start)
+
+    max_diff = float(np.abs(logits - ref).max())
+    report[backend] = {
+      "file": path.name,
+      "size_mb": sizeof_mb(path),
+      "latency_mean_s": round(float(np.mean(times)), 4),
+      "max_abs_diff": round(max_diff, 6),
+      "argmax_agreement": round(float((logits.argmax(-1) == ref.argmax(-1)).mean()), 4),
+      # reduced-precision and quantized graphs are not expected to meet the fp32 tolerance
+      "parity_ok": max_diff <= atol if backend in ("onnx", "onnx_opt") else None,
+    }
+    print(f"[export] {backend}: {report[backend]}")
+    if report[backend]["parity_ok"] is False:
+      print(f"[export] Warning: {backend} differs from PyTorch by {max_diff:.2e} (> {atol:g})")
+  return report
+
+
+def audio_durations(manifest: str) -> np.ndarray:
+  import soundfile as sf
+
+  out = []
+  for item in read_manifest(manifest):
+    try:
+      out.append(sf.info(item.audio).duration)
+    except RuntimeError:  # formats libsndfile cannot read (e.g. m4a)
+      import librosa
+
+      out.append(librosa.get_duration(path=item.audio))
+  if not out:
+    raise ValueError(f"No audio found in: {manifest}")
+  return np.asarray(out, dtype=np.float64)
+
+
+def choose_buckets(durations: np.ndarray, num_buckets: int, step: float = 0.5) -> List[float]:
+  """
+  Equal-traffic bucket edges: quantiles of the observed lengths up to p99
+  (longer outliers fall back to the dynamic model), rounded up to `step` s.
+  """
+  qs = np.linspace(0.0, 0.99, num_buckets + 1)[1:]
+  edges = np.ceil(np.quantile(durations, qs) / step) * step
+  return sorted({float(e) for e in edges if e > 0})
+
+
+def make_fixed_bucket_models(onnx_path: Path, buckets: List[int]) -> Dict[int, str]:
+  """One copy of the graph per bucket with the time axis fixed (batch stays dynamic)."""
+  import onnx
+  from onnxruntime.tools.onnx_model_utils import make_dim_param_fixed
+
+  files: Dict[int, str] = {}
+  for n in buckets:
+    model = onnx.load(onnx_path.as_posix())
+    dim = model.graph.input[0].type.tensor_type.shape.dim[1]
+    if not dim.dim_param:
+      raise ValueError(f"{onnx_path} has no symbolic time axis to fix")
+    make_dim_param_fixed(model.graph, dim.dim_param, n)
+    out = onnx_path.with_name(f"{onnx_path.stem}.b{n}.onnx")
+    onnx.save(model, out.as_posix())
+    files[n] = out.name
+    print(f"[export] bucket model: {out} ({sizeof_mb(out)} MB)")
+  return files
+
+
+def padding_parity(
+  out_dir: Path,
+  processor: Wav2Vec2Processor,
+  buckets: List[int],
+  files: Dict[str, Dict[int, str]],
+  audio: str,
+  max_items: int,
+  max_wer: float,
+) -> Dict[str, Dict]:
+  """
+  Zero-padding a clip up to its bucket (what `ASRService.infer` does) only
+  leaves the logits unchanged when the graph masks the padding; without an
+  attention_mask input group norm and self-attention also see the padded
+  samples. Each clip is run unpadded on the dynamic graph and bucket-padded
+  (on the fixed-shape model when there is one); reports per backend the frame
+  argmax agreement and the WER of the padded vs the unpadded transcripts.
+  """
+  import jiwer
+  import onnxruntime as ort
+
+  from app.asr import load_audio
+  from app.ctc import CTCGreedyDecoder
+
+  src = Path(audio)
+  items = [AudioItem(id=src.name, audio=src.as_posix())] if src.suffix.lower() in AUDIO_EXTS else read_manifest(audio)
+  clips = []
+  for item in items:
+    wav = load_audio(item.audio)
+    if any(b >= len(wav) for b in buckets):  # longer clips use the dynamic graph unpadded
+      clips.append(processor(wav, sampling_rate=SAMPLING_RATE, return_tensors="np"))
+    if len(clips) >= max_items:
+      break
+  decoder = CTCGreedyDecoder.from_tokenizer(processor.tokenizer)
+
+  report: Dict[str, Dict] = {}
+  for backend, name in (("onnx", "model.onnx"), ("onnx_int8", "model_int8.onnx")):
+    if not (out_dir / name).exists():
+      continue
+    dynamic = ort.InferenceSession((out_dir / name).as_posix(), providers=["CPUExecutionProvider"])
+    names = {i.name for i in dynamic.get_inputs()}
+    fixed: Dict[int, ort.InferenceSession] = {}
+    agreement, ref_texts, pad_texts = [], [], []
+    for inputs in clips:
+      feed = {k: v for k, v in inputs.items() if k in names}
+      n = feed["input_values"].shape[1]
+      bucket = next(b for b in buckets if b >= n)
+      padded = {k: np.pad(v, ((0, 0), (0, bucket - n))) for k, v in feed.items()}
+      session = dynamic
+      if bucket in files.get(backend, {}):
+        if bucket not in fixed:
+          fixed[bucket] = ort.InferenceSession((out_dir / files[backend][bucket]).as_posix(), providers=["CPUExecutionProvider"])
+        session = fixed[bucket]
+
+      ref = dynamic.run(None, feed)[0]
+      out = session.run(None, padded)[0][:, : ref.shape[1]]
+      agreement.append(float((out.argmax(-1) == ref.argmax(-1)).mean()))
+      ref_texts.append(decoder.decode(ref)[0].text)
+      pad_texts.append(decoder.decode(out)[0].text)
+
+    pairs = [(r, h) for r, h in zip(ref_texts, pad_texts) if r.strip()]
+    wer = float(jiwer.wer([r for r, _ in pairs], [h for _, h in pairs])) if pairs else None
+    report[backend] = {
+      "clips": len(clips),
+      "masked": "attention_mask" in names,
+      "argmax_agreement": round(float(np.mean(agreement)), 4) if agreement else None,
+      "wer_vs_unpadded": round(wer, 4) if wer is not None else None,
+      "parity_ok": wer <= max_wer if wer is not None else None,
+    }
+    print(f"[export] bucket padding {backend}: {report[backend]}")
+  return report
+
+
+def write_length_buckets(out_dir: Path, args: argparse.Namespace) -> None:
+  durations = None
+  if args.length_buckets == "auto":
+    if not args.bucket_audio:
+      raise ValueError("--length_buckets auto needs --bucket_audio (folder or JSONL of real audio)")
+    durations = audio_durations(args.bucket_audio)
+    seconds = choose_buckets(durations, args.num_buckets)
+  else:
+    seconds = sorted(float(x) for x in args.length_buckets.split(",") if x.strip())
+  buckets = [int(sec * SAMPLING_RATE) for sec in seconds]
+
+  meta: Dict = {"sampling_rate": SAMPLING_RATE, "buckets": buckets, "seconds": seconds, "files": {}}
+  if durations is not None:
+    counts, edges = np.histogram(durations, bins=20)
+    per_bucket = np.searchsorted(seconds, durations, side="left")
+    meta["histogram"] = {
+      "n": int(len(durations)),
+      "bin_edges_s": [round(float(e), 2) for e in edges],
+      "counts": counts.tolist(),
+      "per_bucket": [int((per_bucket == i).sum()) for i in range(len(seconds) + 1)],  # last = dynamic fallback
+    }
+
+  if args.bucket_models:
+    for backend, name in (("onnx", "model.onnx"), ("onnx_int8", "model_int8.onnx")):
+      if (out_dir / name).exists():
+        meta["files"][backend] = make_fixed_bucket_models(out_dir / name, buckets)
+
+  if not args.skip_padding_check:
+    processor = Wav2Vec2Processor.from_pretrained(out_dir.as_posix())
+    audio = args.parity_audio or args.bucket_audio or args.validate_audio
+    meta["parity"] = padding_parity(
+      out_dir, processor, buckets, meta["files"], audio, args.parity_max_items, args.padding_max_wer
+    )
+    failed = [b for b, r in meta["parity"].items() if r["parity_ok"] is False]
+    if failed:
+      # no buckets.json -> the runtime never pads to a bucket
+      for per_backend in meta["files"].values():
+        for name in per_backend.values():
+          (out_dir / name).unlink(missing_ok=True)
+      raise SystemExit(
+        f"[export] bucket padding changes transcripts of {failed} beyond --padding_max_wer {args.padding_max_wer:g} "
+        "(graph without attention_mask); length buckets not written"
+      )
+
+  (out_dir / "buckets.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+  print(f"[export] length buckets (s): {seconds}")
+
+
 def main() -> None:
   p = argparse.ArgumentParser()
   p.add_argument(
@@ -58,6 +320,26 @@ def main() -> None:
     help="HF repo id (e.g. cahya/wav2vec2-base-turkish) OR local folder path",
   )
   p.add_argument("--onnx_dir", required=True, help="Output folder for ONNX artifacts")
+  p.add_argument(
+    "--length_buckets",
+    default=None,
+    help="'auto' (from --bucket_audio length histogram) or bucket lengths in seconds, e.g. 4,8,16,30",
+  )
+  p.add_argument("--bucket_audio", default=None, help="Folder or JSONL manifest of real audio for 'auto' buckets")
+  p.add_argument("--num_buckets", type=int, default=4)
+  p.add_argument("--bucket_models", action="store_true", help="Also write fixed-shape models per bucket")
+  p.add_argument("--buckets_only", action="store_true", help="Skip export; add buckets to an existing --onnx_dir")
+  p.add_argument("--parity_audio", default=None, help="Clips for the bucket padding check (default: --bucket_audio)")
+  p.add_argument("--parity_max_items", type=int, default=16)
+  p.add_argument("--padding_max_wer", type=float, default=0.01, help="Max WER of bucket-padded vs unpadded output")
+  p.add_argument("--skip_padding_check", action="store_true")
+  p.add_argument("--optimize", action="store_true", help="Also write a transformer-fused graph (model_opt.onnx)")
+  # bf16 is not offered: ORT's CPU provider has no bf16 kernels for these ops
+  p.add_argument("--fp16", action="store_true", help="Also write an fp16 copy of the fused graph (model_fp16.onnx)")
+  p.add_argument("--validate", action="store_true", help="Check parity vs PyTorch and time each variant")
+  p.add_argument("--validate_audio", default=SAMPLE.as_posix())
+  p.add_argument("--validate_runs", type=int, default=5)
+  p.add_argument("--parity_atol", type=float, default=1e-3)
   args = p.parse_args()
 
   ckpt_id = args.checkpoint_dir
@@ -67,6 +349,10 @@ def main() -> None:
   print(f"[export] checkpoint_dir={ckpt_id}")
   print(f"[export] onnx_dir={out_dir}")
 
+  if args.buckets_only:
+    write_length_buckets(out_dir, args)
+    return
+
   # 1) Export to ONNX
   print("[export] exporting to ONNX via Optimum...")
   export_with_optimum(ckpt_id, out_dir)
@@ -89,6 +375,23 @@ def main() -> None:
     op_types_to_quantize=["MatMul", "Gemm"]
   )
   print(f"[export] INT8 saved: {int8_path} ({sizeof_mb(int8_path)} MB)")
+
+  # 5) Optional fused / fp16 graphs
+  variants: Dict[str, Path] = {"onnx": onnx_path, "onnx_int8": int8_path}
+  if args.optimize or args.fp16:
+    variants.update(optimize_graph(onnx_path, ckpt_id, args.fp16))
+
+  # 6) Parity + size/latency per variant
+  if args.validate:
+    report = validate_variants(
+      ckpt_id, processor, variants, Path(args.validate_audio), args.validate_runs, args.parity_atol
+    )
+    (out_dir / "variants.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[export] variant report: {out_dir / 'variants.json'}")
+
+  # 7) Optional length buckets (runtime pads inputs up to the nearest bucket)
+  if args.length_buckets:
+    write_length_buckets(out_dir, args)
   print("[export] Done.")
 
 
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import torch
+from torch import nn
+from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from audio_manifest import AudioItem, read_manifest  # noqa: E402
+from quantize import compare, sizeof_mb  # noqa: E402
+
+from app.pruning import PLAN_FILE, WEIGHTS_FILE, apply_plan, attention_modules, ffn_modules  # noqa: E402
+
+def importance_scores(
+  model: Wav2Vec2ForCTC, processor: Wav2Vec2Processor, items: List[AudioItem], max_seconds: float
+) -> Dict[str, Dict[int, torch.Tensor]]:
+  """
+  First-order Taylor importance |w * dL/dw| of every attention head and FFN
+  channel, accumulated over the CTC loss of the labelled validation clips.
+  A head scores its q/k/v rows and out_proj columns; an FFN channel its
+  intermediate_dense row and output_dense column.
+  """
+  from app.asr import load_audio
+
+  model.eval()  # no dropout / layerdrop, but gradients still flow
+  model.zero_grad(set_to_none=True)
+  max_samples = int(max_seconds * 16_000)
+  used = 0
+  for item in items:
+    if not item.text:
+      continue
+    audio = load_audio(item.audio)[:max_samples]
+    inputs = processor(audio, sampling_rate=16_000, return_tensors="pt")
+    labels = torch.tensor([processor.tokenizer(item.text).input_ids])
+    out = model(inputs.input_values, attention_mask=inputs.get("attention_mask"), labels=labels)
+    out.loss.backward()  # grads accumulate across clips
+    used += 1
+  if not used:
+    raise ValueError("Importance needs reference transcripts ('text') in the validation manifest")
+
+  def taylor(param: nn.Parameter) -> torch.Tensor:
+    return (param.detach() * param.grad).abs()
+
+  heads: Dict[int, torch.Tensor] = {}
+  for i, attn in enumerate(attention_modules(model)):
+    d = attn.head_dim
+    rows = sum(taylor(m.weight).sum(1) + taylor(m.bias) for m in (attn.q_proj, attn.k_proj, attn.v_proj))
+    cols = taylor(attn.out_proj.weight).sum(0)
+    heads[i] = (rows + cols).view(attn.num_heads, d).sum(1)
+
+  channels: Dict[int, torch.Tensor] = {}
+  for i, ff in enumerate(ffn_modules(model)):
+    channels[i] = (
+      taylor(ff.intermediate_dense.weight).sum(1)
+      + taylor(ff.intermediate_dense.bias)
+      + taylor(ff.output_dense.weight).sum(0)
+    )
+  model.zero_grad(set_to_none=True)
+  print(f"[prune] importance from {used} clips")
+  return {"heads": heads, "ffn": channels}
+
+
+def select_to_prune(scores: Dict[int, torch.Tensor], sparsity: float, min_keep: int) -> Dict[int, List[int]]:
+  """
+  Global ranking of units (heads or channels) by importance normalized per
+  layer, so layers compete on relative importance; every layer keeps at
+  least `min_keep` units.
+  """
+  ranked = []
+  for layer, s in scores.items():
+    normed = s / s.norm().clamp(min=1e-12)
+    ranked += [(float(v), layer, idx) for idx, v in enumerate(normed)]
+  ranked.sort()
+
+  budget = int(round(sparsity * len(ranked)))
+  remaining = {layer: len(s) for layer, s in scores.items()}
+  drop: Dict[int, List[int]] = {layer: [] for layer in scores}
+  for _, layer, idx in ranked:
+    if budget <= 0:
+      break
+    if remaining[layer] <= min_keep:
+      continue
+    drop[layer].append(idx)
+    remaining[layer] -= 1
+    budget -= 1
+  return {layer: sorted(idx) for layer, idx in drop.items() if idx}
+
+
+def count_params(model: nn.Module) -> int:
+  return sum(p.numel() for p in model.parameters())
+
+
+def save_pruned(model: Wav2Vec2ForCTC, processor: Wav2Vec2Processor, plan: Dict, out_dir: Path) -> None:
+  """
+  Layers no longer share one width, so the config alone cannot rebuild the
+  model: keep the original config, the plan and the sliced weights
+  (`app.pruning.load_pruned` replays them for the `pytorch` backend).
+  """
+  out_dir.mkdir(parents=True, exist_ok=True)
+  model.config.save_pretrained(out_dir.as_posix())
+  processor.save_pretrained(out_dir.as_posix())
+  (out_dir / PLAN_FILE).write_text(json.dumps(plan, indent=2), encoding="utf-8")
+  torch.save(model.state_dict(), out_dir / WEIGHTS_FILE)
+
+
+class _LogitsOnly(nn.Module):
+  def __init__(self, model: Wav2Vec2ForCTC) -> None:
+    super().__init__()
+    self.model = model
+
+  def forward(self, input_values, attention_mask=None):
+    return self.model(input_values, attention_mask=attention_mask).logits
+
+
+def export_onnx(model: Wav2Vec2ForCTC, processor: Wav2Vec2Processor, out_dir: Path) -> Dict[str, Path]:
+  """
+  model.onnx + model_int8.onnx + processor, the same layout export.py writes
+  (Optimum cannot export a model whose layers differ in width, so this goes
+  through torch.onnx directly).
+  """
+  out_dir.mkdir(parents=True, exist_ok=True)
+  onnx_path = out_dir / "model.onnx"
+  dummy = torch.randn(1, 16_000)
+  axes = {"input_values": {0: "batch_size", 1: "sequence_length"}, "logits": {0: "batch_size", 1: "sequence_length"}}
+  inputs, names = (dummy,), ["input_values"]
+  if processor.feature_extractor.return_attention_mask:
+    inputs, names = (dummy, torch.ones(1, 16_000, dtype=torch.long)), ["input_values", "attention_mask"]
+    axes["attention_mask"] = {0: "batch_size", 1: "sequence_length"}
+
+  torch.onnx.export(
+    _LogitsOnly(model.eval()),
+    inputs,
+    onnx_path.as_posix(),
+    input_names=names,
+    output_names=["logits"],
+    dynamic_axes=axes,
+    opset_version=14,
+  )
+  processor.save_pretrained(out_dir.as_posix())
+
+  int8_path = out_dir / "model_int8.onnx"
+  quantize_dynamic(
+    model_input=onnx_path.as_posix(),
+    model_output=int8_path.as_posix(),
+    weight_type=QuantType.QInt8,
+    op_types_to_quantize=["MatMul", "Gemm"],
+  )
+  return {"onnx": onnx_path, "onnx_int8": int8_path}
+
+
+def recover(model: Wav2Vec2ForCTC, processor: Wav2Vec2Processor, args: argparse.Namespace, out_dir: Path) -> Dict:
+  """Short CTC fine-tune of the pruned model on the train.py data pipeline."""
+  from transformers import Trainer, TrainingArguments
+
+  from train import DataCollatorCTCWithPadding, features_cache_dir, load_or_prepare, load_subsets, make_prepare
+
+  train, _, text_col = load_subsets(args.dataset_name, args.train_percent, args.eval_percent)
+  prepare = make_prepare(processor, text_col)
+  train_proc, _ = load_or_prepare(
+    "train", train, prepare, features_cache_dir(args, text_col, processor), args.num_proc
+  )
+
+  model.freeze_feature_encoder()
+  trainer = Trainer(
+    model=model,
+    args=TrainingArguments(
+      output_dir=(out_dir / "recovery").as_posix(),
+      group_by_length=True,
+      length_column_name="input_length",
+      per_device_train_batch_size=args.batch_size,
+      max_steps=args.recover_steps,
+      learning_rate=args.learning_rate,
+      warmup_ratio=0.1,
+      logging_steps=10,
+      save_strategy="no",
+      report_to=[],
+    ),
+    data_collator=DataCollatorCTCWithPadding(processor=processor, padding=True),
+    train_dataset=train_proc,
+  )
+  start = time.perf_counter()
+  result = trainer.train()
+  return {"steps": args.recover_steps, "train_loss": round(result.training_loss, 4), "seconds": round(time.perf_counter() - start, 1)}
+
+
+def render_markdown(rows: List[Dict[str, Any]]) -> str:
+  md = [
+    "# Pruning report\n\n",
+    "| Sparsity | Params (M) | Heads | FFN channels | Recovery | FP32 latency (s) | INT8 latency (s) "
+    "| INT8 size (MB) | FP32 WER | INT8 WER |\n",
+    "|---:|---:|---:|---:|---|---:|---:|---:|---:|---:|\n",
+  ]
+  for r in rows:
+    md.append(
+      f"| {r['sparsity']} | {r['params_m']} | {r['heads']} | {r['ffn_channels']} | "
+      f"{r['recovery']['steps'] if r['recovery'] else '-'} | {r['float']['latency_mean_s']} | "
+      f"{r['quantized']['latency_mean_s']} | {r['quantized']['size_mb']} | "
+      f"{r['float'].get('wer', '-')} | {r['quantized'].get('wer', '-')} |\n"
+    )
+  return "".join(md)
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="Structured pruning (attention heads + FFN channels) of a wav2vec2 CTC model")
+  p.add_argument("--checkpoint_dir", default="models/checkpoint", help="Fine-tuned model + processor")
+  p.add_argument("--val_manifest", required=True, help="Folder/JSONL with reference text, used for importance")
+  p.add_argument("--eval_manifest", default=None, help="Folder/JSONL for latency/WER (default: --val_manifest)")
+  p.add_argument("--sparsities", default="0,0.1,0.2,0.3,0.5", help="Fraction of heads and FFN channels removed")
+  p.add_argument("--targets", default="heads,ffn", help="What to prune: heads and/or ffn")
+  p.add_argument("--min_heads", type=int, default=1, help="Heads every layer keeps")
+  p.add_argument("--min_channels", type=int, default=64, help="FFN channels every layer keeps")
+  p.add_argument("--max_items", type=int, default=200, help="Validation clips used for importance")
+  p.add_argument("--max_seconds", type=float, default=20.0)
+  p.add_argument("--recover_steps", type=int, default=0, help="Recovery fine-tune steps per sparsity (0 = off)")
+  p.add_argument("--dataset_name", default="ysdede/khanacademy-turkish", help="Recovery data (as in train.py)")
+  p.add_argument("--train_percent", type=float, default=0.1)
+  p.add_argument("--eval_percent", type=float, default=0.05)
+  p.add_argument("--batch_size", type=int, default=8)
+  p.add_argument("--learning_rate", type=float, default=3e-5)
+  p.add_argument("--num_proc", type=int, default=os.cpu_count() or 1)
+  p.add_argument("--features_cache", default="data/features_cache")
+  p.add_argument("--eval_runs", type=int, default=3)
+  p.add_argument("--out_dir", default="models/pruned", help="One sub-folder per sparsity")
+  p.add_argument("--report", default="artifacts/pruning_report.md")
+  args = p.parse_args()
+  if args.min_heads < 1:
+    p.error("--min_heads must be >= 1 (a layer without heads cannot run attention)")
+  if args.min_channels < 1:
+    p.error("--min_channels must be >= 1")
+
+  targets = {t.strip() for t in args.targets.split(",") if t.strip()}
+  sparsities = [float(s) for s in args.sparsities.split(",") if s.strip()]
+  processor = Wav2Vec2Processor.from_pretrained(args.checkpoint_dir)
+  val_items = read_manifest(args.val_manifest)[: args.max_items]
+  eval_items = read_manifest(args.eval_manifest) if args.eval_manifest else val_items
+
+  base = Wav2Vec2ForCTC.from_pretrained(args.checkpoint_dir)
+  scores = importance_scores(base, processor, val_items, args.max_seconds)
+  base_params = count_params(base)
+
+  rows: List[Dict[str, Any]] = []
+  for sparsity in sparsities:
+    plan: Dict[str, Dict[int, List[int]]] = {}
+    if "heads" in targets:
+      plan["heads"] = select_to_prune(scores["heads"], sparsity, args.min_heads)
+    if "ffn" in targets:
+      plan["ffn"] = select_to_prune(scores["ffn"], sparsity, args.min_channels)
+
+    # every level is pruned from the original weights with the same scores
+    model = apply_plan(Wav2Vec2ForCTC.from_pretrained(args.checkpoint_dir), plan)
+    out_dir = Path(args.out_dir) / f"s{int(round(sparsity * 100)):02d}"
+    recovery = recover(model, processor, args, out_dir) if args.recover_steps > 0 and sparsity > 0 else None
+
+    save_pruned(model, processor, plan, out_dir)
+    paths = export_onnx(model, processor, out_dir)
+    report = compare(paths["onnx"], paths["onnx_int8"], out_dir.as_posix(), eval_items, args.eval_runs)
+
+    row = {
+      "sparsity": sparsity,
+      "params_m": round(count_params(model) / 1e6, 2),
+      "params_ratio": round(count_params(model) / base_params, 3),
+      "heads": sum(a.num_heads for a in attention_modules(model)),
+      "ffn_channels": sum(f.intermediate_dense.out_features for f in ffn_modules(model)),
+      "recovery": recovery,
+      "model_dir": out_dir.as_posix(),
+      "onnx_size_mb": sizeof_mb(paths["onnx"]),
+      **report,
+    }
+    rows.append(row)
+    print(
+      f"[prune] sparsity={sparsity}: params {row['params_m']}M, int8 {report['quantized']['latency_mean_s']}s, "
+      f"WER {report['quantized'].get('wer', '-')}"
+    )
+
+  out = Path(args.report)
+  out.parent.mkdir(parents=True, exist_ok=True)
+  out.write_text(render_markdown(rows), encoding="utf-8")
+  out.with_suffix(".json").write_text(json.dumps(rows, indent=2), encoding="utf-8")
+  print(f"[prune] report: {out}")
+
+
+if __name__ == "__main__":
+  main()
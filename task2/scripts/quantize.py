@@ -1,40 +1,245 @@
 from __future__ import annotations
 
 import argparse
+import json
+import re
+import sys
+import time
 from pathlib import Path
-from onnxruntime.quantization import quantize_dynamic, QuantType
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from onnxruntime.quantization import (
+  CalibrationDataReader,
+  CalibrationMethod,
+  QuantFormat,
+  QuantType,
+  quantize_dynamic,
+  quantize_static,
+)
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from audio_manifest import AudioItem, read_manifest  # noqa: E402
 
 
 def sizeof_mb(path: Path) -> float:
   return round(path.stat().st_size / (1024 * 1024), 2)
 
 
+class AudioCalibrationReader(CalibrationDataReader):
+  """
+  Feeds real audio through the processor for static calibration. Clips are
+  cut to `max_seconds`: the calibrator keeps every intermediate tensor of a
+  clip, so its memory grows with clip length (see `run_static` for the
+  bound across clips).
+  """
+
+  def __init__(self, items: List[AudioItem], processor, input_names: List[str], max_seconds: float = 20.0) -> None:
+    self.items = items
+    self.processor = processor
+    self.input_names = set(input_names)
+    self.max_samples = int(max_seconds * 16_000)
+    self._it: Optional[Iterator[Dict[str, np.ndarray]]] = None
+
+  def _feeds(self) -> Iterator[Dict[str, np.ndarray]]:
+    from app.asr import load_audio
+
+    for item in self.items:
+      audio = load_audio(item.audio)[: self.max_samples]
+      inputs = self.processor(audio, sampling_rate=16_000, return_tensors="np")
+      feed = {"input_values": inputs["input_values"].astype(np.float32)}
+      if "attention_mask" in self.input_names and "attention_mask" in inputs:
+        feed["attention_mask"] = inputs["attention_mask"].astype(np.int64)
+      yield feed
+
+  def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+    if self._it is None:
+      self._it = self._feeds()
+    return next(self._it, None)
+
+  def rewind(self) -> None:
+    self._it = None
+
+
+def select_nodes(onnx_path: Path, patterns: List[str]) -> List[str]:
+  """Node names matching any regex (e.g. 'lm_head', 'feature_extractor/conv_layers.0/')."""
+  if not patterns:
+    return []
+  import onnx
+
+  graph = onnx.load(onnx_path.as_posix(), load_external_data=False).graph
+  regexes = [re.compile(p) for p in patterns]
+  return [n.name for n in graph.node if any(r.search(n.name) for r in regexes)]
+
+
+def run_static(args: argparse.Namespace, onnx_path: Path, output_path: Path) -> None:
+  import onnxruntime as ort
+  from onnxruntime.quantization.shape_inference import quant_pre_process
+  from transformers import Wav2Vec2Processor
+
+  items = read_manifest(args.calib_audio)[: args.calib_max_items]
+  processor = Wav2Vec2Processor.from_pretrained(args.processor_dir or onnx_path.parent.as_posix())
+  input_names = [i.name for i in ort.InferenceSession(onnx_path.as_posix(), providers=["CPUExecutionProvider"]).get_inputs()]
+
+  model_input = onnx_path
+  if not args.skip_preprocess:
+    # symbolic shape inference + graph cleanup; recommended before static quantization
+    model_input = onnx_path.with_name(f"{onnx_path.stem}.preproc.onnx")
+    quant_pre_process(onnx_path.as_posix(), model_input.as_posix(), skip_symbolic_shape=False)
+
+  exclude = select_nodes(model_input, args.exclude_nodes)
+  print(f"[quantize] calibration clips: {len(items)}; excluded nodes: {len(exclude)}")
+  if args.calibrate_method != "minmax" and len(items) > args.calib_chunk:
+    # ORT's histogram calibrators hold the outputs of every clip until the end of collection
+    print(
+      f"[quantize] warning: {args.calibrate_method} keeps intermediate tensors of all {len(items)} clips "
+      "in memory; lower --calib_max_items / --calib_max_seconds if calibration runs out of RAM"
+    )
+
+  quantize_static(
+    model_input=model_input.as_posix(),
+    model_output=output_path.as_posix(),
+    calibration_data_reader=AudioCalibrationReader(items, processor, input_names, args.calib_max_seconds),
+    quant_format=QuantFormat.QDQ,
+    # u8 activations / s8 weights is the fast path on x86 CPUs
+    activation_type=QuantType.QUInt8,
+    weight_type=QuantType.QInt8,
+    per_channel=args.per_channel,
+    reduce_range=args.reduce_range,
+    op_types_to_quantize=args.op_types or None,  # None -> everything incl. Conv
+    nodes_to_exclude=exclude,
+    calibrate_method={
+      "minmax": CalibrationMethod.MinMax,
+      "entropy": CalibrationMethod.Entropy,
+      "percentile": CalibrationMethod.Percentile,
+    }[args.calibrate_method],
+    # MinMax: fold ranges every N clips instead of keeping all intermediate tensors
+    extra_options={"CalibMaxIntermediateOutputs": args.calib_chunk},
+  )
+  if model_input != onnx_path:
+    model_input.unlink(missing_ok=True)
+
+
+def compare(float_path: Path, quant_path: Path, processor_dir: str, items: List[AudioItem], runs: int) -> Dict:
+  """Latency and WER of the quantized model against the float one (and references, if any)."""
+  import jiwer
+  import onnxruntime as ort
+  from transformers import Wav2Vec2Processor
+
+  from app.asr import load_audio
+  from app.ctc import CTCGreedyDecoder
+
+  processor = Wav2Vec2Processor.from_pretrained(processor_dir)
+  decoder = CTCGreedyDecoder.from_tokenizer(processor.tokenizer)
+  features = [processor(load_audio(it.audio), sampling_rate=16_000, return_tensors="np") for it in items]
+
+  report: Dict[str, Dict] = {}
+  transcripts: Dict[str, List[str]] = {}
+  for name, path in (("float", float_path), ("quantized", quant_path)):
+    sess = ort.InferenceSession(path.as_posix(), providers=["CPUExecutionProvider"])
+    names = {i.name for i in sess.get_inputs()}
+    feeds = [{k: v for k, v in f.items() if k in names} for f in features]
+    sess.run(None, feeds[0])  # warmup
+    times, texts = [], []
+    for feed in feeds:
+      for _ in range(runs):
+        start = time.perf_counter()
+        logits = sess.run(None, feed)[0]
+        times.append(time.perf_counter() - start)
+      texts.append(decoder.decode(logits)[0].text)
+    transcripts[name] = texts
+    report[name] = {"size_mb": sizeof_mb(path), "latency_mean_s": round(float(np.mean(times)), 4)}
+
+    refs = [it.text for it in items]
+    if all(refs):
+      report[name]["wer"] = round(float(jiwer.wer([str(r).lower() for r in refs], [t.lower() for t in texts])), 4)
+
+  # how far quantization moves the output, independent of reference quality
+  report["quantized"]["wer_vs_float"] = round(float(jiwer.wer(transcripts["float"], transcripts["quantized"])), 4)
+  report["speedup"] = round(report["float"]["latency_mean_s"] / report["quantized"]["latency_mean_s"], 3)
+  return report
+
+
 def main() -> None:
   p = argparse.ArgumentParser()
   p.add_argument("--onnx_path", required=True, help="Path to ONNX model")
   p.add_argument("--output_path", required=True, help="Path for quantized output")
+  p.add_argument("--mode", choices=["dynamic", "static"], default="dynamic")
+  p.add_argument("--calib_audio", default=None, help="static: folder or JSONL of local calibration audio")
+  p.add_argument("--calib_max_items", type=int, default=64)
+  p.add_argument("--calib_max_seconds", type=float, default=8.0)
+  p.add_argument("--calib_chunk", type=int, default=8, help="static/minmax: clips kept in memory before ranges are merged")
+  p.add_argument("--calibrate_method", choices=["minmax", "entropy", "percentile"], default="minmax")
+  p.add_argument("--per_channel", action="store_true", help="static: per-channel weight scales")
+  p.add_argument("--reduce_range", action="store_true", help="7-bit weights (older CPUs without VNNI)")
+  p.add_argument("--op_types", nargs="*", default=None, help="Restrict quantized op types (default: all, incl. Conv)")
+  p.add_argument("--exclude_nodes", nargs="*", default=[], help="Regexes of node names to keep in float")
+  p.add_argument("--skip_preprocess", action="store_true")
+  p.add_argument("--processor_dir", default=None, help="Processor folder (default: next to --onnx_path)")
+  p.add_argument("--eval_audio", default=None, help="Folder/JSONL for the float-vs-quantized WER/latency comparison")
+  p.add_argument("--eval_runs", type=int, default=3)
+  p.add_argument("--report", default="artifacts/quantization_report.json")
   args = p.parse_args()
 
   onnx_path = Path(args.onnx_path)
   output_path = Path(args.output_path)
 
+  # argument errors are not quantization failures: report them before any work starts
   if not onnx_path.exists():
-    raise FileNotFoundError(f"ONNX model not found: {onnx_path}")
+    p.error(f"ONNX model not found: {onnx_path}")
+  if args.mode == "static":
+    if not args.calib_audio:
+      p.error("--mode static needs --calib_audio (folder or JSONL of local audio)")
+    if not Path(args.calib_audio).exists():
+      p.error(f"--calib_audio not found: {args.calib_audio}")
+  for pattern in args.exclude_nodes:
+    try:
+      re.compile(pattern)
+    except re.error as e:
+      p.error(f"--exclude_nodes: invalid regex {pattern!r}: {e}")
+  if args.eval_audio and not Path(args.eval_audio).exists():
+    p.error(f"--eval_audio not found: {args.eval_audio}")
 
   print(f"[quantize] Input: {onnx_path} ({sizeof_mb(onnx_path)} MB)")
-  print(f"[quantize] Quantizing to INT8...")
+  print(f"[quantize] Quantizing to INT8 ({args.mode})...")
 
   try:
-    quantize_dynamic(
-      model_input=str(onnx_path),
-      model_output=str(output_path),
-      weight_type=QuantType.QInt8,
-    )
+    if args.mode == "static":
+      run_static(args, onnx_path, output_path)
+    else:
+      quantize_dynamic(
+        model_input=str(onnx_path),
+        model_output=str(output_path),
+        weight_type=QuantType.QInt8,
+      )
     print(f"[quantize] Output: {output_path} ({sizeof_mb(output_path)} MB)")
-    print("[quantize] Done.")
   except Exception as e:
+    if args.mode == "static":
+      # an explicitly requested static model must not silently go missing
+      print(f"[quantize] ERROR: static quantization failed: {e}", file=sys.stderr)
+      sys.exit(1)
     print(f"[quantize] Warning: Quantization failed: {e}")
     print("[quantize] The float32 model is still available for use.")
+    return
+
+  if args.eval_audio:
+    report = compare(
+      onnx_path,
+      output_path,
+      args.processor_dir or onnx_path.parent.as_posix(),
+      read_manifest(args.eval_audio),
+      args.eval_runs,
+    )
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("onnx_path", "output_path")}
+    out = Path(args.report)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(json.dumps({k: v for k, v in report.items() if k != "config"}, indent=2))
+    print(f"[quantize] report: {out}")
+
+  print("[quantize] Done.")
 
 
 if __name__ == "__main__":
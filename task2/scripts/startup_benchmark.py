@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+
+HEAVY = ("torch", "transformers", "librosa", "onnxruntime", "numba", "fastapi")
+
+# Runs in a fresh interpreter so nothing is cached in sys.modules.
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app.main  # noqa: F401
+t1 = time.perf_counter()
+loaded_after_import = [m for m in {heavy!r} if m in sys.modules]
+
+from app.asr import ASRService
+svc = ASRService(model_dir={model_dir!r}, backend={backend!r})
+t2 = time.perf_counter()
+svc.warmup((1.0,))
+t3 = time.perf_counter()
+
+import psutil
+print(json.dumps({{
+  "import_app_s": t1 - t0,
+  "model_load_s": t2 - t1,
+  "first_request_s": t3 - t2,
+  "heavy_after_import": loaded_after_import,
+  "heavy_after_load": [m for m in {heavy!r} if m in sys.modules],
+  "modules": len(sys.modules),
+  "rss_mb": psutil.Process().memory_info().rss / 2**20,
+}}))
+"""
+
+
+def probe(backend: str, model_dir: str) -> Dict[str, Any]:
+  code = _PROBE.format(root=str(ROOT), heavy=HEAVY, model_dir=model_dir, backend=backend)
+  start = time.perf_counter()
+  out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+  result = json.loads(out.stdout.strip().splitlines()[-1])
+  # interpreter start + everything above, as a container/worker would pay it
+  result["process_total_s"] = time.perf_counter() - start
+  return result
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+  keys = ("import_app_s", "model_load_s", "first_request_s", "process_total_s", "rss_mb")
+  out: Dict[str, Any] = {k: round(statistics.median(r[k] for r in runs), 3) for k in keys}
+  out["heavy_after_import"] = runs[-1]["heavy_after_import"]
+  out["heavy_after_load"] = runs[-1]["heavy_after_load"]
+  out["modules"] = runs[-1]["modules"]
+  return out
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="Cold-start cost per backend: imports, model load, first request")
+  p.add_argument("--model_dir", default="models/onnx")
+  p.add_argument("--backends", default="onnx_int8,onnx", help="Comma-separated")
+  p.add_argument("--runs", type=int, default=3)
+  p.add_argument("--out", default="artifacts/startup_report.md")
+  args = p.parse_args()
+
+  results: Dict[str, Dict[str, Any]] = {}
+  for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+    runs = [probe(backend, args.model_dir) for _ in range(args.runs)]
+    results[backend] = summarize(runs)
+    print(f"[startup] {backend}: {results[backend]}")
+
+  md = [
+    "# Startup benchmark\n\n",
+    f"Median of {args.runs} cold starts (fresh interpreter each).\n\n",
+    "| Backend | import app (s) | model load (s) | first request (s) | total (s) | RSS (MB) | heavy modules loaded |\n",
+    "|---|---:|---:|---:|---:|---:|---|\n",
+  ]
+  for backend, r in results.items():
+    md.append(
+      f"| {backend} | {r['import_app_s']} | {r['model_load_s']} | {r['first_request_s']} | "
+      f"{r['process_total_s']} | {r['rss_mb']} | {', '.join(r['heavy_after_load']) or '-'} |\n"
+    )
+
+  out = Path(args.out)
+  out.parent.mkdir(parents=True, exist_ok=True)
+  out.write_text("".join(md), encoding="utf-8")
+  out.with_suffix(".json").write_text(json.dumps(results, indent=2), encoding="utf-8")
+  print(f"[startup] report: {out}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,17 +1,25 @@
 ﻿from __future__ import annotations
 
 import argparse
+import hashlib
+import json
+import os
+import sys
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
-from datasets import load_dataset, Audio
+import datasets
+from datasets import load_dataset, load_from_disk, Audio
 from transformers import (
   Wav2Vec2ForCTC,
   Wav2Vec2Processor,
   TrainingArguments,
   Trainer,
+  TrainerCallback,
 )
 import evaluate
 
@@ -51,25 +59,16 @@ def find_text_column(cols: List[str]) -> str:
   raise ValueError(f"Could not find text column. Available columns: {cols}")
 
 
-def main() -> None:
-  p = argparse.ArgumentParser()
-  p.add_argument("--model_name", default="facebook/wav2vec2-large-xlsr-53")
-  p.add_argument("--dataset_name", default="ysdede/khanacademy-turkish")
-  p.add_argument("--train_percent", type=float, default=0.1)
-  p.add_argument("--eval_percent", type=float, default=0.05)
-  p.add_argument("--epochs", type=int, default=1)
-  p.add_argument("--output_dir", default="models/checkpoint")
-  args = p.parse_args()
-
-  # Load dataset
-  ds = load_dataset(args.dataset_name)
+def load_subsets(dataset_name: str, train_percent: float, eval_percent: float) -> Tuple[Any, Any, str]:
+  """Train/eval subsets (16 kHz audio) and the name of the transcript column."""
+  ds = load_dataset(dataset_name)
   if "train" not in ds:
     raise ValueError("Dataset has no 'train' split.")
 
   # pick a subset (engineering-centric: fast)
   train = ds["train"].shuffle(seed=42)
-  n_train = max(50, int(len(train) * args.train_percent))
-  n_eval = max(20, int(len(train) * args.eval_percent))
+  n_train = max(50, int(len(train) * train_percent))
+  n_eval = max(20, int(len(train) * eval_percent))
   train = train.select(range(n_train))
   eval_ds = ds["train"].shuffle(seed=123).select(range(n_eval))
 
@@ -82,26 +81,24 @@ def main() -> None:
 
   train = train.cast_column("audio", Audio(sampling_rate=16_000))
   eval_ds = eval_ds.cast_column("audio", Audio(sampling_rate=16_000))
+  return train, eval_ds, text_col
 
-  processor = Wav2Vec2Processor.from_pretrained(args.model_name)
-  model = Wav2Vec2ForCTC.from_pretrained(
-    args.model_name,
-    ctc_loss_reduction="mean",
-    pad_token_id=processor.tokenizer.pad_token_id,
-    vocab_size=len(processor.tokenizer),
-  )
 
+def make_prepare(processor: Wav2Vec2Processor, text_col: str):
   def prepare(batch: Dict[str, Any]) -> Dict[str, Any]:
     audio = batch["audio"]
     inputs = processor(audio["array"], sampling_rate=16_000)
     batch["input_values"] = inputs.input_values[0]
+    # used by group_by_length to bucket similar lengths (less padding per batch)
+    batch["input_length"] = len(batch["input_values"])
     with processor.as_target_processor():
       batch["labels"] = processor(batch[text_col]).input_ids
     return batch
 
-  train_proc = train.map(prepare, remove_columns=train.column_names, num_proc=1)
-  eval_proc = eval_ds.map(prepare, remove_columns=eval_ds.column_names, num_proc=1)
+  return prepare
+
 
+def make_compute_metrics(processor: Wav2Vec2Processor):
   wer_metric = evaluate.load("wer")
 
   def compute_metrics(pred):
@@ -117,13 +114,259 @@ def main() -> None:
     wer = wer_metric.compute(predictions=pred_str, references=label_str)
     return {"wer": wer}
 
+  return compute_metrics
+
+
+def processor_fingerprint(processor: Wav2Vec2Processor) -> str:
+  h = hashlib.sha1(processor.feature_extractor.to_json_string().encode("utf-8"))
+  h.update(json.dumps(processor.tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+  return h.hexdigest()[:12]
+
+
+def features_cache_dir(args: argparse.Namespace, text_col: str, processor: Wav2Vec2Processor) -> Path:
+  """One folder per (dataset, subset selection, text column, processor, datasets version)."""
+  key = json.dumps({
+    "dataset": args.dataset_name,
+    "train_percent": args.train_percent,
+    "eval_percent": args.eval_percent,
+    "text_col": text_col,
+    "processor": processor_fingerprint(processor),
+    "datasets": datasets.__version__,
+  }, sort_keys=True)
+  name = f"{args.dataset_name.replace('/', '__')}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+  return Path(args.features_cache) / name
+
+
+def load_or_prepare(split_name: str, raw, prepare, cache: Path, num_proc: int) -> Tuple[Any, Dict[str, Any]]:
+  """Feature-extracted split from the Arrow cache (memory-mapped), building it on first use."""
+  path = cache / split_name
+  if (path / "dataset_info.json").exists():
+    start = time.perf_counter()
+    ds = load_from_disk(path.as_posix())
+    return ds, {"split": split_name, "cached": True, "load_s": round(time.perf_counter() - start, 2)}
+
+  start = time.perf_counter()
+  ds = raw.map(prepare, remove_columns=raw.column_names, num_proc=num_proc)
+  elapsed = time.perf_counter() - start
+  ds.save_to_disk(path.as_posix())
+  audio_s = float(np.sum(ds["input_length"])) / 16_000
+  stats = {
+    "split": split_name,
+    "cached": False,
+    "examples": len(ds),
+    "num_proc": num_proc,
+    "preprocess_s": round(elapsed, 2),
+    "examples_per_s": round(len(ds) / elapsed, 2),
+    "audio_s_per_s": round(audio_s / elapsed, 2),
+  }
+  return load_from_disk(path.as_posix()), stats
+
+
+def benchmark_loader(trainer: Trainer, max_batches: int) -> Dict[str, Any]:
+  """Batches/s of the training DataLoader alone (Arrow read + collate + padding), no model."""
+  loader = trainer.get_train_dataloader()
+  n_batches = samples = frames = 0
+  start = time.perf_counter()
+  for batch in loader:
+    n_batches += 1
+    samples += batch["input_values"].shape[0]
+    frames += batch["input_values"].numel()
+    if n_batches >= max_batches:
+      break
+  elapsed = time.perf_counter() - start
+  return {
+    "batches": n_batches,
+    "samples_per_s": round(samples / elapsed, 2),
+    "batches_per_s": round(n_batches / elapsed, 2),
+    # padded input / real input: what length grouping saves
+    "padded_audio_s_per_s": round(frames / 16_000 / elapsed, 2),
+  }
+
+
+class ThroughputCallback(TrainerCallback):
+  """
+  Splits wall time into waiting for the next batch (step end -> next step
+  begin) and compute (step begin -> step end). A high data-wait share means
+  training is input-bound.
+  """
+
+  def __init__(self) -> None:
+    self.data_wait = 0.0
+    self.compute = 0.0
+    self.steps = 0
+    self._t: Optional[float] = None
+    self._train_start = 0.0
+
+  def on_train_begin(self, args, state, control, **kwargs):
+    self._train_start = self._t = time.perf_counter()
+
+  def on_step_begin(self, args, state, control, **kwargs):
+    now = time.perf_counter()
+    if self._t is not None:
+      self.data_wait += now - self._t
+    self._t = now
+
+  def on_step_end(self, args, state, control, **kwargs):
+    now = time.perf_counter()
+    if self._t is not None:
+      self.compute += now - self._t
+    self.steps += 1
+    self._t = now
+
+  def on_evaluate(self, args, state, control, **kwargs):
+    self._t = None  # evaluation time is neither
+
+  def summary(self, samples_per_step: int) -> Dict[str, Any]:
+    total = self.data_wait + self.compute
+    return {
+      "steps": self.steps,
+      "train_wall_s": round(time.perf_counter() - self._train_start, 2),
+      "data_wait_s": round(self.data_wait, 2),
+      "compute_s": round(self.compute, 2),
+      "data_wait_share": round(self.data_wait / total, 3) if total else None,
+      "samples_per_s": round(self.steps * samples_per_step / total, 2) if total else None,
+    }
+
+
+def bf16_supported() -> bool:
+  if torch.cuda.is_available():
+    return torch.cuda.is_bf16_supported()
+  # CPU bf16 autocast only pays off with native support (AVX512-BF16 / AMX)
+  try:
+    return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+  except (AttributeError, RuntimeError):
+    return False
+
+
+def freeze_lower_layers(model: Wav2Vec2ForCTC, n_layers: int) -> None:
+  # the feature projection feeds layer 0, so it goes with the lower layers
+  if n_layers <= 0:
+    return
+  for param in model.wav2vec2.feature_projection.parameters():
+    param.requires_grad = False
+  for layer in model.wav2vec2.encoder.layers[:n_layers]:
+    for param in layer.parameters():
+      param.requires_grad = False
+
+
+def add_lora(model: Wav2Vec2ForCTC, args: argparse.Namespace):
+  """Wraps attention projections of the trainable layers in LoRA adapters; lm_head stays fully trainable."""
+  from peft import LoraConfig, get_peft_model
+
+  n_layers = len(model.wav2vec2.encoder.layers)
+  config = LoraConfig(
+    r=args.lora_r,
+    lora_alpha=args.lora_alpha,
+    lora_dropout=args.lora_dropout,
+    target_modules=[m.strip() for m in args.lora_targets.split(",") if m.strip()],
+    layers_to_transform=list(range(max(0, args.freeze_layers), n_layers)),
+    layers_pattern="layers",
+    modules_to_save=["lm_head"],
+    bias="none",
+  )
+  return get_peft_model(model, config)
+
+
+def trainable_params(model: torch.nn.Module) -> Dict[str, Any]:
+  total = sum(p.numel() for p in model.parameters())
+  trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+  return {"trainable": trainable, "total": total, "trainable_pct": round(100.0 * trainable / total, 3)}
+
+
+def peak_memory_mb() -> Dict[str, float]:
+  # covers this process only (not dataloader workers)
+  try:
+    import resource
+
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = kb / (1024 * 1024 if sys.platform == "darwin" else 1024)
+  except ImportError:  # Windows
+    import psutil
+
+    rss = psutil.Process().memory_info().peak_wset / 2**20
+  out = {"peak_rss_mb": round(rss, 1)}
+  if torch.cuda.is_available():
+    out["peak_cuda_mb"] = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+  return out
+
+
+def main() -> None:
+  p = argparse.ArgumentParser()
+  p.add_argument("--model_name", default="facebook/wav2vec2-large-xlsr-53")
+  p.add_argument("--dataset_name", default="ysdede/khanacademy-turkish")
+  p.add_argument("--train_percent", type=float, default=0.1)
+  p.add_argument("--eval_percent", type=float, default=0.05)
+  p.add_argument("--epochs", type=int, default=1)
+  p.add_argument("--output_dir", default="models/checkpoint")
+  p.add_argument("--batch_size", type=int, default=8, help="Per-device train/eval batch size")
+  p.add_argument("--num_proc", type=int, default=os.cpu_count() or 1, help="Processes for feature extraction")
+  p.add_argument("--features_cache", default="data/features_cache", help="Arrow cache of extracted features")
+  p.add_argument("--dataloader_workers", type=int, default=2)
+  p.add_argument("--loader_benchmark_batches", type=int, default=50, help="0 = skip the DataLoader-only pass")
+  p.add_argument("--learning_rate", type=float, default=None, help="Default: 5e-5, or 1e-3 with LoRA")
+  p.add_argument("--grad_accum", type=int, default=1, help="Gradient accumulation steps")
+  p.add_argument("--freeze_feature_encoder", action="store_true", help="Freeze the CNN feature encoder")
+  p.add_argument("--freeze_layers", type=int, default=0, help="Also freeze the lowest N transformer layers")
+  p.add_argument("--lora_r", type=int, default=0, help="LoRA rank; 0 = full fine-tuning")
+  p.add_argument("--lora_alpha", type=int, default=32)
+  p.add_argument("--lora_dropout", type=float, default=0.05)
+  p.add_argument("--lora_targets", default="q_proj,v_proj", help="Comma-separated module names")
+  p.add_argument("--bf16", choices=["auto", "on", "off"], default="auto", help="bf16 autocast (auto = if supported)")
+  p.add_argument("--gradient_checkpointing", action="store_true")
+  p.add_argument(
+    "--cpu_efficient",
+    action="store_true",
+    help="Preset: freeze feature encoder, LoRA r=8, gradient checkpointing, grad_accum>=4",
+  )
+  p.add_argument("--runs_log", default="artifacts/train_runs.jsonl", help="One line per run: config, speed, memory")
+  args = p.parse_args()
+
+  if args.cpu_efficient:
+    args.freeze_feature_encoder = True
+    args.gradient_checkpointing = True
+    args.lora_r = args.lora_r or 8
+    args.grad_accum = max(args.grad_accum, 4)
+
+  train, eval_ds, text_col = load_subsets(args.dataset_name, args.train_percent, args.eval_percent)
+
+  processor = Wav2Vec2Processor.from_pretrained(args.model_name)
+  model = Wav2Vec2ForCTC.from_pretrained(
+    args.model_name,
+    ctc_loss_reduction="mean",
+    pad_token_id=processor.tokenizer.pad_token_id,
+    vocab_size=len(processor.tokenizer),
+  )
+
+  if args.freeze_feature_encoder:
+    model.freeze_feature_encoder()
+  if args.lora_r > 0:
+    # peft freezes every base weight itself, only adapters + lm_head train
+    model = add_lora(model, args)
+  else:
+    freeze_lower_layers(model, args.freeze_layers)
+  params = trainable_params(model)
+  print(f"[train] parameters: {params}")
+
+  # decode + resample + normalize once, in parallel; later runs reuse the cache
+  prepare = make_prepare(processor, text_col)
+  cache = features_cache_dir(args, text_col, processor)
+  train_proc, train_stats = load_or_prepare("train", train, prepare, cache, args.num_proc)
+  eval_proc, eval_stats = load_or_prepare("eval", eval_ds, prepare, cache, args.num_proc)
+  throughput: Dict[str, Any] = {"features_cache": cache.as_posix(), "preprocess": [train_stats, eval_stats]}
+  print(f"[train] features: {throughput['preprocess']}")
+
+  compute_metrics = make_compute_metrics(processor)
   collator = DataCollatorCTCWithPadding(processor=processor, padding=True)
 
+  use_bf16 = args.bf16 == "on" or (args.bf16 == "auto" and bf16_supported())
+
   training_args = TrainingArguments(
     output_dir=args.output_dir,
     group_by_length=True,
-    per_device_train_batch_size=2,
-    per_device_eval_batch_size=2,
+    length_column_name="input_length",
+    per_device_train_batch_size=args.batch_size,
+    per_device_eval_batch_size=args.batch_size,
+    dataloader_num_workers=args.dataloader_workers,
     evaluation_strategy="steps",
     save_strategy="steps",
     logging_strategy="steps",
@@ -131,11 +374,18 @@ def main() -> None:
     eval_steps=50,
     save_steps=50,
     num_train_epochs=args.epochs,
-    fp16=torch.cuda.is_available(),
+    learning_rate=args.learning_rate or (1e-3 if args.lora_r > 0 else 5e-5),
+    gradient_accumulation_steps=args.grad_accum,
+    gradient_checkpointing=args.gradient_checkpointing,
+    # non-reentrant checkpointing still backprops when the layer inputs are frozen (LoRA)
+    gradient_checkpointing_kwargs={"use_reentrant": False},
+    bf16=use_bf16,
+    fp16=torch.cuda.is_available() and not use_bf16,
     report_to=["tensorboard"],
     run_name="turkish_asr_task2",
   )
 
+  speed = ThroughputCallback()
   trainer = Trainer(
     model=model,
     args=training_args,
@@ -144,12 +394,43 @@ def main() -> None:
     eval_dataset=eval_proc,
     tokenizer=processor.feature_extractor,
     compute_metrics=compute_metrics,
+    callbacks=[speed],
   )
 
-  trainer.train()
-
-  # Save model + processor
-  trainer.save_model(args.output_dir)
+  if args.loader_benchmark_batches > 0:
+    throughput["dataloader"] = benchmark_loader(trainer, args.loader_benchmark_batches)
+    print(f"[train] dataloader only: {throughput['dataloader']}")
+
+  train_output = trainer.train()
+
+  throughput["training"] = speed.summary(args.batch_size * training_args.gradient_accumulation_steps)
+  throughput["training"]["trainer_samples_per_s"] = train_output.metrics.get("train_samples_per_second")
+  throughput["training"].update(peak_memory_mb())
+  throughput["config"] = {
+    "batch_size": args.batch_size,
+    "grad_accum": args.grad_accum,
+    "freeze_feature_encoder": args.freeze_feature_encoder,
+    "freeze_layers": args.freeze_layers,
+    "lora_r": args.lora_r,
+    "bf16": use_bf16,
+    "fp16": training_args.fp16,
+    "gradient_checkpointing": args.gradient_checkpointing,
+    "parameters": params,
+  }
+  print(f"[train] training: {throughput['training']}")
+  Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+  (Path(args.output_dir) / "train_throughput.json").write_text(json.dumps(throughput, indent=2), encoding="utf-8")
+  runs_log = Path(args.runs_log)
+  runs_log.parent.mkdir(parents=True, exist_ok=True)
+  with runs_log.open("a", encoding="utf-8") as f:
+    f.write(json.dumps({"output_dir": args.output_dir, **throughput["config"], **throughput["training"]}) + "\n")
+
+  # Save model + processor. Adapters are merged into the base weights so the
+  # checkpoint is a plain Wav2Vec2ForCTC (export.py loads it unchanged).
+  if args.lora_r > 0:
+    trainer.model.merge_and_unload().save_pretrained(args.output_dir)
+  else:
+    trainer.save_model(args.output_dir)
   processor.save_pretrained(args.output_dir)
 
   print(f"[train] done. checkpoint saved to: {args.output_dir}")
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from audio_manifest import AudioItem, read_manifest  # noqa: E402
+
+SAMPLING_RATE = 16_000
+
+
+def probe_duration(path: str) -> float:
+  """Header-only length (used to sort before decoding anything)."""
+  import soundfile as sf
+
+  try:
+    return float(sf.info(path).duration)
+  except RuntimeError:  # formats libsndfile cannot read (e.g. m4a)
+    import librosa
+
+    try:
+      return float(librosa.get_duration(path=path))
+    except Exception:  # unreadable: reported as an error row when loading
+      return 0.0
+
+
+def _load(path: str) -> Tuple[Optional[np.ndarray], float, Optional[str]]:
+  # runs in the prefetch pool: decode + resample are CPU-bound
+  from app.asr import load_audio
+
+  start = time.perf_counter()
+  try:
+    audio = load_audio(path)
+  except Exception as e:
+    return None, time.perf_counter() - start, repr(e)
+  return audio, time.perf_counter() - start, None
+
+
+def prefetch(
+  pool: ProcessPoolExecutor, items: List[AudioItem], depth: int
+) -> Iterator[Tuple[AudioItem, Tuple[Optional[np.ndarray], float, Optional[str]]]]:
+  """Decode up to `depth` files ahead of the consumer, in order (bounded memory)."""
+  pending: "deque[Tuple[AudioItem, Future]]" = deque()
+  it = iter(items)
+  for item in it:
+    pending.append((item, pool.submit(_load, item.audio)))
+    if len(pending) >= depth:
+      break
+  while pending:
+    item, fut = pending.popleft()
+    nxt = next(it, None)
+    if nxt is not None:
+      pending.append((nxt, pool.submit(_load, nxt.audio)))
+    yield item, fut.result()
+
+
+def done_ids(out_path: Path) -> Set[str]:
+  """Ids already transcribed successfully (rows with errors are retried)."""
+  if not out_path.exists():
+    return set()
+  ids = set()
+  with out_path.open("r", encoding="utf-8") as f:
+    for line in f:
+      try:
+        row = json.loads(line)
+      except json.JSONDecodeError:  # partial last line of an interrupted run
+        continue
+      if "error" not in row:
+        ids.add(row["id"])
+  return ids
+
+
+def batches(
+  loaded: Iterator[Tuple[AudioItem, Tuple[Optional[np.ndarray], float, Optional[str]]]],
+  batch_size: int,
+  max_batch_seconds: float,
+) -> Iterator[List[Tuple[AudioItem, Optional[np.ndarray], float, Optional[str]]]]:
+  """Group length-sorted clips; a batch is capped by rows and by padded audio (rows x longest)."""
+  batch: List[Tuple[AudioItem, Optional[np.ndarray], float, Optional[str]]] = []
+  longest = 0
+  for item, (audio, load_s, error) in loaded:
+    n = len(audio) if audio is not None else 0
+    if batch and (
+      len(batch) >= batch_size or (len(batch) + 1) * max(longest, n) > max_batch_seconds * SAMPLING_RATE
+    ):
+      yield batch
+      batch, longest = [], 0
+    batch.append((item, audio, load_s, error))
+    longest = max(longest, n)
+  if batch:
+    yield batch
+
+
+def transcribe_batch(asr, batch, args: argparse.Namespace) -> List[Dict[str, Any]]:
+  rows: List[Dict[str, Any]] = []
+  ok = [(item, audio, load_s) for item, audio, load_s, error in batch if error is None]
+  for item, _, load_s, error in batch:
+    if error is not None:
+      rows.append({"id": item.id, "audio": item.audio, "error": error, "load_s": round(load_s, 4)})
+  if not ok:
+    return rows
+
+  if args.vad:
+    # VAD batches each file's speech segments itself
+    for item, audio, load_s in ok:
+      result = asr.transcribe_audio(audio, with_timestamps=args.timestamps, decoder=args.decoder, vad=True)
+      row = {
+        "id": item.id,
+        "audio": item.audio,
+        "text": result.text,
+        "duration_s": round(len(audio) / SAMPLING_RATE, 3),
+        "load_s": round(load_s, 4),
+        "inference_s": round(result.inference_time, 4),
+        "speech_ratio": result.speech_ratio,
+        "segments": [asdict(seg) for seg in result.segments or []],
+      }
+      if item.text is not None:
+        row["reference"] = item.text
+      rows.append(row)
+    return rows
+
+  input_values, attention_mask = asr.extract_features([audio for _, audio, _ in ok])
+  start = time.perf_counter()
+  logits = asr.infer(input_values, attention_mask)
+  inference_s = time.perf_counter() - start
+
+  total = sum(len(audio) for _, audio, _ in ok)
+  for row_idx, (item, audio, load_s) in enumerate(ok):
+    # drop frames that only cover batch padding
+    frames = logits[row_idx:row_idx + 1, :asr.geometry.num_frames(len(audio))]
+    decoded = asr.decode(frames, with_timestamps=args.timestamps, decoder=args.decoder)
+    row = {
+      "id": item.id,
+      "audio": item.audio,
+      "text": decoded.text,
+      "duration_s": round(len(audio) / SAMPLING_RATE, 3),
+      "load_s": round(load_s, 4),
+      # batch inference time, attributed by share of audio
+      "inference_s": round(inference_s * len(audio) / total, 4),
+      "batch_size": len(ok),
+    }
+    if decoded.words is not None:
+      row["words"] = [asdict(w) for w in decoded.words]
+    if item.text is not None:
+      row["reference"] = item.text
+    rows.append(row)
+  return rows
+
+
+def main() -> None:
+  p = argparse.ArgumentParser(description="Offline transcription of a folder or JSONL manifest")
+  p.add_argument("--input", required=True, help="Audio folder or JSONL manifest (see scripts/audio_manifest.py)")
+  p.add_argument("--output", required=True, help="JSONL results; appended to, so reruns resume")
+  p.add_argument("--model_dir", default="models/onnx")
+  p.add_argument("--backend", default="onnx_int8")
+  p.add_argument("--batch_size", type=int, default=8)
+  p.add_argument("--max_batch_seconds", type=float, default=240.0, help="Cap on padded audio per batch")
+  p.add_argument("--prefetch_workers", type=int, default=4, help="Processes decoding audio ahead of inference")
+  p.add_argument("--prefetch_depth", type=int, default=32, help="Decoded files kept ready ahead of inference")
+  p.add_argument("--window", type=int, default=512, help="Files sorted by length together")
+  p.add_argument("--decoder", choices=["greedy", "beam"], default="greedy")
+  p.add_argument("--timestamps", action="store_true")
+  p.add_argument("--vad", action="store_true", help="Transcribe speech segments only")
+  p.add_argument("--no_resume", action="store_true", help="Truncate --output instead of skipping finished ids")
+  p.add_argument("--summary", default=None, help="Optional JSON with throughput numbers")
+  args = p.parse_args()
+
+  from app.asr import ASRService
+
+  out_path = Path(args.output)
+  out_path.parent.mkdir(parents=True, exist_ok=True)
+  if args.no_resume and out_path.exists():
+    out_path.unlink()
+
+  if out_path.exists() and out_path.stat().st_size and not out_path.read_bytes().endswith(b"\n"):
+    # interrupted mid-line: terminate it so appended rows stay parseable
+    with out_path.open("ab") as f:
+      f.write(b"\n")
+
+  items = read_manifest(args.input)
+  finished = done_ids(out_path)
+  todo = [it for it in items if it.id not in finished]
+  print(f"[batch] {len(items)} files, {len(finished)} already done, {len(todo)} to go")
+
+  asr = ASRService(model_dir=args.model_dir, backend=args.backend)  # type: ignore[arg-type]
+
+  wall_start = time.perf_counter()
+  audio_s = 0.0
+  n_ok = n_err = 0
+  # spawn, not fork: the ORT session above already runs thread pools, and forked
+  # children would inherit them (deadlocks) along with a copy of the model
+  pool = ProcessPoolExecutor(max_workers=max(1, args.prefetch_workers), mp_context=multiprocessing.get_context("spawn"))
+  with pool, out_path.open("a", encoding="utf-8") as out:
+    for w in range(0, len(todo), args.window):
+      # longest first: similar lengths share a batch (less padding) and the
+      # largest allocations happen up front
+      window = sorted(todo[w:w + args.window], key=lambda it: probe_duration(it.audio), reverse=True)
+      loaded = prefetch(pool, window, args.prefetch_depth)
+
+      for batch in batches(loaded, args.batch_size, args.max_batch_seconds):
+        for row in transcribe_batch(asr, batch, args):
+          out.write(json.dumps(row, ensure_ascii=False) + "\n")
+          if "error" in row:
+            n_err += 1
+          else:
+            n_ok += 1
+            audio_s += row["duration_s"]
+        out.flush()
+
+      elapsed = time.perf_counter() - wall_start
+      print(f"[batch] {n_ok + n_err}/{len(todo)} files, {audio_s / 3600:.2f} audio h in {elapsed / 60:.1f} min")
+
+  wall_s = time.perf_counter() - wall_start
+  asr.close()
+  summary = {
+    "files_ok": n_ok,
+    "files_failed": n_err,
+    "files_skipped": len(finished),
+    "audio_hours": round(audio_s / 3600, 4),
+    "wall_hours": round(wall_s / 3600, 4),
+    "audio_hours_per_wall_hour": round(audio_s / wall_s, 2) if wall_s > 0 else None,
+    "backend": args.backend,
+    "batch_size": args.batch_size,
+    "prefetch_workers": args.prefetch_workers,
+  }
+  print(json.dumps(summary, indent=2))
+  if args.summary:
+    Path(args.summary).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,36 @@
+import numpy as np
+
+from app.vad import VadConfig, detect_speech
+
+SR = 16_000
+
+
+def _speech_like(levels_db, seconds_each, rng):
+  """Noise bursts whose loudness follows `levels_db` (dBFS), one level per chunk."""
+  chunks = []
+  for level in levels_db:
+    n = int(seconds_each * SR)
+    chunks.append(rng.standard_normal(n) * 10 ** (level / 20.0))
+  return np.concatenate(chunks).astype(np.float32)
+
+
+def _covered(spans, n):
+  return sum(e - s for s, e in spans) / n
+
+
+def test_energy_vad_keeps_speech_from_start_to_end():
+  rng = np.random.default_rng(0)
+  # 10 s with no silence: loud and quiet syllables within ~15 dB of each other
+  audio = _speech_like(rng.uniform(-30, -15, size=100), 0.1, rng)
+  spans = detect_speech(audio, VadConfig(mode="energy"))
+  assert _covered(spans, len(audio)) > 0.95
+
+
+def test_energy_vad_still_drops_silence():
+  rng = np.random.default_rng(1)
+  speech = _speech_like(rng.uniform(-30, -15, size=20), 0.1, rng)
+  silence = _speech_like([-70] * 30, 0.1, rng)
+  audio = np.concatenate([silence, speech, silence, speech, silence])
+  spans = detect_speech(audio, VadConfig(mode="energy", pad_s=0.0))
+  assert len(spans) == 2
+  assert 0.3 < _covered(spans, len(audio)) < 0.5
@@ -9,23 +9,16 @@ from datasets import load_dataset
 from tqdm import tqdm
 
 from pii_guard.config import DATA
+from pii_guard.inference.rules import looks_like_pii
 
 
 SENT_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
-EMAIL_RE = re.compile(r"\b[\w\.-]+@[\w\.-]+\.\w+\b", re.IGNORECASE)
-PHONE_RE = re.compile(r"(\+994|0)\s*\d{2}[\s-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}")
-CARD_RE = re.compile(r"\b(?:\d[ -]*?){13,19}\b")  # loose card-like
-FIN_RE = re.compile(r"\b[A-Z0-9]{7}\b")  # loose FIN-like
 
 
 def normalize_ws(s: str) -> str:
     return re.sub(r"\s+", " ", s).strip()
 
 
-def looks_like_pii(s: str) -> bool:
-    return bool(EMAIL_RE.search(s) or PHONE_RE.search(s) or CARD_RE.search(s) or FIN_RE.search(s))
-
-
 def iter_sentences(text: str, min_chars: int, max_chars: int) -> Iterable[str]:
     text = normalize_ws(text)
     if not text:
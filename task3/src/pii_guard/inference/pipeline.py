@@ -1,11 +1,13 @@
 ﻿import re
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import onnxruntime as ort
 from transformers import AutoTokenizer
 
+from pii_guard.inference.rules import prefilter as rule_prefilter
+
 
 LABELS = [
     "O",
@@ -26,13 +28,19 @@ class CascadeResult:
     masked_text: str
     guardrail_score: float
     entities: List[Tuple[str, str]]  # (entity_label, entity_text)
+    decided_by: str = "classifier"  # or "rules" (stage 0 prefilter)
 
 
 class PiiCascade:
     """
     Efficient cascade:
+      0) optional regex/gazetteer prefilter (rules.prefilter): clear cases skip the classifier
       1) ONNX INT8 classifier
       2) if unsafe -> ONNX INT8 token classifier + mask spans
+
+    mode="multitask" uses one ONNX graph (shared encoder, see
+    pii_guard.training.train_multitask) that returns both the guardrail and
+    the NER logits in a single forward pass.
     """
 
     def __init__(
@@ -43,41 +51,156 @@ class PiiCascade:
         ner_onnx: str = "models/ner/onnx/model.int8.onnx",
         max_len: int = 96,  # keep small for speed
         threshold: float = 0.5,
+        share_tokenizer: Optional[bool] = None,  # None = detect
+        mode: str = "cascade",  # "cascade" | "multitask"
+        multitask_dir: str = "models/multitask/onnx",
+        multitask_onnx: str = "models/multitask/onnx/model.int8.onnx",
+        prefilter: bool = False,
     ):
+        if mode not in ("cascade", "multitask"):
+            raise ValueError(f"Unknown mode: {mode}")
         self.max_len = max_len
         self.threshold = threshold
+        self.mode = mode
+        self.prefilter = prefilter
+
+        if mode == "multitask":
+            self.clf_tok = self.ner_tok = AutoTokenizer.from_pretrained(multitask_dir, use_fast=True)
+            self.shared_tokenizer = True
+            self.mt_sess = ort.InferenceSession(multitask_onnx, providers=["CPUExecutionProvider"])
+            self._mt_inputs = {i.name for i in self.mt_sess.get_inputs()}
+            return
 
         self.clf_tok = AutoTokenizer.from_pretrained(clf_dir, use_fast=True)
         self.ner_tok = AutoTokenizer.from_pretrained(ner_dir, use_fast=True)
+        if share_tokenizer is None:
+            share_tokenizer = self._same_tokenizer(self.clf_tok, self.ner_tok)
+        self.shared_tokenizer = share_tokenizer
+        if self.shared_tokenizer:
+            # both models come from the same base checkpoint: one tokenizer, one encoding per text
+            self.ner_tok = self.clf_tok
 
         self.clf_sess = ort.InferenceSession(clf_onnx, providers=["CPUExecutionProvider"])
         self.ner_sess = ort.InferenceSession(ner_onnx, providers=["CPUExecutionProvider"])
+        self._clf_inputs = {i.name for i in self.clf_sess.get_inputs()}
+        self._ner_inputs = {i.name for i in self.ner_sess.get_inputs()}
+
+    @staticmethod
+    def _same_tokenizer(a, b) -> bool:
+        # the serialized fast tokenizer covers vocab, normalizer, pre-tokenizer and special-token post-processing
+        if not (a.is_fast and b.is_fast):
+            return False
+        return a.backend_tokenizer.to_str() == b.backend_tokenizer.to_str() and a.padding_side == b.padding_side
 
     @staticmethod
     def _sigmoid(x: float) -> float:
         return float(1.0 / (1.0 + np.exp(-x)))
 
+    def _encode(self, tok, texts: Sequence[str], offsets: bool) -> Dict[str, np.ndarray]:
+        enc = tok(
+            list(texts),
+            return_tensors="np",
+            padding=True,
+            truncation=True,
+            max_length=self.max_len,
+            return_offsets_mapping=offsets,
+        )
+        return dict(enc)
+
+    def _rows(self, enc: Dict[str, np.ndarray], rows: List[int]) -> Dict[str, np.ndarray]:
+        """Sub-batch of an encoding, trimmed to the longest of those rows."""
+        sub = {k: v[rows] for k, v in enc.items()}
+        if self.clf_tok.padding_side == "right":
+            width = int(sub["attention_mask"].sum(axis=1).max())
+            sub = {k: v[:, :width] for k, v in sub.items()}
+        return sub
+
     def _clf_predict_proba_unsafe(self, text: str) -> float:
-        enc = self.clf_tok(text, return_tensors="np", truncation=True, max_length=self.max_len)
-        logits = self.clf_sess.run(None, dict(enc))[0]  # (1,2)
-        # logits[0,1] => unsafe logit vs safe logit; use softmax
+        return float(self._clf_predict_proba_unsafe_batch([text])[0])
+
+    @staticmethod
+    def _proba_unsafe(logits: np.ndarray) -> np.ndarray:
+        # logits[:,1] => unsafe logit vs safe logit; use softmax
         exps = np.exp(logits - logits.max(axis=-1, keepdims=True))
         probs = exps / exps.sum(axis=-1, keepdims=True)
-        return float(probs[0, 1])
+        return probs[:, 1]
+
+    def _clf_predict_proba_unsafe_batch(
+        self, texts: Sequence[str], enc: Optional[Dict[str, np.ndarray]] = None
+    ) -> np.ndarray:
+        if enc is None:
+            enc = self._encode(self.clf_tok, texts, offsets=False)
+        feed = {k: v for k, v in enc.items() if k in self._clf_inputs}
+        logits = self.clf_sess.run(None, feed)[0]  # (batch,2)
+        return self._proba_unsafe(logits)
 
     def _ner_predict(self, text: str) -> Dict:
-        enc = self.ner_tok(
-            text,
-            return_tensors="np",
-            truncation=True,
-            max_length=self.max_len,
-            return_offsets_mapping=True,
-        )
-        offsets = enc.pop("offset_mapping")[0].tolist()  # list of [start,end]
-        logits = self.ner_sess.run(None, dict(enc))[0][0]  # (seq, num_labels)
-        pred_ids = logits.argmax(axis=-1).tolist()
-        tokens = self.ner_tok.convert_ids_to_tokens(enc["input_ids"][0].tolist())
-        return {"tokens": tokens, "pred_ids": pred_ids, "offsets": offsets}
+        return self._ner_predict_batch([text])[0]
+
+    def _ner_predict_batch(self, texts: Sequence[str], enc: Optional[Dict[str, np.ndarray]] = None) -> List[Dict]:
+        if enc is None:
+            enc = self._encode(self.ner_tok, texts, offsets=True)
+        feed = {k: v for k, v in enc.items() if k in self._ner_inputs}
+        logits = self.ner_sess.run(None, feed)[0]  # (batch, seq, num_labels)
+        return self._ner_preds(enc, logits, list(range(len(logits))))
+
+    def _ner_preds(self, enc: Dict[str, np.ndarray], logits: np.ndarray, rows: List[int]) -> List[Dict]:
+        # padding tokens get offset (0,0) like special tokens, so _extract_spans skips them
+        preds = []
+        for row in rows:
+            ids = enc["input_ids"][row].tolist()
+            preds.append({
+                "tokens": self.ner_tok.convert_ids_to_tokens(ids),
+                "pred_ids": logits[row].argmax(axis=-1).tolist(),
+                "offsets": enc["offset_mapping"][row].tolist(),
+            })
+        return preds
+
+    def _predict_chunk(self, chunk: List[str]) -> Tuple[np.ndarray, Dict[int, Dict], List[bool]]:
+        """
+        Unsafe probability of every text, NER predictions keyed by row for the
+        unsafe ones, and which rows the prefilter decided (score 0.0 / 1.0).
+        """
+        p_unsafe = np.full(len(chunk), np.nan)  # nan = ask the classifier
+        if self.prefilter:
+            for j, text in enumerate(chunk):
+                decision = rule_prefilter(text)
+                if decision is not None:
+                    p_unsafe[j] = 1.0 if decision else 0.0
+        by_rules = [not np.isnan(p) for p in p_unsafe]
+
+        # rows ruled SAFE need nothing else; rows ruled UNSAFE still need NER
+        todo = [j for j in range(len(chunk)) if p_unsafe[j] != 0.0]
+        if not todo:
+            return p_unsafe, {}, by_rules
+        sub = [chunk[j] for j in todo]
+        ask = [k for k, j in enumerate(todo) if np.isnan(p_unsafe[j])]
+
+        if self.mode == "multitask":
+            # one encoder pass yields both heads; NER rows of safe texts are just ignored
+            enc = self._encode(self.clf_tok, sub, offsets=True)
+            feed = {k: v for k, v in enc.items() if k in self._mt_inputs}
+            clf_logits, ner_logits = self.mt_sess.run(["clf_logits", "ner_logits"], feed)
+            p_model = self._proba_unsafe(clf_logits)
+            for k in ask:
+                p_unsafe[todo[k]] = p_model[k]
+            unsafe = [k for k, j in enumerate(todo) if p_unsafe[j] >= self.threshold]
+            preds = self._ner_preds(enc, ner_logits, unsafe)
+            return p_unsafe, {todo[k]: pred for k, pred in zip(unsafe, preds)}, by_rules
+
+        # shared tokenizer: encode once (with offsets) and hand the same encoding to NER
+        enc = self._encode(self.clf_tok, sub, offsets=True) if self.shared_tokenizer else None
+        if ask:
+            ask_enc = self._rows(enc, ask) if enc is not None and len(ask) < len(sub) else enc
+            p_model = self._clf_predict_proba_unsafe_batch([sub[k] for k in ask], ask_enc)
+            for k, p in zip(ask, p_model):
+                p_unsafe[todo[k]] = p
+        unsafe = [k for k, j in enumerate(todo) if p_unsafe[j] >= self.threshold]
+        preds = []
+        if unsafe:
+            sub_enc = self._rows(enc, unsafe) if enc is not None else None
+            preds = self._ner_predict_batch([sub[k] for k in unsafe], sub_enc)
+        return p_unsafe, {todo[k]: pred for k, pred in zip(unsafe, preds)}, by_rules
 
     def _extract_spans(self, text: str, pred) -> List[Tuple[str, int, int]]:
         spans = []
@@ -142,13 +265,41 @@ class PiiCascade:
         masked = MULTI_STAR_RE.sub("****", masked)
         return masked, extracted
 
-    def run(self, text: str) -> CascadeResult:
-        p_unsafe = self._clf_predict_proba_unsafe(text)
-        is_unsafe = p_unsafe >= self.threshold
-        if not is_unsafe:
-            return CascadeResult(is_unsafe=False, masked_text=text, guardrail_score=p_unsafe, entities=[])
-
-        pred = self._ner_predict(text)
+    def _result(self, text: str, score: float, pred: Optional[Dict], by_rules: bool) -> CascadeResult:
+        decided_by = "rules" if by_rules else "classifier"
+        if pred is None:
+            return CascadeResult(
+                is_unsafe=False, masked_text=text, guardrail_score=score, entities=[], decided_by=decided_by
+            )
         spans = self._extract_spans(text, pred)
         masked, entities = self._mask_text(text, spans)
-        return CascadeResult(is_unsafe=True, masked_text=masked, guardrail_score=p_unsafe, entities=entities)
\ No newline at end of file
+        return CascadeResult(
+            is_unsafe=True, masked_text=masked, guardrail_score=score, entities=entities, decided_by=decided_by
+        )
+
+    def run(self, text: str) -> CascadeResult:
+        p_unsafe, ner_by_row, by_rules = self._predict_chunk([text])
+        return self._result(text, float(p_unsafe[0]), ner_by_row.get(0), by_rules[0])
+
+    def run_batch(self, texts: Sequence[str], batch_size: int = 32) -> List[CascadeResult]:
+        """
+        [run(t) for t in texts] with one classifier call per batch and one NER
+        call for the unsafe texts of that batch. Texts are batched by length
+        (less padding); results come back in input order.
+
+        Not bit-identical to run(): padding is masked in attention, but the
+        dynamically quantized INT8 graphs compute one activation scale over the
+        whole padded batch, so scores (and, near the threshold, decisions and
+        NER spans) can depend on batch makeup. Check with the benchmark's
+        cascade_throughput mismatch counts before relying on it.
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results: List[CascadeResult] = [None] * len(texts)  # type: ignore[list-item]
+
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            chunk = [texts[i] for i in idx]
+            p_unsafe, ner_by_row, by_rules = self._predict_chunk(chunk)
+            for j, text in enumerate(chunk):
+                results[idx[j]] = self._result(text, float(p_unsafe[j]), ner_by_row.get(j), by_rules[j])
+        return results
\ No newline at end of file
@@ -0,0 +1,114 @@
+import re
+from typing import Optional
+
+
+# PII-like patterns (also used to keep PII-looking sentences out of the SAFE training data)
+EMAIL_RE = re.compile(r"\b[\w\.-]+@[\w\.-]+\.\w+\b", re.IGNORECASE)
+PHONE_RE = re.compile(r"(\+994|0)\s*\d{2}[\s-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}")
+CARD_RE = re.compile(r"\b(?:\d[ -]*?){13,19}\b")  # loose card-like
+FIN_RE = re.compile(r"\b[A-Z0-9]{7}\b")  # loose FIN-like
+
+# words that usually introduce personal data; "FİN" is listed separately because
+# "İ".lower() is two characters and IGNORECASE does not fold it to "i"
+TRIGGER_RE = re.compile(
+    r"\b(?:FİN|fin|adım|adı|soyad|telefon|nömrə|mobil|kart|hesab|e-?poçt|e-?mail|ünvan|vəsiqə|doğum)\w*",
+    re.IGNORECASE,
+)
+
+FIRST_NAMES = {
+    "Elvin", "Aysel", "Nigar", "Orxan", "Leyla", "Kamal", "Zehra", "Murad", "Gunel", "Günel", "Ramil",
+    "Rəşad", "Rashad", "Tural", "Elnur", "Vüsal", "Anar", "Samir", "Fərid", "Farid", "Nicat", "Emil",
+    "Kənan", "Ilkin", "İlkin", "Aynur", "Sevinc", "Nərmin", "Narmin", "Lalə", "Lala", "Türkan", "Aygün",
+    "Səbinə", "Sabina", "Aytən", "Ülviyyə", "Könül", "Xədicə", "Məryəm", "Fatimə", "Əli", "Ali",
+    "Məmməd", "Mammad", "Hüseyn", "Huseyn", "Həsən", "Hasan", "Rauf", "Elşən", "Elshan", "Cavid",
+}
+LAST_NAMES = {
+    "Aliyev", "Aliyeva", "Əliyev", "Əliyeva", "Mammadov", "Mammadova", "Məmmədov", "Məmmədova",
+    "Huseynov", "Huseynova", "Hüseynov", "Hüseynova", "Hasanli", "Həsənli", "Quliyev", "Quliyeva",
+    "Abdullayev", "Abdullayeva", "Ismayilov", "Ismayilova", "İsmayılov", "İsmayılova", "Mustafayev",
+    "Mustafayeva", "Hasanov", "Hasanova", "Həsənov", "Həsənova", "Ibrahimov", "İbrahimov", "Rzayev",
+    "Rzayeva", "Nəsirov", "Nasirov", "Cəfərov", "Jafarov", "Babayev", "Babayeva", "Qasımov", "Gasimov",
+}
+# capitalized word with a typical Azerbaijani surname ending
+SURNAME_RE = re.compile(r"\b[A-ZÇƏĞIİÖŞÜ][a-zçəğıöşü]+(?:ov|ova|yev|yeva|zadə|zade)\b")
+WORD_RE = re.compile(r"\w+")
+LETTERS_RE = re.compile(r"[^\W\d_]+")
+DIGIT_RE = re.compile(r"\d")
+
+SENTENCE_END = ".!?…\n"
+OPENING_PUNCT = " \t\"'«“„(-–—"
+# common sentence openers; any other capitalized first word may be a name ("Zaur bu gün gəlmədi.")
+SENTENCE_STARTERS = {
+    "bu", "o", "bir", "mən", "sən", "biz", "siz", "onlar", "bizim", "sizin", "onun", "mənim", "sənin",
+    "salam", "sağ", "sağol", "təşəkkür", "zəhmət", "xahiş", "bəli", "xeyr", "hə", "yox", "ok", "oldu",
+    "və", "amma", "ancaq", "lakin", "çünki", "əgər", "ona", "buna", "onda", "sonra", "indi", "hələ",
+    "artıq", "bəs", "yəni", "belə", "elə", "necə", "nə", "niyə", "harada", "hara", "kim", "hansı",
+    "neçə", "haçan", "bugün", "sabah", "dünən", "hər", "heç", "çox", "az", "daha", "ən",
+    "hamı", "hamısı", "bütün", "burada", "orada", "bəzən", "həmişə", "əlbəttə", "yaxşı", "pis",
+    "the", "this", "it", "we", "i", "you", "please", "thanks", "hello", "hi",
+}
+
+
+def looks_like_pii(s: str) -> bool:
+    return bool(EMAIL_RE.search(s) or PHONE_RE.search(s) or CARD_RE.search(s) or FIN_RE.search(s))
+
+
+def luhn_ok(digits: str) -> bool:
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2 == 1:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+    return total % 10 == 0
+
+
+def has_name(s: str) -> bool:
+    return bool(SURNAME_RE.search(s)) or any(w in FIRST_NAMES or w in LAST_NAMES for w in WORD_RE.findall(s))
+
+
+def az_lower(word: str) -> str:
+    return word.replace("İ", "i").replace("I", "ı").lower()
+
+
+def has_name_like(s: str) -> bool:
+    """
+    Any word that could be a name the gazetteer does not know: a fully
+    upper-case word, a capitalized word inside a sentence, or a capitalized
+    sentence opener that is not a common function word.
+    """
+    for m in LETTERS_RE.finditer(s):
+        w = m.group(0)
+        if not w[0].isupper():
+            continue
+        if len(w) > 1 and w.isupper():
+            return True
+        before = s[: m.start()].rstrip(OPENING_PUNCT)
+        if before and before[-1] not in SENTENCE_END:
+            return True
+        if az_lower(w) not in SENTENCE_STARTERS:
+            return True
+    return False
+
+
+def prefilter(text: str) -> Optional[bool]:
+    """
+    Stage 0 of the cascade. True = certainly UNSAFE (email, Azerbaijani phone
+    number, Luhn-valid card number, FIN code next to its keyword), False =
+    certainly SAFE (no digits, no "@", no trigger word, no known, surname-shaped
+    or otherwise name-like capitalized word), None = ambiguous, ask the classifier.
+    """
+    if EMAIL_RE.search(text) or PHONE_RE.search(text):
+        return True
+    for m in CARD_RE.finditer(text):
+        digits = re.sub(r"\D", "", m.group(0))
+        if 13 <= len(digits) <= 19 and luhn_ok(digits):
+            return True
+    trigger = TRIGGER_RE.search(text)
+    if trigger and any(DIGIT_RE.search(m.group(0)) and not m.group(0).isdigit() for m in FIN_RE.finditer(text)):
+        return True
+
+    if not DIGIT_RE.search(text) and "@" not in text and not trigger:
+        if not has_name(text) and not has_name_like(text):
+            return False
+    return None
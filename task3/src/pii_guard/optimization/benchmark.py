@@ -1,5 +1,6 @@
 ﻿import argparse
 import json
+import sys
 import time
 from pathlib import Path
 
@@ -73,10 +74,90 @@ def bench_onnx_ner(onnx_path: str, tok_dir: str, text: str, n: int) -> float:
     return (t1 - t0) * 1000 / n
 
 
+def load_texts(path: str) -> list:
+    """One text per line (.txt), or .json/.jsonl records with a "text" field."""
+    p = Path(path)
+    raw = p.read_text(encoding="utf-8")
+    if p.suffix == ".txt":
+        return [line.strip() for line in raw.splitlines() if line.strip()]
+    if p.suffix == ".jsonl":
+        rows = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    else:
+        rows = json.loads(raw)
+    return [r["text"] if isinstance(r, dict) else str(r) for r in rows]
+
+
+def bench_cascade_throughput(texts: list, batch_sizes: list, repeats: int) -> dict:
+    from pii_guard.inference.pipeline import PiiCascade
+
+    pipe = PiiCascade()
+    pipe.run_batch(texts[:8])  # warmup
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        loop_results = [pipe.run(t) for t in texts]
+    loop_s = (time.perf_counter() - t0) / repeats
+
+    out = {
+        "texts": len(texts),
+        "shared_tokenizer": pipe.shared_tokenizer,
+        "unsafe_share": round(sum(r.is_unsafe for r in loop_results) / max(1, len(texts)), 3),
+        "per_text_loop": {"texts_per_s": round(len(texts) / loop_s, 1)},
+    }
+    for bs in batch_sizes:
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            batch_results = pipe.run_batch(texts, batch_size=bs)
+        batch_s = (time.perf_counter() - t0) / repeats
+        out[f"run_batch_{bs}"] = {
+            "texts_per_s": round(len(texts) / batch_s, 1),
+            "speedup": round(loop_s / batch_s, 2),
+            # INT8 activation scales are per batch: scores move, decisions and masks must not
+            "decision_mismatches": sum(a.is_unsafe != b.is_unsafe for a, b in zip(loop_results, batch_results)),
+            "masked_text_mismatches": sum(
+                a.masked_text != b.masked_text for a, b in zip(loop_results, batch_results)
+            ),
+            "max_score_diff": round(
+                max((abs(a.guardrail_score - b.guardrail_score) for a, b in zip(loop_results, batch_results)), default=0.0), 6
+            ),
+        }
+    return out
+
+
+def batch_mismatches(throughput: dict) -> dict:
+    """run_batch sizes whose decisions or masks differ from the per-text loop."""
+    return {
+        name: {k: r[k] for k in ("decision_mismatches", "masked_text_mismatches")}
+        for name, r in throughput.items()
+        if name.startswith("run_batch_") and (r["decision_mismatches"] or r["masked_text_mismatches"])
+    }
+
+
+def bench_cascade_run(mode: str, text: str, n: int) -> float:
+    from pii_guard.inference.pipeline import PiiCascade
+
+    pipe = PiiCascade(mode=mode)
+    for _ in range(10):
+        pipe.run(text)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        pipe.run(text)
+    t1 = time.perf_counter()
+    return (t1 - t0) * 1000 / n
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--out", default="reports/benchmarks/bench.json")
     ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--cascade_texts", default=None, help=".txt / .json / .jsonl texts for cascade throughput")
+    ap.add_argument("--batch_sizes", default="8,32,64", help="run_batch sizes compared to the per-text loop")
+    ap.add_argument("--cascade_repeats", type=int, default=3)
+    ap.add_argument(
+        "--allow_batch_mismatch",
+        action="store_true",
+        help="Exit 0 even if run_batch changes decisions / masks vs run",
+    )
     args = ap.parse_args()
 
     out_path = Path(args.out)
@@ -113,10 +194,35 @@ def main() -> None:
         },
     }
 
+    m_q = Path("models/multitask/onnx/model.int8.onnx")
+    if m_q.exists():
+        # one encoder instead of two: compare end-to-end run() and weights on disk
+        results["sizes_mb"]["multitask_onnx_int8"] = file_mb(m_q)
+        results["latency_ms_avg"]["multitask_run_safe"] = bench_cascade_run("multitask", sample_safe, args.n)
+        results["latency_ms_avg"]["multitask_run_unsafe"] = bench_cascade_run("multitask", sample_unsafe, args.n)
+        if c_q.exists() and n_q.exists():
+            results["latency_ms_avg"]["cascade_run_safe"] = bench_cascade_run("cascade", sample_safe, args.n)
+            results["latency_ms_avg"]["cascade_run_unsafe"] = bench_cascade_run("cascade", sample_unsafe, args.n)
+
+    if c_q.exists() and n_q.exists():
+        texts = load_texts(args.cascade_texts) if args.cascade_texts else [sample_safe, sample_unsafe] * 100
+        batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+        results["cascade_throughput"] = bench_cascade_throughput(texts, batch_sizes, args.cascade_repeats)
+
     out_path.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
     print(f"Wrote benchmark report: {out_path}")
     print(json.dumps(results, indent=2, ensure_ascii=False))
 
+    mismatches = batch_mismatches(results.get("cascade_throughput", {}))
+    if mismatches:
+        print(
+            f"ERROR: run_batch disagrees with per-text run: {mismatches}. "
+            "Use smaller batch sizes or run() for these models.",
+            file=sys.stderr,
+        )
+        if not args.allow_batch_mismatch:
+            sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
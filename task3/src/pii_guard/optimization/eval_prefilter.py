@@ -0,0 +1,98 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+from pii_guard.inference.rules import prefilter
+
+
+def load_split(path: Path, split: str) -> list:
+    rows = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                if r.get("split", split) == split:
+                    rows.append(r)
+    return rows
+
+
+def recall_precision(labels: list, preds: list) -> dict:
+    tp = sum(1 for y, p in zip(labels, preds) if y == 1 and p)
+    fn = sum(1 for y, p in zip(labels, preds) if y == 1 and not p)
+    fp = sum(1 for y, p in zip(labels, preds) if y == 0 and p)
+    return {
+        "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+        "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+    }
+
+
+def rules_report(texts: list, labels: list) -> dict:
+    t0 = time.perf_counter()
+    decisions = [prefilter(t) for t in texts]
+    elapsed = time.perf_counter() - t0
+
+    n = len(texts)
+    n_unsafe = sum(labels)
+    ruled_safe = [y for y, d in zip(labels, decisions) if d is False]
+    ruled_unsafe = [y for y, d in zip(labels, decisions) if d is True]
+    return {
+        "texts": n,
+        "skip_rate": round((len(ruled_safe) + len(ruled_unsafe)) / n, 4),
+        "ruled_safe": len(ruled_safe),
+        "ruled_unsafe": len(ruled_unsafe),
+        # UNSAFE texts the rules wave through: recall lost regardless of the model
+        "unsafe_ruled_safe": sum(ruled_safe),
+        "max_recall": round(1 - sum(ruled_safe) / n_unsafe, 4) if n_unsafe else None,
+        "safe_ruled_unsafe": len(ruled_unsafe) - sum(ruled_unsafe),
+        "us_per_text": round(elapsed * 1e6 / n, 2),
+    }
+
+
+def model_report(texts: list, labels: list, batch_size: int) -> dict:
+    from pii_guard.inference.pipeline import PiiCascade
+
+    out = {}
+    for name, use_rules in (("model_only", False), ("with_prefilter", True)):
+        pipe = PiiCascade(prefilter=use_rules)
+        pipe.run_batch(texts[:batch_size], batch_size=batch_size)  # warmup
+        t0 = time.perf_counter()
+        results = pipe.run_batch(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - t0
+        out[name] = {
+            **recall_precision(labels, [r.is_unsafe for r in results]),
+            "texts_per_s": round(len(texts) / elapsed, 1),
+            "classifier_calls_skipped": sum(r.decided_by == "rules" for r in results),
+        }
+    out["speedup"] = round(out["with_prefilter"]["texts_per_s"] / out["model_only"]["texts_per_s"], 2)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default="data/processed/train_classifier.json")
+    ap.add_argument("--split", default="validation")
+    ap.add_argument("--with_model", action="store_true", help="Also run the ONNX cascade with and without stage 0")
+    ap.add_argument("--batch_size", type=int, default=32)
+    ap.add_argument("--out", default="reports/benchmarks/prefilter.json")
+    args = ap.parse_args()
+
+    rows = load_split(Path(args.data), args.split)
+    if not rows:
+        raise RuntimeError(f"No '{args.split}' rows in {args.data}. Run scripts/build_train_classifier_json.py first.")
+    texts = [r["text"] for r in rows]
+    labels = [int(r["label"]) for r in rows]
+
+    report = {"rules": rules_report(texts, labels)}
+    if args.with_model:
+        report["cascade"] = model_report(texts, labels, args.batch_size)
+
+    out_path = Path(args.out)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Wrote prefilter report: {out_path}")
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -25,16 +25,56 @@ def export_one(model_dir: str, out_dir: str, task: str) -> None:
     AutoTokenizer.from_pretrained(model_dir, use_fast=True).save_pretrained(str(out))
 
 
+def export_multitask(model_dir: str, out_dir: str) -> None:
+    """One ONNX graph, inputs input_ids/attention_mask, outputs clf_logits (batch,2) and ner_logits (batch,seq,labels)."""
+    import torch
+
+    from pii_guard.training.train_multitask import MultiTaskPiiModel
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    model = MultiTaskPiiModel.load(model_dir)
+    tok = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+
+    class _Outputs(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, input_ids, attention_mask):
+            o = self.m(input_ids=input_ids, attention_mask=attention_mask)
+            return o["clf_logits"], o["ner_logits"]
+
+    dummy = tok(["Salam, sabah görüşərik."], return_tensors="pt")
+    axes = {0: "batch_size", 1: "sequence_length"}
+    torch.onnx.export(
+        _Outputs(model),
+        (dummy["input_ids"], dummy["attention_mask"]),
+        str(out / "model.onnx"),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["clf_logits", "ner_logits"],
+        dynamic_axes={"input_ids": axes, "attention_mask": axes, "clf_logits": {0: "batch_size"}, "ner_logits": axes},
+        opset_version=14,
+    )
+    tok.save_pretrained(str(out))
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--classifier_pt", default="models/classifier/pytorch")
     ap.add_argument("--ner_pt", default="models/ner/pytorch")
     ap.add_argument("--classifier_out", default="models/classifier/onnx")
     ap.add_argument("--ner_out", default="models/ner/onnx")
+    ap.add_argument("--multitask_pt", default="models/multitask/pytorch")
+    ap.add_argument("--multitask_out", default="models/multitask/onnx")
+    ap.add_argument("--which", choices=["separate", "multitask", "all"], default="separate")
     args = ap.parse_args()
 
-    export_one(args.classifier_pt, args.classifier_out, "text-classification")
-    export_one(args.ner_pt, args.ner_out, "token-classification")
+    if args.which in ("separate", "all"):
+        export_one(args.classifier_pt, args.classifier_out, "text-classification")
+        export_one(args.ner_pt, args.ner_out, "token-classification")
+    if args.which in ("multitask", "all"):
+        export_multitask(args.multitask_pt, args.multitask_out)
     print("✅ ONNX export finished.")
 
 
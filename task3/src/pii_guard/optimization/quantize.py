@@ -19,14 +19,23 @@ def main() -> None:
     ap.add_argument("--ner_onnx", default="models/ner/onnx/model.onnx")
     ap.add_argument("--classifier_out", default="models/classifier/onnx/model.int8.onnx")
     ap.add_argument("--ner_out", default="models/ner/onnx/model.int8.onnx")
+    ap.add_argument("--multitask_onnx", default="models/multitask/onnx/model.onnx")
+    ap.add_argument("--multitask_out", default="models/multitask/onnx/model.int8.onnx")
+    ap.add_argument("--which", choices=["separate", "multitask", "all"], default="separate")
     args = ap.parse_args()
 
-    q_one(Path(args.classifier_onnx), Path(args.classifier_out))
-    q_one(Path(args.ner_onnx), Path(args.ner_out))
+    done = []
+    if args.which in ("separate", "all"):
+        q_one(Path(args.classifier_onnx), Path(args.classifier_out))
+        q_one(Path(args.ner_onnx), Path(args.ner_out))
+        done += [args.classifier_out, args.ner_out]
+    if args.which in ("multitask", "all"):
+        q_one(Path(args.multitask_onnx), Path(args.multitask_out))
+        done.append(args.multitask_out)
 
     print("Quantized:")
-    print(" -", args.classifier_out)
-    print(" -", args.ner_out)
+    for path in done:
+        print(" -", path)
 
 
 if __name__ == "__main__":
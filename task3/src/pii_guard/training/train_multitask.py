@@ -0,0 +1,225 @@
+import argparse
+import inspect
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import evaluate
+from datasets import concatenate_datasets, load_dataset
+from sklearn.metrics import accuracy_score, f1_score
+from torch import nn
+from transformers import AutoModel, AutoTokenizer, Trainer, TrainingArguments
+
+from pii_guard.config import MODELS
+from pii_guard.training.train_ner import ID2LABEL, LABELS, align_labels_with_tokens
+
+
+CONFIG_FILE = "multitask_config.json"
+HEADS_FILE = "heads.pt"
+
+
+class MultiTaskPiiModel(nn.Module):
+    """
+    One transformer encoder, two heads:
+      - clf head on the first token (SAFE / UNSAFE), same shape as DistilBERT's
+        sequence classifier (pre_classifier -> ReLU -> classifier)
+      - ner head on every token (BIO labels of train_ner.LABELS)
+
+    Labels set to -100 are ignored, so a batch can mix classifier-only rows
+    (no token labels) and NER rows.
+    """
+
+    def __init__(self, base: str, num_ner_labels: int = len(LABELS), dropout: float = 0.1):
+        super().__init__()
+        self.base = base
+        self.encoder = AutoModel.from_pretrained(base)
+        dim = self.encoder.config.hidden_size
+        self.dropout = nn.Dropout(dropout)
+        self.pre_classifier = nn.Linear(dim, dim)
+        self.classifier = nn.Linear(dim, 2)
+        self.ner_head = nn.Linear(dim, num_ner_labels)
+
+    def forward(self, input_ids, attention_mask=None, clf_labels=None, ner_labels=None):
+        hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        pooled = self.dropout(torch.relu(self.pre_classifier(hidden[:, 0])))
+        clf_logits = self.classifier(pooled)
+        ner_logits = self.ner_head(self.dropout(hidden))
+
+        out = {"clf_logits": clf_logits, "ner_logits": ner_logits}
+        if clf_labels is not None or ner_labels is not None:
+            ce = nn.CrossEntropyLoss(ignore_index=-100)
+            loss = clf_logits.new_zeros(())
+            if clf_labels is not None and (clf_labels != -100).any():
+                loss = loss + ce(clf_logits, clf_labels)
+            if ner_labels is not None and (ner_labels != -100).any():
+                loss = loss + ce(ner_logits.reshape(-1, ner_logits.shape[-1]), ner_labels.reshape(-1))
+            out = {"loss": loss, **out}
+        return out
+
+    def save(self, out_dir: str) -> None:
+        out = Path(out_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        self.encoder.save_pretrained(str(out / "encoder"))
+        heads = {k: v for k, v in self.state_dict().items() if not k.startswith("encoder.")}
+        torch.save(heads, out / HEADS_FILE)
+        cfg = {"base": self.base, "num_ner_labels": self.ner_head.out_features, "ner_labels": LABELS}
+        (out / CONFIG_FILE).write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, model_dir: str) -> "MultiTaskPiiModel":
+        path = Path(model_dir)
+        cfg = json.loads((path / CONFIG_FILE).read_text(encoding="utf-8"))
+        model = cls(str(path / "encoder"), num_ner_labels=cfg["num_ner_labels"])
+        model.base = cfg["base"]
+        model.load_state_dict(torch.load(path / HEADS_FILE, map_location="cpu"), strict=False)
+        return model.eval()
+
+
+class MultiTaskCollator:
+    def __init__(self, tok):
+        self.tok = tok
+
+    def __call__(self, features: List[Dict]) -> Dict[str, torch.Tensor]:
+        batch = self.tok.pad(
+            [{"input_ids": f["input_ids"], "attention_mask": f["attention_mask"]} for f in features],
+            return_tensors="pt",
+        )
+        width = batch["input_ids"].shape[1]
+        ner = torch.full((len(features), width), -100, dtype=torch.long)
+        for i, f in enumerate(features):
+            labels = f["ner_labels"][:width]
+            ner[i, : len(labels)] = torch.tensor(labels, dtype=torch.long)
+        batch["ner_labels"] = ner
+        batch["clf_labels"] = torch.tensor([f["clf_labels"] for f in features], dtype=torch.long)
+        return batch
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clf_data", default="data/processed/train_classifier.json")
+    ap.add_argument("--ner_data", default="data/synthetic/ner_bio.jsonl")
+    ap.add_argument("--model", default=MODELS.classifier_base)
+    ap.add_argument("--out", default="models/multitask/pytorch")
+    ap.add_argument("--epochs", type=int, default=2)
+    ap.add_argument("--lr", type=float, default=3e-5)
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--max_len", type=int, default=96)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    for p in (args.clf_data, args.ner_data):
+        if not Path(p).exists():
+            raise FileNotFoundError(f"Missing dataset file: {p}. Build the classifier / NER data first.")
+
+    tok = AutoTokenizer.from_pretrained(args.model, use_fast=True)
+
+    # classifier rows: sentence label only
+    clf_all = load_dataset("json", data_files=args.clf_data, split="train")
+
+    def clf_features(batch):
+        enc = tok(batch["text"], truncation=True, max_length=args.max_len)
+        enc["clf_labels"] = batch["label"]
+        enc["ner_labels"] = [[-100] * len(ids) for ids in enc["input_ids"]]
+        return enc
+
+    def clf_split(name: str):
+        ds = clf_all.filter(lambda x: x["split"] == name)
+        return ds.map(clf_features, batched=True, remove_columns=ds.column_names)
+
+    # NER rows: token labels; a text with any entity is also UNSAFE, one without has no sentence label
+    ner_all = load_dataset("json", data_files=args.ner_data, split="train").train_test_split(test_size=0.1, seed=args.seed)
+
+    def ner_features(x):
+        enc = align_labels_with_tokens(tok, x["tokens"], x["tags"])
+        labels = enc.pop("labels")[: args.max_len]
+        return {
+            "input_ids": enc["input_ids"][: args.max_len],
+            "attention_mask": enc["attention_mask"][: args.max_len],
+            "ner_labels": labels,
+            "clf_labels": 1 if any(t != "O" for t in x["tags"]) else -100,
+        }
+
+    def ner_split(name: str):
+        ds = ner_all[name]
+        return ds.map(ner_features, remove_columns=ds.column_names)
+
+    train_ds = concatenate_datasets([clf_split("train"), ner_split("train")]).shuffle(seed=args.seed)
+    val_ds = concatenate_datasets([clf_split("validation"), ner_split("test")])
+
+    model = MultiTaskPiiModel(args.model)
+    seqeval = evaluate.load("seqeval")
+
+    def compute_metrics(p):
+        (clf_logits, ner_logits), (clf_labels, ner_labels) = p.predictions, p.label_ids
+        has_clf = clf_labels != -100
+        clf_preds = clf_logits.argmax(axis=-1)
+        out = {
+            "clf_accuracy": accuracy_score(clf_labels[has_clf], clf_preds[has_clf]),
+            "clf_f1": f1_score(clf_labels[has_clf], clf_preds[has_clf], average="macro"),
+        }
+
+        ner_preds = ner_logits.argmax(axis=-1)
+        true_labels, true_preds = [], []
+        for pred_row, lab_row in zip(ner_preds, ner_labels):
+            keep = lab_row != -100
+            if not keep.any():
+                continue  # classifier-only row
+            true_labels.append([ID2LABEL[int(lb)] for lb in lab_row[keep]])
+            true_preds.append([ID2LABEL[int(pr)] for pr in pred_row[keep]])
+        if true_labels:
+            m = seqeval.compute(predictions=true_preds, references=true_labels)
+            out.update({"ner_precision": m["overall_precision"], "ner_recall": m["overall_recall"], "ner_f1": m["overall_f1"]})
+        # one number for checkpoint selection
+        out["f1"] = (out["clf_f1"] + out.get("ner_f1", out["clf_f1"])) / 2
+        return out
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fp16 = torch.cuda.is_available()
+
+    ta_params = set(inspect.signature(TrainingArguments.__init__).parameters.keys())
+    eval_key = "eval_strategy" if "eval_strategy" in ta_params else "evaluation_strategy"
+
+    tr_kwargs = dict(
+        output_dir=str(out_dir / "_runs"),
+        save_strategy="epoch",
+        logging_strategy="steps",
+        logging_steps=50,
+        learning_rate=args.lr,
+        per_device_train_batch_size=args.batch,
+        per_device_eval_batch_size=args.batch,
+        num_train_epochs=args.epochs,
+        weight_decay=0.01,
+        warmup_ratio=0.05,
+        load_best_model_at_end=True,
+        metric_for_best_model="f1",
+        greater_is_better=True,
+        label_names=["clf_labels", "ner_labels"],
+        remove_unused_columns=False,
+        seed=args.seed,
+        fp16=fp16,
+        report_to="none",
+    )
+    tr_kwargs[eval_key] = "epoch"
+
+    trainer = Trainer(
+        model=model,
+        args=TrainingArguments(**tr_kwargs),
+        train_dataset=train_ds,
+        eval_dataset=val_ds,
+        data_collator=MultiTaskCollator(tok),
+        compute_metrics=compute_metrics,
+    )
+
+    trainer.train()
+    print("Eval:", trainer.evaluate())
+
+    model.save(str(out_dir))
+    tok.save_pretrained(str(out_dir))
+    print(f"Saved multi-task model to: {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
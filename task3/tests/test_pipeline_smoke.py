@@ -1,2 +1,39 @@
-﻿# TODO: smoke test for cascade pipeline
+﻿from pathlib import Path
 
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("transformers")
+
+CLF_ONNX = Path("models/classifier/onnx/model.int8.onnx")
+NER_ONNX = Path("models/ner/onnx/model.int8.onnx")
+
+pytestmark = pytest.mark.skipif(
+    not (CLF_ONNX.exists() and NER_ONNX.exists()), reason="INT8 classifier / NER models not exported"
+)
+
+MIXED_TEXTS = [
+    "Salam.",
+    "Salam, sabah görüşərik.",
+    "Mənim adım Elvin Aliyev, FİN 94FMDDD və telefon +994 50 123 45 67.",
+    "Kart nömrəm 4111 1111 1111 1111, zəhmət olmasa yoxlayın.",
+    "Bu gün hava çox yaxşıdır, axşam parkda gəzməyə çıxacağıq və sonra evə qayıdacağıq.",
+    "Zaur Nəbili ilə danışdım",
+    "ok",
+    "Mənim e-poçtum aysel.m@example.com, ünvanım Bakı şəhəri, Nizami küçəsi 12.",
+]
+
+
+def test_run_batch_matches_run_on_mixed_lengths():
+    from pii_guard.inference.pipeline import PiiCascade
+
+    pipe = PiiCascade()
+    texts = MIXED_TEXTS * 3
+    expected = [pipe.run(t) for t in texts]
+    for batch_size in (1, 4, len(texts)):
+        got = pipe.run_batch(texts, batch_size=batch_size)
+        assert [r.is_unsafe for r in got] == [r.is_unsafe for r in expected]
+        assert [r.masked_text for r in got] == [r.masked_text for r in expected]
+        # per-batch INT8 activation scales: scores may move, but only slightly
+        for a, b in zip(got, expected):
+            assert abs(a.guardrail_score - b.guardrail_score) < 0.05
@@ -0,0 +1,62 @@
+import pytest
+
+from pii_guard.inference.rules import luhn_ok, prefilter
+
+
+@pytest.mark.parametrize(
+    "digits, ok",
+    [
+        ("4111111111111111", True),
+        ("5500005555555559", True),
+        ("4111111111111112", False),
+        ("1234567812345678", False),
+    ],
+)
+def test_luhn_ok(digits, ok):
+    assert luhn_ok(digits) is ok
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Mənim emailim aysel.m@example.com",
+        "Zəng edin: +994 50 123 45 67",
+        "Kart: 4111 1111 1111 1111",
+        "FİN kodum 5ABC12D",
+    ],
+)
+def test_prefilter_unsafe(text):
+    assert prefilter(text) is True
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Bu gün hava çox yaxşıdır.",
+        "Salam, necəsən? İndi gəlirəm.",
+        "sabah görüşərik",
+    ],
+)
+def test_prefilter_safe(text):
+    assert prefilter(text) is False
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # names outside the gazetteer must reach the model
+        "Zaur bu gün gəlmədi.",
+        "Salam Zaur, necəsən?",
+        "Zaur Nəbili ilə danışdım",
+        "ZAUR ƏHMƏDLİ zəng etdi",
+        "Kamran müəllim zəng etdi",
+        "Rəhman Şirinli",
+        # digits or trigger words without a certain pattern
+        "Sifariş 3 günə gələcək",
+        "telefonu itirdim",
+        # Luhn-invalid card-like number
+        "Kart: 4111 1111 1111 1112",
+    ],
+)
+def test_prefilter_ambiguous(text):
+    assert prefilter(text) is None